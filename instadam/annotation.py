@@ -6,16 +6,16 @@ import json
 import datetime as dt
 
 from flask import Blueprint, abort, jsonify, request
-from flask_jwt_extended import (get_jwt_identity, jwt_required)
+from flask_jwt_extended import jwt_required
 
 from instadam.app import db
 from instadam.models.annotation import Annotation
 from instadam.models.image import Image
 from instadam.models.label import Label
-from instadam.models.user import User
 from instadam.utils import construct_msg
 from instadam.utils.get_project import (maybe_get_project,
                                         maybe_get_project_read_only)
+from instadam.utils.user_identification import get_current_user_id
 
 bp = Blueprint('annotation', __name__, url_prefix='/annotation')
 
@@ -45,6 +45,7 @@ def upload_annotation():
     # Validate labels
     labels = req['labels']
     fields_to_check = ['label_id']
+    project_labels = {}
     for label_obj in labels:
         for field_to_check in fields_to_check:
             if field_to_check not in label_obj:
@@ -56,15 +57,14 @@ def upload_annotation():
             abort(
                 400, 'label id %d not in project %s' % (label_id,
                                                         project.project_name))
+        project_labels[label_id] = label
 
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
+    user_id = get_current_user_id()
 
     for label_obj in labels:
         data = str.encode(json.dumps(label_obj))
         label_id = label_obj['label_id']
-        label = Label.query.filter_by(
-            id=label_id, project_id=project.id).first()
+        label = project_labels[label_id]
 
         annotation = Annotation.query.filter_by(
             label_id=label_id, image_id=image.id).first()
@@ -72,12 +72,12 @@ def upload_annotation():
             annotation.data = data
         else:
             annotation = Annotation(
-                data=data, image_id=image.id, label_id=label_id, vector=b'')
+                data=data, image_id=image.id, label_id=label_id, vector=b'',
+                creator_id=user_id)
             project.annotations.append(annotation)
             image.is_annotated = True
             image.annotations.append(annotation)
             label.annotations.append(annotation)
-            user.annotations.append(annotation)
 
             annotation.added_at = dt.datetime.utcnow()
             image.modified_at = dt.datetime.utcnow()
@@ -1,8 +1,11 @@
 import os
+import sqlite3
 
 from flask import Flask
 from flask_jwt_extended import JWTManager
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 from .config import app_config
 
@@ -10,6 +13,15 @@ db = SQLAlchemy()
 jwt = JWTManager()
 
 
+@event.listens_for(Engine, 'connect')
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys, and their ON DELETE CASCADE, unless enabled
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
 def create_app(mode='development'):
     """
     create and configure the app in specific mode
@@ -26,6 +38,9 @@ def create_app(mode='development'):
     db.init_app(app)
     jwt.init_app(app)
 
+    from .utils import request_context
+    request_context.init_app(app)
+
     from . import auth
     app.register_blueprint(auth.bp)
 
@@ -44,6 +59,12 @@ def create_app(mode='development'):
     from . import user
     app.register_blueprint(user.bp)
 
+    from . import job
+    app.register_blueprint(job.bp)
+
+    from . import upload
+    app.register_blueprint(upload.bp)
+
     if not os.path.isdir(app.config['STATIC_STORAGE_DIR']):
         os.mkdir(app.config['STATIC_STORAGE_DIR'])
 
@@ -1,13 +1,19 @@
+import datetime as dt
 from email.utils import parseaddr
 
 from flask import Blueprint, abort, jsonify, request
-from flask_jwt_extended import (create_access_token, get_raw_jwt, jwt_required)
+from flask_jwt_extended import (create_access_token, create_refresh_token,
+                                get_jwt_claims, get_raw_jwt,
+                                jwt_refresh_token_required, jwt_required)
 from sqlalchemy.exc import IntegrityError
 
 from .app import db, jwt
 from .models.revoked_token import RevokedToken
 from .models.user import User
 from .utils import construct_msg
+from .utils.revoked_token_cache import get_revoked_token_cache
+from .utils.user_identification import (is_permission_version_current,
+                                        user_claims)
 
 bp = Blueprint('auth', __name__, url_prefix='')
 
@@ -49,12 +55,48 @@ def email_checking(email):
         abort(400, 'Please enter a valid email address.')
 
 
+def create_tokens(user):
+    """
+    Create a short lived access token and a long lived refresh token. The
+    access token carries the user id, privileges and permission version as
+    custom claims.
+    Args:
+        user -- The user to create the tokens for
+
+    Returns:
+        A dict with the access token and the refresh token
+
+    """
+    return {
+        'access_token': create_access_token(
+            identity=user.username, user_claims=user_claims(user)),
+        'refresh_token': create_refresh_token(
+            identity=user.username, user_claims={'id': user.id})
+    }
+
+
+def revoke_current_token():
+    """
+    Add the token in the request header to the revoked tokens.
+    """
+    raw_jwt = get_raw_jwt()
+    jti = raw_jwt['jti']
+    expires_at = None
+    if 'exp' in raw_jwt:
+        expires_at = dt.datetime.utcfromtimestamp(raw_jwt['exp'])
+    token = RevokedToken(jti=jti, expires_at=expires_at)
+    db.session.add(token)
+    db.session.commit()
+    get_revoked_token_cache().add(jti)
+
+
 @bp.route('/login', methods=['POST'])
 def login():
     """User login endpoint for application
 
     Take POST data as json with userame and password.
-    Return a json web token as access token.
+    Return a short lived json web token as access token and a long lived one as
+    refresh token.
 
     Usage:
         POST /login
@@ -66,9 +108,10 @@ def login():
     user = User.query.filter_by(username=req['username']).first()
     if user is not None:
         if user.verify_password(req['password']):
-            return jsonify(
-                {'access_token': create_access_token(
-                    identity=user.username)}), 201
+            if user.password_needs_rehash():
+                user.set_password(req['password'])
+                db.session.commit()
+            return jsonify(create_tokens(user)), 201
     abort(401, 'User %s not found or incorrect password' % username)
 
 
@@ -77,7 +120,8 @@ def register():
     """User register endpoint for application
 
     Take POST data as json with userame and password.
-    Return a json web token as access token.
+    Return a short lived json web token as access token and a long lived one as
+    refresh token.
 
     Usage:
         POST /register
@@ -101,15 +145,47 @@ def register():
     except IntegrityError:
         db.session.rollback()
         abort(401, 'User/Email already exist')
-    return jsonify(
-        {'access_token': create_access_token(identity=user.username)}), 201
+    return jsonify(create_tokens(user)), 201
+
+
+@bp.route('/refresh', methods=['POST'])
+@jwt_refresh_token_required
+def refresh():
+    """Token refresh endpoint for application
+
+    Take the refresh token in the request header.
+    Return a new json web token as access token, with up to date claims.
+
+    Usage:
+        POST /refresh
+    """
+    user_id = get_jwt_claims().get('id')
+    user = User.query.get(user_id) if user_id is not None else None
+    if user is None:
+        abort(401, 'User not found')
+    return jsonify({
+        'access_token': create_access_token(
+            identity=user.username, user_claims=user_claims(user))
+    }), 201
 
 
 @jwt.token_in_blacklist_loader
 def check_if_token_in_blacklist(decrypted_token):
     jti = decrypted_token['jti']
-    token = RevokedToken.query.filter_by(jti=jti).first()
-    return token is not None
+    return get_revoked_token_cache().is_revoked(jti)
+
+
+@jwt.claims_verification_loader
+def check_if_claims_current(claims):
+    if 'id' not in claims or 'permission_version' not in claims:
+        return False
+    return is_permission_version_current(claims['id'],
+                                         claims['permission_version'])
+
+
+@jwt.claims_verification_failed_loader
+def stale_claims_callback():
+    return jsonify({'msg': 'Token is outdated, please log in again'}), 401
 
 
 @bp.route('/logout', methods=['DELETE'])
@@ -122,8 +198,19 @@ def logout():
     Usage:
         DELETE /logout
     """
-    jti = get_raw_jwt()['jti']
-    token = RevokedToken(jti=jti)
-    db.session.add(token)
-    db.session.commit()
+    revoke_current_token()
     return construct_msg('Logged out'), 200
+
+
+@bp.route('/logout/refresh', methods=['DELETE'])
+@jwt_refresh_token_required
+def logout_refresh():
+    """Refresh token revoking endpoint for application
+
+    Invalidate the refresh token in the request header
+
+    Usage:
+        DELETE /logout/refresh
+    """
+    revoke_current_token()
+    return construct_msg('Refresh token revoked'), 200
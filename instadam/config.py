@@ -1,6 +1,7 @@
 """Config for the server
 """
 
+import datetime as dt
 import os
 
 DATABASE_USERNAME = 'postgres'
@@ -27,6 +28,12 @@ INSTADAM_STORAGE_ROOT_URL = 'static'
 if ('INSTADAM_STORAGE_ROOT_URL' in os.environ
         and os.environ['INSTADAM_STORAGE_ROOT_URL'] is not None):
     INSTADAM_STORAGE_ROOT_URL = os.environ['INSTADAM_STORAGE_ROOT_URL']
+INSTADAM_STORAGE_BACKEND = os.environ.get('INSTADAM_STORAGE_BACKEND', 'local')
+INSTADAM_S3_BUCKET = os.environ.get('INSTADAM_S3_BUCKET', 'instadam')
+INSTADAM_S3_ENDPOINT_URL = os.environ.get('INSTADAM_S3_ENDPOINT_URL')
+INSTADAM_S3_URL = os.environ.get('INSTADAM_S3_URL')
+INSTADAM_ACCEL_REDIRECT_LOCATION = os.environ.get(
+    'INSTADAM_ACCEL_REDIRECT_LOCATION')
 
 
 class Config(object):
@@ -38,17 +45,125 @@ class Config(object):
     MAIL_SERVER = 'smtp.localhost.test'
     MAIL_DEFAULT_SENDER = 'admin@demo.test'
     JWT_BLACKLIST_ENABLED = True
-    JWT_BLACKLIST_TOKEN_CHECKS = ['access']
-    JWT_ACCESS_TOKEN_EXPIRES = False
+    JWT_BLACKLIST_TOKEN_CHECKS = ['access', 'refresh']
+    JWT_ACCESS_TOKEN_EXPIRES = dt.timedelta(minutes=15)
+    JWT_REFRESH_TOKEN_EXPIRES = dt.timedelta(days=30)
+
+    # In-process cache of revoked tokens, see utils/revoked_token_cache.py
+    REVOKED_TOKEN_CACHE_REFRESH_INTERVAL = 5  # seconds
+    REVOKED_TOKEN_BLOOM_BITS = 1 << 20
+    REVOKED_TOKEN_BLOOM_HASHES = 7
+    REVOKED_TOKEN_LRU_SIZE = 1024
+    REVOKED_TOKEN_PRUNE_BATCH_SIZE = 1000
+
+    # Permission cache shared by the worker processes, see
+    # utils/shared_cache.py. Backend is one of 'auto', 'uwsgi', 'local'
+    SHARED_CACHE_BACKEND = 'auto'
+    SHARED_CACHE_NAME = 'instadam'
+    SHARED_CACHE_TIMEOUT = 300  # seconds
+
+    # Password hashing policy, see utils/password.py. Stored hashes computed
+    # with another method or fewer iterations are upgraded on the next login
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256'
+    PASSWORD_HASH_ITERATIONS = 260000
+    # Hashes run at once across the worker processes, keep it below the
+    # number of uWSGI processes. Others wait for a slot this long, then get 503
+    PASSWORD_HASH_SLOTS = 2
+    PASSWORD_HASH_SLOT_TIMEOUT = 0.5  # seconds
+    PASSWORD_HASH_LOCK_DIR = None  # Directory of the slot locks, tmp if None
+
+    # Bulk user import, see utils/user_import.py. manage.py import-users
+    # hashes the passwords in this many processes, the endpoint in the
+    # password hashing slots
+    USER_IMPORT_BATCH_SIZE = 500
+    USER_IMPORT_HASH_PROCESSES = 4
+
+    # On-disk thumbnail cache, see utils/thumbnail.py
+    THUMBNAIL_CACHE_DIR_NAME = 'thumbnails'
+    THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+    THUMBNAIL_MAX_SIZE = 1024
+
+    # Thumbnails generated as images are uploaded, see utils/ingest.py. Sizes
+    # are (size_h, size_w) as requested from the thumbnail endpoint
+    THUMBNAIL_STANDARD_SIZES = [(100, 100), (256, 256)]
+    THUMBNAIL_STANDARD_FORMAT = 'png'
+    THUMBNAIL_INGEST_WORKERS = 2  # 0 to generate on the request thread
+    THUMBNAIL_INGEST_QUEUE_SIZE = 64
+
+    # Zip members are extracted in chunks of this many bytes, see
+    # utils/zip_stream.py
+    ZIP_EXTRACT_CHUNK_SIZE = 1024 * 1024
+    # Number of extracted zip members between progress updates
+    ZIP_EXTRACT_PROGRESS_INTERVAL = 100
+    # Zips with at least this many images are extracted across
+    # ZIP_EXTRACT_PROCESSES worker processes, see utils/zip_extract.py
+    ZIP_EXTRACT_PARALLEL_THRESHOLD = 1000
+    ZIP_EXTRACT_PROCESSES = 4
+    # Number of image rows inserted per statement for zip uploads
+    IMAGE_INSERT_BATCH_SIZE = 1000
+    # Pages of the image listings of a project, see utils/pagination.py
+    IMAGE_PAGE_SIZE = 100
+    IMAGE_PAGE_MAX_SIZE = 1000
+
+    # Resumable uploads, see upload.py. Sessions older than the max age are
+    # pruned by manage.py prune-uploads
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # suggested to clients
+    UPLOAD_MAX_SIZE = 64 * 1024 * 1024 * 1024
+    UPLOAD_SESSION_MAX_AGE = dt.timedelta(days=2)
+
+    # Background jobs, see utils/job_queue.py. Eager jobs run on the
+    # enqueuing thread instead of in the job workers
+    JOB_QUEUE_EAGER = False
+    JOB_WORKERS = 4
+    JOB_POLL_INTERVAL = 1  # seconds
+    JOB_MAX_ATTEMPTS = 3
+    JOB_RETRY_DELAY = 10  # seconds, doubled after each attempt
+    JOB_LEASE_TIMEOUT = 3600  # seconds
+
+    # Content-addressed storage, see utils/content_store.py. Image files are
+    # stored once per content under BLOB_DIR_NAME and shared across projects
+    CONTENT_ADDRESSED_STORAGE = False
+    BLOB_DIR_NAME = 'blobs'
+    BLOB_PRUNE_BATCH_SIZE = 1000
+
+    # Deleted projects are removed in the background, this many images per
+    # transaction
+    PROJECT_DELETE_BATCH_SIZE = 1000
+
+    # Report the number of SQL statements of each request in X-Query-Count
+    QUERY_COUNT_HEADER = False
 
     STATIC_STORAGE_DIR = INSTADAM_STORAGE
     STATIC_STORAGE_URL = INSTADAM_STORAGE_ROOT_URL
+    # Uploads are received in this directory of STATIC_STORAGE_DIR
+    UPLOAD_DIR_NAME = 'uploads'
+
+    # Storage of the image files, see utils/storage.py. Backend is one of
+    # 'local', under STATIC_STORAGE_DIR, or 's3', which requires boto3 and
+    # takes its credentials from the usual AWS environment variables
+    STORAGE_BACKEND = INSTADAM_STORAGE_BACKEND
+    STORAGE_S3_BUCKET = INSTADAM_S3_BUCKET
+    STORAGE_S3_PREFIX = ''
+    STORAGE_S3_ENDPOINT_URL = INSTADAM_S3_ENDPOINT_URL  # None for AWS S3
+    STORAGE_S3_URL = INSTADAM_S3_URL  # Defaults to STATIC_STORAGE_URL
+    # Levels of shard directories of the files of new images in a project, 0
+    # for a flat directory. Existing files are moved by manage.py
+    # shard-storage
+    STORAGE_SHARD_LEVELS = 2
+    STORAGE_SHARD_BATCH_SIZE = 1000
+    # Original images are sent by nginx from this internal location of
+    # STATIC_STORAGE_DIR (see conf.d/instadam.conf), by the app if None. In S3
+    # storage clients are redirected to urls presigned for the expiry instead
+    STORAGE_ACCEL_REDIRECT_LOCATION = INSTADAM_ACCEL_REDIRECT_LOCATION
+    STORAGE_S3_URL_EXPIRY = 300  # seconds
 
 
 class Development(Config):
     """Development config
     """
     DEVELOPMENT = True
+    QUERY_COUNT_HEADER = True
+    JOB_QUEUE_EAGER = True  # The in-memory db can't be shared with workers
 
     SECRET_KEY = 'Some really random string'
     SQLALCHEMY_DATABASE_URI = 'sqlite://'  # In-memory sqlite db
@@ -76,6 +191,11 @@ class Production(Config):
 class Testing(Config):
     """Testing config
     """
+    QUERY_COUNT_HEADER = True
+    SHARED_CACHE_BACKEND = 'local'
+    PASSWORD_HASH_ITERATIONS = 1000
+    THUMBNAIL_INGEST_WORKERS = 0
+    JOB_QUEUE_EAGER = True
     SECRET_KEY = 'Some really random string'
     _SQLALCHEMY_DATABASE_DATABASE = 'travis_ci_test'
     _SQLALCHEMY_DATABASE_HOSTNAME = 'localhost'
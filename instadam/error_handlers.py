@@ -19,4 +19,6 @@ register_error_handler(403)
 register_error_handler(404)
 register_error_handler(405)
 register_error_handler(406)
+register_error_handler(409)
 register_error_handler(415)
+register_error_handler(503)
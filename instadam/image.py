@@ -1,24 +1,38 @@
 """Module related to uploading image
 """
 import base64
-import multiprocessing
+import mimetypes
 import os
 import uuid
-from io import BytesIO
-from zipfile import ZipFile
+from zipfile import BadZipFile, ZipFile
 
-from PIL import Image as PILImage
-from flask import Blueprint, abort, jsonify, request
+from flask import Blueprint, Response, abort, jsonify, request
+from flask import current_app as app
 from flask_jwt_extended import (jwt_required)
+from sqlalchemy import bindparam
 from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import HTTPException
+from werkzeug.formparser import parse_form_data
 
 from instadam.app import db
 from instadam.models.image import Image, VALID_IMG_EXTENSIONS
 from instadam.utils import construct_msg
-from instadam.utils.file import (get_project_dir,
+from instadam.utils.content_store import (HashingWriter, add_blobs, hash_file,
+                                          is_content_addressed)
+from instadam.utils.file import (get_upload_dir,
                                  parse_and_validate_file_extension)
-from instadam.utils.get_project import (maybe_get_project,
-                                        maybe_get_project_read_only)
+from instadam.utils.get_project import (maybe_get_image_read_only,
+                                        maybe_get_project)
+from instadam.utils.ingest import get_thumbnail_ingest, schedule_thumbnails
+from instadam.utils.job_queue import enqueue_job, heartbeat, job_handler
+from instadam.utils.storage import get_storage
+from instadam.utils.thumbnail import (THUMBNAIL_FORMATS, get_image_version,
+                                      get_thumbnail, get_thumbnail_etag,
+                                      normalize_size)
+from instadam.utils.user_identification import get_current_user_id
+from instadam.utils.zip_extract import unzip_process
+from instadam.utils.zip_stream import (ZipStreamError, ZipStreamUnsupported,
+                                       iter_zip_members)
 
 bp = Blueprint('image', __name__, url_prefix='/image')
 
@@ -48,24 +62,204 @@ def upload_image(project_id):
         except IntegrityError:
             db.session.rollback()
             abort(400, 'Failed to add image')
+        schedule_thumbnails(image)
         return construct_msg('Image added successfully'), 200
     else:
         abort(400, 'Missing \'image\' in request')
 
 
-def unzip_process(zip_path, name_map):
-    zip_file = ZipFile(zip_path)
-    for name, hashed_name in name_map.items():
-        image = zip_file.read(name)
-        with open(hashed_name, 'wb') as f:
-            try:
-                f.write(image)
-            except IOError as e:
-                print('Error when saving image from zip:', e)
+@bp.route('/upload/batch/<project_id>', methods=['POST'])
+@jwt_required
+def upload_images(project_id):
+    """
+    Upload many images to a project in one multipart request, each as an
+    `images` file. Files are streamed to disk as they arrive and the images
+    are added in a single transaction.
+
+    Args:
+        project_id: The id of the project
+
+    Returns:
+        The result of each file, in the order of the request, with either the
+        id of the new image or an error
+    """
+    project = maybe_get_project(project_id)
+    upload_dir = get_upload_dir()
+    content_addressed = is_content_addressed()
+
+    def stream_factory(total_content_length, content_type, filename=None,
+                       content_length=None):
+        if not filename or not is_image_name(filename):
+            return open(os.devnull, 'wb')
+        fd = open(os.path.join(upload_dir, '%s.part' % uuid.uuid4()), 'wb+')
+        # Hashed as it arrives, for content-addressed storage
+        return HashingWriter(fd) if content_addressed else fd
+
+    _, _, files = parse_form_data(request.environ,
+                                  stream_factory=stream_factory)
+    for key, file in files.items(multi=True):
+        file.stream.close()
+        if key != 'images' and file.stream.name != os.devnull:
+            os.remove(file.stream.name)
+    files = files.getlist('images')
+    if not files:
+        abort(400, 'Missing \'images\' in request')
+
+    results = []
+    uploaded = []
+    for file in files:
+        results.append({'name': file.filename})
+        if file.stream.name == os.devnull:
+            results[-1]['error'] = 'Invalid file extension'
+        else:
+            uploaded.append(
+                (results[-1], file.stream.name,
+                 file.stream.digest if content_addressed else None))
+
+    images = add_uploaded_images(
+        project, [(result['name'], path, digest)
+                  for result, path, digest in uploaded])
+    for image, (result, _, _) in zip(images, uploaded):
+        result['id'] = image.id
+    if images:
+        enqueue_job(
+            'generate_thumbnails',
+            {'image_ids': [image.id for image in images]},
+            project_id=project.id,
+            created_by=get_current_user_id())
+    return jsonify({'results': results}), 200
+
+
+def is_image_name(name):
+    split = name.lower().split('.')
+    return split and split[-1] in VALID_IMG_EXTENSIONS
+
+
+def _record_extraction(job, extracted, failed):
+    if extracted and is_content_addressed():
+        blobs = add_blobs([(path, digest,
+                            parse_and_validate_file_extension(
+                                image.image_name, VALID_IMG_EXTENSIONS))
+                           for image, path, digest in extracted])
+        table = Image.__table__
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('image_id')).values(
+                ready=True,
+                digest=bindparam('blob_digest'),
+                image_storage_path=bindparam('blob_storage_path'),
+                image_url=bindparam('blob_url')),
+            [{
+                'image_id': image.id,
+                'blob_digest': digest,
+                'blob_storage_path': blobs[digest].storage_path,
+                'blob_url': blobs[digest].url
+            } for image, _, digest in extracted])
+    elif extracted:
+        storage = get_storage()
+        for image, path, _ in extracted:
+            storage.put(image.image_storage_path, path)
+        Image.query.filter(
+            Image.id.in_([image.id for image, _, _ in extracted])).update(
+                {'ready': True}, synchronize_session=False)
+    if failed:
+        # The images of members that can't be extracted will never be ready
+        Image.query.filter(Image.id.in_(
+            [image_id for image_id, _ in failed])).delete(
+                synchronize_session=False)
+        job.failures = (job.failures or []) + [
+            failure for _, failure in failed
+        ]
+    job.progress_done += len(extracted)
+    job.progress_failed += len(failed)
+    heartbeat(job)
+    db.session.commit()
+
+
+@job_handler('extract_zip')
+def extract_zip(job):
+    """
+    Job extracting the images of an uploaded zip, then queuing the generation
+    of their thumbnails. Extracted images are marked ready and the progress
+    of the job is updated as the extraction goes. The images of members that
+    fail are removed, and reported in the failures of the job. The zip is
+    removed once extracted. Members are extracted to the upload directory,
+    then put in the storage. In content-addressed storage mode, they are
+    hashed as they are extracted and stored as blobs.
+
+    Payload:
+        zip_path -- path to the zip file
+        image_ids -- ids of the images, named after their zip member
+    """
+    image_ids = job.payload['image_ids']
+    # Images extracted by a previous attempt are ready already
+    images = db.session.query(Image.id, Image.image_name,
+                              Image.image_storage_path).filter(
+                                  Image.id.in_(image_ids),
+                                  Image.ready.is_(False)).all()
+    job.progress_total = len(image_ids)
+    job.progress_done = len(image_ids) - len(images) - job.progress_failed
+    heartbeat(job)
+    db.session.commit()
+
+    interval = app.config['ZIP_EXTRACT_PROGRESS_INTERVAL']
+    upload_dir = get_upload_dir()
+    by_name = {image.image_name: image for image in images}
+    members = [(image.image_name,
+                os.path.join(upload_dir, '%d.part' % image.id))
+               for image in images]
+    paths = dict(members)
+    # Large zips are extracted across several processes
+    processes = 1
+    if len(members) >= app.config['ZIP_EXTRACT_PARALLEL_THRESHOLD']:
+        processes = app.config['ZIP_EXTRACT_PROCESSES']
+    extracted, failed = [], []
+    for name, error, digest in unzip_process(
+            job.payload['zip_path'], members,
+            app.config['ZIP_EXTRACT_CHUNK_SIZE'], processes, interval,
+            is_content_addressed()):
+        if error is None:
+            extracted.append((by_name[name], paths[name], digest))
+        else:
+            failed.append((by_name[name].id, {'name': name, 'error': error}))
+        if len(extracted) + len(failed) >= interval:
+            _record_extraction(job, extracted, failed)
+            extracted, failed = [], []
+    _record_extraction(job, extracted, failed)
+
     try:
-        os.remove(zip_path)
+        os.remove(job.payload['zip_path'])
     except OSError:
         pass
+    ready_ids = [image_id for image_id, in db.session.query(Image.id).filter(
+        Image.id.in_(image_ids), Image.ready.is_(True))]
+    enqueue_job(
+        'generate_thumbnails', {'image_ids': ready_ids},
+        project_id=job.project_id,
+        created_by=job.created_by)
+
+
+@job_handler('generate_thumbnails')
+def generate_thumbnails(job):
+    """
+    Job generating the standard thumbnails of images.
+
+    Payload:
+        image_ids -- ids of the images
+    """
+    ingest = get_thumbnail_ingest()
+    images = db.session.query(Image.id, Image.project_id,
+                              Image.image_storage_path,
+                              Image.digest).filter(
+                                  Image.id.in_(
+                                      job.payload['image_ids'])).all()
+    job.progress_total = len(job.payload['image_ids'])
+    for image in images:
+        ingest.generate(image.project_id, image.id, image.image_storage_path,
+                        get_image_version(image))
+        job.progress_done += 1
+        heartbeat(job)
+        db.session.commit()
+    db.session.commit()
 
 
 @bp.route('/upload/zip/<project_id>', methods=['POST'])
@@ -74,52 +268,213 @@ def upload_zip(project_id):
     """
     Upload zip file of images to project
 
+    The zip is either sent as the `zip` file of a multipart form, in which case
+    it is extracted in the background once uploaded, or as the raw body of the
+    request with the `application/zip` content type, in which case the images
+    are extracted while the upload is still arriving.
+
     Args:
         project_id -- id of project to upload zip file to
 
     Returns:
         HTTP status code and message of zip file upload
     """
-
-    def filter_condition(name):
-        split = name.lower().split('.')
-        return split and split[-1] in VALID_IMG_EXTENSIONS
-
     project = maybe_get_project(project_id)
-    project_dir = get_project_dir(project)
+    if request.mimetype == 'application/zip':
+        return upload_zip_stream(project)
     if 'zip' in request.files:
         file = request.files['zip']
         extension = parse_and_validate_file_extension(file.filename, {'zip'})
         new_file_name = '%s.%s' % (str(uuid.uuid4()), extension)
-        zip_path = os.path.join(project_dir, new_file_name)
+        zip_path = os.path.join(get_upload_dir(), new_file_name)
         file.save(zip_path)
-        zip_file = ZipFile(zip_path)
-        image_names = zip_file.namelist()
-        name_map = {}
-        for image_name in filter(filter_condition, image_names):
-            if image_name in name_map:
-                continue
-            image = Image(project_id=project.id)
-            image.save_empty_image(image_name)
-            project.images.append(image)
-            try:
-                db.session.add(image)
-                db.session.commit()
-            except IntegrityError:
-                db.session.rollback()
-                abort(400, 'Failed to add image')
-            name_map[image_name] = image.image_storage_path
-
-        zip_file.close()
-        multiprocessing.Process(
-            target=unzip_process, args=(zip_path, name_map)).start()
-        return (
-            construct_msg('Zip uploaded successfully, please wait for unzip'),
-            200)
+        return ingest_zip(project, zip_path)
     else:
         abort(400, 'Missing \'zip\' in request')
 
 
+def ingest_zip(project, zip_path):
+    """
+    Add the images of an uploaded zip to a project, and queue their
+    extraction.
+
+    Args:
+        project -- project to add the images to
+        zip_path -- path to the zip file, in the upload directory
+
+    Raises:
+        400 if the file is not a zip
+
+    Returns:
+        Response with the id of the extraction job
+    """
+    try:
+        with ZipFile(zip_path) as zip_file:
+            # Duplicated names are extracted once, in namelist order
+            image_names = list(
+                dict.fromkeys(filter(is_image_name, zip_file.namelist())))
+    except BadZipFile:
+        os.remove(zip_path)
+        abort(400, 'Invalid zip file')
+
+    images = create_empty_images(project, image_names, ready=False)
+    job = enqueue_job(
+        'extract_zip', {
+            'zip_path': zip_path,
+            'image_ids': [image.id for image in images]
+        },
+        project_id=project.id,
+        created_by=get_current_user_id())
+    return jsonify({
+        'msg': 'Zip uploaded successfully, please wait for unzip',
+        'job_id': job.id
+    }), 200
+
+
+def ingest_image(project, file_name, path):
+    """
+    Add an uploaded image to a project.
+
+    Args:
+        project -- project to add the image to
+        file_name -- original name of the image
+        path -- path to the uploaded file, in the upload directory
+
+    Returns:
+        The transient image with its id
+    """
+    digest = hash_file(path) if is_content_addressed() else None
+    image, = add_uploaded_images(project, [(file_name, path, digest)])
+    schedule_thumbnails(image)
+    return image
+
+
+def add_uploaded_images(project, uploads):
+    """
+    Add uploaded files to a project, and put them in the storage at the
+    storage path of their image. In content-addressed storage mode the files
+    are stored as blobs, shared with the images of the same content.
+
+    Args:
+        project -- project to add the images to
+        uploads -- list of (original name of the image, local path to the
+            uploaded file, hex digest of the file in content-addressed
+            storage mode)
+
+    Raises:
+        400 if the images can't be added
+        415 if the extension of a name is invalid
+
+    Returns:
+        List of the transient images with their ids
+    """
+    names = [name for name, _, _ in uploads]
+    blobs = None
+    try:
+        if is_content_addressed():
+            stored = add_blobs([
+                (path, digest,
+                 parse_and_validate_file_extension(name,
+                                                   VALID_IMG_EXTENSIONS))
+                for name, path, digest in uploads
+            ])
+            blobs = [stored[digest] for _, _, digest in uploads]
+        images = create_empty_images(project, names, blobs=blobs)
+    except HTTPException:
+        for _, path, _ in uploads:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        raise
+    if blobs is None:
+        storage = get_storage()
+        for image, (_, path, _) in zip(images, uploads):
+            storage.put(image.image_storage_path, path)
+    return images
+
+
+def create_empty_images(project, image_names, ready=True, blobs=None):
+    """
+    Insert the images of a zip in batches and commit them.
+
+    Args:
+        project -- project to add the images to
+        image_names -- names of the images
+        ready -- whether the files of the images are already saved
+        blobs -- BlobLocation of each image in content-addressed storage
+            mode
+
+    Raises:
+        400 if the images can't be added
+
+    Returns:
+        List of the transient images with their ids
+    """
+    try:
+        images = Image.bulk_create_empty(
+            project, image_names, app.config['IMAGE_INSERT_BATCH_SIZE'],
+            ready, blobs)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        abort(400, 'Failed to add image')
+    return images
+
+
+def upload_zip_stream(project):
+    """
+    Extract the images of a zip read from the body of the request, streaming
+    each member to disk as it arrives, and put them in the storage. Their
+    thumbnails are generated by a background job.
+
+    Args:
+        project -- project to add the images to
+
+    Raises:
+        400 if the zip is corrupted
+        415 if the layout of the zip doesn't allow streaming it
+    """
+    upload_dir = get_upload_dir()
+    content_addressed = is_content_addressed()
+    paths, digests = {}, {}
+    try:
+        for member in iter_zip_members(request.stream,
+                                       app.config['ZIP_EXTRACT_CHUNK_SIZE']):
+            if member.name in paths or not is_image_name(member.name):
+                continue
+            paths[member.name] = os.path.join(upload_dir,
+                                              '%s.part' % uuid.uuid4())
+            with open(paths[member.name], 'wb') as fd:
+                if content_addressed:
+                    fd = HashingWriter(fd)
+                member.copy_to(fd)
+            if content_addressed:
+                digests[member.name] = fd.digest
+    except (ZipStreamError, IOError) as e:
+        for path in paths.values():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if isinstance(e, ZipStreamUnsupported):
+            abort(415, 'Zip can\'t be streamed (%s), please upload it as '
+                  'a form instead' % e)
+        abort(400, 'Failed to extract zip: %s' % e)
+
+    images = add_uploaded_images(
+        project, [(name, path, digests.get(name))
+                  for name, path in paths.items()])
+    response = {'msg': 'Zip uploaded successfully'}
+    if images:
+        response['job_id'] = enqueue_job(
+            'generate_thumbnails',
+            {'image_ids': [image.id for image in images]},
+            project_id=project.id,
+            created_by=get_current_user_id()).id
+    return jsonify(response), 200
+
+
 @bp.route('/<image_id>')
 @jwt_required
 def get_project_image(image_id):
@@ -130,12 +485,7 @@ def get_project_image(image_id):
         project_id -- id of the project
         image_id -- id of the image to return
     """
-    image = Image.query.filter_by(id=image_id).first()
-    if image is None:
-        abort(404, 'No image found with id=%s' % image_id)
-
-    # We don't actually need the project. Just to check permission
-    maybe_get_project_read_only(image.project_id)
+    image = maybe_get_image_read_only(image_id)
 
     return jsonify({
         'id': image.id,
@@ -145,33 +495,75 @@ def get_project_image(image_id):
     }), 200
 
 
+@bp.route('/<image_id>/original')
+@jwt_required
+def get_original_image(image_id):
+    """
+    Get the original file of the image
+
+    The permissions are checked by the app, which then hands the transfer of
+    the file over: to nginx with `X-Accel-Redirect` when
+    `STORAGE_ACCEL_REDIRECT_LOCATION` is set, to the object store with a
+    redirect to a presigned url in S3 storage, or else to the file wrapper of
+    the server. Range and conditional requests are supported in every case.
+
+    Args:
+        image_id -- id of the image
+    """
+    image = maybe_get_image_read_only(image_id)
+    mimetype = (mimetypes.guess_type(image.image_storage_path)[0]
+                or 'application/octet-stream')
+    response = get_storage().serve(image.image_storage_path, mimetype)
+    response.cache_control.private = True
+    return response
+
+
 @bp.route('/<image_id>/thumbnail')
 @jwt_required
 def get_image_thumbnail(image_id):
     """
     Get the thumbnail of the image
+
+    By default the thumbnail is returned base64 encoded in a json object. With
+    `binary=true` the thumbnail bytes are returned directly, with an `ETag`
+    derived from the stored file of the image so that browsers can cache
+    them, and requests with a matching `If-None-Match` get a 304. There is no
+    `Last-Modified`, since the modification time of the image changes with
+    its annotations while its file doesn't.
+
     Args:
         image_id -- id of the image
-    """
-    image = Image.query.filter_by(id=image_id).first()
-    if image is None:
-        abort(404, 'No image found with id=%s' % image_id)
 
-    # We don't actually need the project. Just to check permission
-    maybe_get_project_read_only(image.project_id)
+    Raises:
+        400 if the size or the format is invalid
+    """
+    image = maybe_get_image_read_only(image_id)
 
-    size_h = int(request.args.get('size_h', 100))
-    size_w = int(request.args.get('size_w', 100))
+    size = normalize_size(
+        request.args.get('size_h', 100), request.args.get('size_w', 100))
+    fmt = request.args.get('format', 'png').lower()
+    if fmt not in THUMBNAIL_FORMATS:
+        abort(400, 'Invalid thumbnail format %s' % fmt)
 
-    img = PILImage.open(image.image_storage_path)
-    img.thumbnail((size_h, size_w), PILImage.ANTIALIAS)
+    if request.args.get('binary', 'false').lower() != 'true':
+        # Rendered thumbnails are cached on disk
+        thumbnail = get_thumbnail(image, size, fmt)
+        base64_str = base64.b64encode(thumbnail).decode('utf-8')
+        return jsonify({
+            'image_id': image.id,
+            'format': fmt,
+            'base64_image': base64_str
+        }), 200
 
-    # Save as bytes
-    buffer = BytesIO()
-    img.save(buffer, format='PNG')
-    base64_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    return jsonify({
-        'image_id': image.id,
-        'format': 'png',
-        'base64_image': base64_str
-    }), 200
+    etag = get_thumbnail_etag(image, size, fmt)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(
+            get_thumbnail(image, size, fmt),
+            mimetype=THUMBNAIL_FORMATS[fmt])
+    response.set_etag(etag)
+    # Authorized content: cache in the browser only, and revalidate each time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,57 @@
+"""Module related to background jobs
+"""
+from flask import Blueprint, abort, jsonify
+from flask_jwt_extended import jwt_required
+
+from instadam.models.job import Job
+from instadam.models.user import PrivilegesEnum
+from instadam.utils.user_identification import (get_current_user_id,
+                                                get_current_user_privileges)
+
+bp = Blueprint('job', __name__, url_prefix='/jobs')
+
+
+@bp.route('/<int:job_id>', methods=['GET'])
+@jwt_required
+def get_job(job_id):
+    """
+    Get the status of a background job. Only the user that started the job
+    and admins can see it.
+
+    Args:
+        job_id -- id of the job
+
+    Raises:
+        401 if the logged in user can't see the job
+        404 if the job does not exist
+    """
+    job = Job.query.get(job_id)
+    if job is None:
+        abort(404, 'Job with id=%s does not exist' % job_id)
+    if (job.created_by != get_current_user_id()
+            and get_current_user_privileges() != PrivilegesEnum.ADMIN):
+        abort(401, 'Logged in user can\'t see this job.')
+
+    error = None
+    if job.error:
+        # Only the exception of the traceback, the rest is for the logs
+        error = job.error.strip().splitlines()[-1]
+
+    return jsonify({
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status.value,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'error': error,
+        'project_id': job.project_id,
+        'progress': {
+            'total': job.progress_total,
+            'done': job.progress_done,
+            'failed': job.progress_failed
+        },
+        'failures': job.failures or [],
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at
+    }), 200
@@ -23,17 +23,20 @@ class Annotation(db.Model):
 
     # TODO: consistency problem - image's project and project_id should be the consistent
     # backref: original_image
-    image_id = db.Column(db.Integer, db.ForeignKey('image.id'))
+    image_id = db.Column(db.Integer,
+                         db.ForeignKey('image.id', ondelete='CASCADE'))
 
     # Since in image model, project_id is nullable, it is illogical to make it non-nullable here
     # backref: project
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
+    project_id = db.Column(db.Integer,
+                           db.ForeignKey('project.id', ondelete='CASCADE'))
 
     # backref: created_by
     creator_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 
     # backref: label
-    label_id = db.Column(db.Integer, db.ForeignKey('label.id'))
+    label_id = db.Column(db.Integer,
+                         db.ForeignKey('label.id', ondelete='CASCADE'))
 
     added_at = db.Column(
         db.DateTime, nullable=False, default=dt.datetime.utcnow)
@@ -0,0 +1,34 @@
+import datetime as dt
+
+from ..app import db
+
+
+class Blob(db.Model):
+    """Class Blob is a database model to represent an image file stored by
+    content
+
+    Specifies the full database schema of the table 'blob'. In
+    content-addressed storage mode, the images with the same content share one
+    file, see utils/content_store.py
+
+    Attributes:
+        digest: hex SHA-256 digest of the content of the file (primary key)
+        size: size of the file in bytes
+        refcount: number of images referencing the file. The file is removed
+            once no image references it
+        storage_path: path to the file
+        url: url path to the static file
+        created_at: datetime that the file is stored at
+    """
+
+    __tablename__ = 'blob'
+    digest = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    storage_path = db.Column(db.String(256), nullable=False)
+    url = db.Column(db.String(256), nullable=False)
+    created_at = db.Column(
+        db.DateTime, nullable=False, default=dt.datetime.utcnow)
+
+    def __repr__(self):
+        return '<Blob %r: %r references>' % (self.digest, self.refcount)
@@ -1,14 +1,20 @@
+import collections
 import datetime as dt
 import os
+import shutil
 import uuid
 
 from flask import abort
 from flask import current_app as app
+from sqlalchemy import bindparam
 from sqlalchemy.orm import relationship
 
 from instadam.models.project import Project
-from instadam.utils.file import (get_project_dir, get_project_static_url,
+from instadam.utils.content_store import (HashingWriter, add_blobs,
+                                          is_content_addressed)
+from instadam.utils.file import (get_upload_dir,
                                  parse_and_validate_file_extension)
+from instadam.utils.storage import get_image_parts, get_storage
 from ..app import db
 
 VALID_IMG_EXTENSIONS = {'png', 'jpg', 'jpeg'}
@@ -25,9 +31,14 @@ class Image(db.Model):
         belongs to
         image_name: string to represent name of image
         added_at: datetime that image was added to the project
+        ready: whether the file of the image is saved. Images of a zip are
+        not ready until extracted, and are left out of the listings
     """
 
     __tablename__ = 'image'
+    # Serves the keyset pagination of the image listings of a project
+    __table_args__ = (
+        db.Index('ix_image_project_id_id', 'project_id', 'id'), )
     id = db.Column(db.Integer, primary_key=True)
     image_name = db.Column(db.String(64), nullable=False)
     image_url = db.Column(db.String(256))
@@ -35,14 +46,21 @@ class Image(db.Model):
     modified_at = db.Column(
         db.DateTime, nullable=False, default=dt.datetime.utcnow)
     is_annotated = db.Column(db.Boolean, nullable=False, default=False)
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'),
+    ready = db.Column(db.Boolean, nullable=False, default=True)
+    digest = db.Column(db.String(64), db.ForeignKey('blob.digest'),
+                       index=True)
+    project_id = db.Column(db.Integer,
+                           db.ForeignKey('project.id', ondelete='CASCADE'),
                            nullable=False)
 
     annotations = relationship('Annotation', backref='original_image',
-                               order_by='Annotation.label_id')
+                               order_by='Annotation.label_id',
+                               cascade='save-update, merge, delete',
+                               passive_deletes=True)
 
     def save_image_to_project(self, img_file):
-        """Saves the image file associated to disk.
+        """Saves the image file associated to disk. In content-addressed
+        storage mode the file is hashed while it is saved and stored as a blob.
 
         Args:
             img_file: Image file get from the request.
@@ -53,27 +71,157 @@ class Image(db.Model):
         project = Project.query.filter_by(id=self.project_id).first()
         if project is None:
             abort(400, 'Project with id %d does not exist.' % self.project_id)
-        project_dir = get_project_dir(project)
-        new_file_name = '%s.%s' % (str(uuid.uuid4()), extension)
-        self.image_name = img_file.filename
-        self.image_storage_path = os.path.join(project_dir, new_file_name)
-        self.image_url = os.path.join(get_project_static_url(project),
-                                      new_file_name)
-        img_file.save(self.image_storage_path)
+        storage = get_storage()
+        self._set_storage_names(img_file.filename, project, storage)
+        # Received locally first, then put in the storage
+        upload_path = os.path.join(get_upload_dir(),
+                                   '%s.part' % uuid.uuid4())
+        try:
+            with open(upload_path, 'wb') as fd:
+                writer = HashingWriter(fd) if is_content_addressed() else fd
+                shutil.copyfileobj(img_file.stream, writer)
+            if not is_content_addressed():
+                storage.put(self.image_storage_path, upload_path)
+                return
+            self._set_blob(
+                add_blobs([(upload_path, writer.digest,
+                            extension)])[writer.digest])
+        finally:
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
 
     def save_empty_image(self, original_file_name):
+        project = Project.query.filter_by(id=self.project_id).first()
+        self._set_storage_names(original_file_name, project, get_storage())
+
+    def _set_storage_names(self, original_file_name, project, storage):
         extension = parse_and_validate_file_extension(original_file_name,
                                                       VALID_IMG_EXTENSIONS)
-        project = Project.query.filter_by(id=self.project_id).first()
-        project_dir = os.path.join(app.config['STATIC_STORAGE_DIR'],
-                                   str(project.id))
-        if not os.path.exists(project_dir):
-            os.mkdir(project_dir)
-        project_url = get_project_static_url(project)
         new_file_name = '%s.%s' % (str(uuid.uuid4()), extension)
+        parts = get_image_parts(project.id, new_file_name,
+                                app.config['STORAGE_SHARD_LEVELS'])
         self.image_name = original_file_name
-        self.image_url = os.path.join(project_url, new_file_name)
-        self.image_storage_path = os.path.join(project_dir, new_file_name)
+        self.image_url = storage.url(*parts)
+        self.image_storage_path = storage.path(*parts)
+
+    def _set_blob(self, blob):
+        self.digest = blob.digest
+        self.image_storage_path = blob.storage_path
+        self.image_url = blob.url
+
+    @classmethod
+    def bulk_create_empty(cls, project, original_file_names, batch_size,
+                          ready=True, blobs=None):
+        """Insert empty images with multi-row statements, without loading
+        them in the session. Names and paths are generated in memory and the
+        ids are fetched with RETURNING where the database supports it. The
+        caller is responsible for committing the session.
+
+        Args:
+            project: Project of the images
+            original_file_names: List of names of the images
+            batch_size: Number of rows inserted per statement
+            ready: Whether the files of the images are already saved
+            blobs: BlobLocation of each image in content-addressed storage
+                mode, instead of a new file in the project directory
+
+        Returns:
+            List of transient Image with their ids, in the same order
+        """
+        storage = get_storage()
+        now = dt.datetime.utcnow()
+        images = []
+        for i, original_file_name in enumerate(original_file_names):
+            image = cls(project_id=project.id, modified_at=now,
+                        is_annotated=False, ready=ready)
+            image._set_storage_names(original_file_name, project, storage)
+            if blobs is not None:
+                image._set_blob(blobs[i])
+            images.append(image)
+
+        table = cls.__table__
+        columns = [column.name for column in table.columns
+                   if column.name != 'id']
+        returning = db.session.get_bind().dialect.implicit_returning
+        for start in range(0, len(images), batch_size):
+            batch = images[start:start + batch_size]
+            rows = [{column: getattr(image, column) for column in columns}
+                    for image in batch]
+            # Rows are mapped to their ids by name and storage path. Images
+            # sharing both share a blob, and are identical apart from the id
+            if returning:
+                inserted = db.session.execute(
+                    table.insert().values(rows).returning(
+                        table.c.image_name, table.c.image_storage_path,
+                        table.c.id)).fetchall()
+            else:
+                last_id = db.session.query(db.func.max(cls.id)).scalar()
+                db.session.execute(table.insert().values(rows))
+                inserted = db.session.query(
+                    cls.image_name, cls.image_storage_path, cls.id).filter(
+                    cls.id > (last_id or 0),
+                    cls.image_storage_path.in_(
+                        [image.image_storage_path for image in batch]))
+            id_map = collections.defaultdict(list)
+            for image_name, image_storage_path, image_id in inserted:
+                id_map[image_name, image_storage_path].append(image_id)
+            for image in batch:
+                image.id = id_map[image.image_name,
+                                  image.image_storage_path].pop()
+        return images
+
+    @classmethod
+    def shard_storage(cls, levels, batch_size):
+        """Move the files of the images to the shard directories of their
+        project, and update their paths and urls. Images are processed in
+        batches of ids, committed one at a time, so the migration can be
+        interrupted and run again. Files stored as blobs are left alone.
+
+        Args:
+            levels: Number of levels of shard directories
+            batch_size: Number of images updated per statement
+
+        Returns:
+            Number of images moved
+        """
+        storage = get_storage()
+        update = cls.__table__.update().where(
+            cls.id == bindparam('image_id')).values(
+                image_storage_path=bindparam('new_storage_path'),
+                image_url=bindparam('new_url'))
+        moved = 0
+        last_id = 0
+        while True:
+            batch = db.session.query(
+                cls.id, cls.project_id, cls.image_storage_path).filter(
+                cls.id > last_id, cls.digest.is_(None),
+                cls.image_storage_path.isnot(None)).order_by(
+                cls.id).limit(batch_size).all()
+            if not batch:
+                return moved
+            last_id = batch[-1].id
+            rows = []
+            for image_id, project_id, storage_path in batch:
+                parts = get_image_parts(project_id,
+                                        os.path.basename(storage_path), levels)
+                new_storage_path = storage.path(*parts)
+                if new_storage_path == storage_path:
+                    continue
+                # The file is moved already if the batch was interrupted
+                # before committing
+                if storage.stat(storage_path) is not None:
+                    storage.move(storage_path, new_storage_path)
+                elif storage.stat(new_storage_path) is None:
+                    continue
+                rows.append({
+                    'image_id': image_id,
+                    'new_storage_path': new_storage_path,
+                    'new_url': storage.url(*parts)
+                })
+            if rows:
+                db.session.execute(update, rows)
+            db.session.commit()
+            moved += len(rows)
 
     def __repr__(self):
         return '<Image: %r>' % self.image_name
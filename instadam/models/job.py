@@ -0,0 +1,80 @@
+import datetime as dt
+import enum
+
+from ..app import db
+
+
+class JobStatusEnum(enum.Enum):
+    """Class JobStatusEnum is an enum structure to represent the status of a
+    background job
+
+    A job is QUEUED until a worker claims it, RUNNING while the worker runs
+    it, and QUEUED again if it failed and is retried later. It ends up either
+    SUCCEEDED or FAILED once it ran out of attempts.
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+
+class Job(db.Model):
+    """Class Job is a database model to represent a background job
+
+    Specifies the full database schema of the table 'job'. The table is the
+    queue the job workers poll, see utils/job_queue.py
+
+    Attributes:
+        id: unique integer id given to a job (primary key)
+        kind: name of the handler that runs the job
+        payload: json arguments of the handler
+        status: enum type that specifies the status of the job
+        attempts: number of times a worker started the job
+        max_attempts: number of attempts after which the job fails
+        error: error of the last failed attempt
+        run_at: datetime before which the job is not run, used to delay
+            retries
+        locked_by: name of the worker running the job
+        locked_at: datetime the worker claimed the job. Running jobs claimed
+            too long ago are assumed lost and are claimed again
+        created_by: integer id of the user that started the job
+        project_id: integer id of the project the job works on
+        progress_total: number of items the job works on
+        progress_done: number of items done successfully
+        progress_failed: number of items that failed
+        failures: json list of the items that failed, with their error
+        created_at: datetime that the job is created at
+        started_at: datetime the last attempt started at
+        finished_at: datetime the job succeeded or failed at
+    """
+
+    __tablename__ = 'job'
+    __table_args__ = (db.Index('ix_job_status_run_at', 'status', 'run_at'), )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    status = db.Column(
+        db.Enum(JobStatusEnum), nullable=False, default=JobStatusEnum.QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    error = db.Column(db.Text)
+    run_at = db.Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+    locked_by = db.Column(db.String(64))
+    locked_at = db.Column(db.DateTime)
+
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    # Jobs outlive their project, to report how they ended
+    project_id = db.Column(db.Integer,
+                           db.ForeignKey('project.id', ondelete='SET NULL'))
+    progress_total = db.Column(db.Integer, nullable=False, default=0)
+    progress_done = db.Column(db.Integer, nullable=False, default=0)
+    progress_failed = db.Column(db.Integer, nullable=False, default=0)
+    failures = db.Column(db.JSON)
+    created_at = db.Column(
+        db.DateTime, nullable=False, default=dt.datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return '<Job %r: %r>' % (self.kind, self.status)
@@ -18,9 +18,12 @@ class Label(db.Model):
     label_name = db.Column(db.String(64), nullable=False)
     label_color = db.Column(db.String(7), default="#E84A27")
     # backref: project
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
+    project_id = db.Column(db.Integer,
+                           db.ForeignKey('project.id', ondelete='CASCADE'))
 
-    annotations = relationship("Annotation", backref="label")
+    annotations = relationship(
+        "Annotation", backref="label", cascade='save-update, merge, delete',
+        passive_deletes=True)
 
     def __repr__(self):
         return '<Label %r>' % self.label_name
@@ -14,6 +14,8 @@ class Project(db.Model):
         project_name: unique string that represents name of the project
         created_by: integer to represent id of user who created project
         created_at: datetime to represent date at which project was created
+        deleted_at: datetime the project was deleted at. Deleted projects are
+            hidden right away, and removed by a background job
     """
 
     __tablename__ = 'project'
@@ -24,14 +26,21 @@ class Project(db.Model):
         db.DateTime, nullable=False, default=dt.datetime.utcnow)
     modified_at = db.Column(
         db.DateTime, nullable=False, default=dt.datetime.utcnow)
+    deleted_at = db.Column(db.DateTime)
 
-    images = relationship('Image', backref='project', cascade='delete')
+    # Children are deleted by the ON DELETE CASCADE of their foreign keys,
+    # without being loaded
+    images = relationship(
+        'Image', backref='project', cascade='delete', passive_deletes=True)
     permissions = relationship(
-        'ProjectPermission', back_populates='project', cascade='delete')
+        'ProjectPermission', back_populates='project', cascade='delete',
+        passive_deletes=True)
     annotations = relationship(
-        'Annotation', backref='project', cascade='delete')
+        'Annotation', backref='project', cascade='delete',
+        passive_deletes=True)
 
-    labels = relationship("Label", backref="project", cascade='delete')
+    labels = relationship(
+        "Label", backref="project", cascade='delete', passive_deletes=True)
 
     def __repr__(self):
         return '<Project: %r>' % self.project_name
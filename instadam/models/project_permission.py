@@ -30,14 +30,20 @@ class ProjectPermission(db.Model):
         project_id: integer project id of permission entry
         user_id: integer user id that has access to project with project_id
         access_type: enum type that specifies the level of access
+
+    A user has at most one permission entry per project, enforced by a unique
+    index on (user_id, project_id) that also serves the permission lookups.
     """
 
     __tablename__ = 'project_permission'
+    __table_args__ = (db.UniqueConstraint(
+        'user_id', 'project_id', name='uq_project_permission_user_project'), )
     id = db.Column(db.Integer, primary_key=True)
     access_type = db.Column(db.Enum(AccessTypeEnum), nullable=False)
 
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
+    project_id = db.Column(db.Integer,
+                           db.ForeignKey('project.id', ondelete='CASCADE'))
     user = relationship('User', back_populates='project_permissions')
     project = relationship('Project', back_populates='permissions')
 
@@ -1,10 +1,48 @@
+import datetime as dt
+
 from ..app import db
 
 
 class RevokedToken(db.Model):
+    """Class RevokedToken is a database model to represent a revoked token
+
+    Specifies the full database schema of the table 'invoken_token'
+
+    Attributes:
+        id: unique integer id given to a revoked token (primary key)
+        jti: unique identifier of the revoked token
+        expires_at: datetime after which the token is expired anyway, and the
+            entry can be pruned. Null for tokens that never expire
+    """
+
     __tablename__ = 'invoken_token'
     id = db.Column(db.Integer, primary_key=True)
     jti = db.Column(db.String(128), unique=True, nullable=False)
+    expires_at = db.Column(db.DateTime, index=True)
+
+    @classmethod
+    def prune_expired(cls, batch_size, now=None):
+        """Delete expired entries in batches of at most `batch_size` rows.
+
+        Args:
+            batch_size: Maximum number of rows deleted per transaction
+            now: Reference time, defaults to the current UTC time
+
+        Returns:
+            Number of deleted rows
+        """
+        if now is None:
+            now = dt.datetime.utcnow()
+        deleted = 0
+        while True:
+            expired_ids = db.session.query(cls.id).filter(
+                cls.expires_at < now).limit(batch_size).subquery()
+            count = cls.query.filter(cls.id.in_(expired_ids)).delete(
+                synchronize_session=False)
+            db.session.commit()
+            deleted += count
+            if count < batch_size:
+                return deleted
 
     def __repr__(self):
         return self.jti
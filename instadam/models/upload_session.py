@@ -0,0 +1,75 @@
+import datetime as dt
+import os
+
+from ..app import db
+
+
+class UploadSession(db.Model):
+    """Class UploadSession is a database model to represent a resumable
+    upload
+
+    Specifies the full database schema of the table 'upload_session'. The file
+    is written chunk by chunk to a partial file in the upload directory, and
+    the size of that file is the offset the upload resumes from.
+
+    Attributes:
+        id: unique random token identifying the session (primary key)
+        project_id: integer id of the project the file is uploaded to
+        created_by: integer id of the user uploading the file
+        file_name: original name of the uploaded file
+        size: total size of the file in bytes
+        partial_path: path to the partial file
+        created_at: datetime that the session is created at
+    """
+
+    __tablename__ = 'upload_session'
+    id = db.Column(db.String(36), primary_key=True)
+    project_id = db.Column(db.Integer,
+                           db.ForeignKey('project.id', ondelete='CASCADE'),
+                           nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'),
+                           nullable=False)
+    file_name = db.Column(db.String(256), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    partial_path = db.Column(db.String(256), nullable=False)
+    created_at = db.Column(
+        db.DateTime, nullable=False, default=dt.datetime.utcnow, index=True)
+
+    @property
+    def offset(self):
+        """Number of bytes received so far"""
+        try:
+            return os.path.getsize(self.partial_path)
+        except OSError:
+            return 0
+
+    def discard(self):
+        """Remove the partial file and delete the session. The caller is
+        responsible for committing the session."""
+        try:
+            os.remove(self.partial_path)
+        except OSError:
+            pass
+        db.session.delete(self)
+
+    @classmethod
+    def prune_expired(cls, max_age, now=None):
+        """Discard the sessions created more than `max_age` ago.
+
+        Args:
+            max_age: timedelta after which a session is abandoned
+            now: Reference time, defaults to the current UTC time
+
+        Returns:
+            Number of discarded sessions
+        """
+        if now is None:
+            now = dt.datetime.utcnow()
+        sessions = cls.query.filter(cls.created_at < now - max_age).all()
+        for session in sessions:
+            session.discard()
+        db.session.commit()
+        return len(sessions)
+
+    def __repr__(self):
+        return '<Upload of %r: %r>' % (self.file_name, self.id)
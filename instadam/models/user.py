@@ -2,10 +2,10 @@ import datetime as dt
 import enum
 
 from sqlalchemy.orm import relationship
-from werkzeug.security import check_password_hash, generate_password_hash
 
 
 from ..app import db
+from ..utils.password import hash_password, needs_rehash, verify_password
 
 from ..models.message import Message
 
@@ -36,6 +36,9 @@ class User(db.Model):
         created_at: datetime that specifies when user signed up
         updated_at: datetime that specifies 
         privileges: enum type that specifies permission level of user
+        permission_version: integer bumped whenever the identity or privileges
+                    of the user change, so that the claims in tokens issued
+                    before are rejected
     """
 
     __tablename__ = 'user'
@@ -51,6 +54,7 @@ class User(db.Model):
         db.Enum(PrivilegesEnum),
         nullable=False,
         default=PrivilegesEnum.ADMIN)
+    permission_version = db.Column(db.Integer, nullable=False, default=0)
 
     project_permissions = relationship('ProjectPermission',
                                        back_populates='user')
@@ -67,13 +71,20 @@ class User(db.Model):
         """
         Set password to a hashed password
         """
-        self.password = generate_password_hash(password)
+        self.password = hash_password(password)
 
     def verify_password(self, password):
         """
         Check if hashed password matches actual password
         """
-        return check_password_hash(self.password, password)
+        return verify_password(self.password, password)
+
+    def password_needs_rehash(self):
+        """
+        Check if the password was hashed with a weaker policy than the
+        configured one
+        """
+        return needs_rehash(self.password)
 
     def __repr__(self):
         return '<User %r>' % self.username
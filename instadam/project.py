@@ -1,20 +1,29 @@
-import os
-import shutil
+import datetime as dt
 from string import hexdigits
 
 from flask import Blueprint, abort, jsonify, request
 from flask import current_app as app
-from flask_jwt_extended import get_jwt_identity, jwt_required
+from flask_jwt_extended import jwt_required
 from sqlalchemy.exc import DatabaseError, IntegrityError
 
 from instadam.models.image import Image
 from instadam.models.label import Label
 from instadam.models.project_permission import AccessTypeEnum, ProjectPermission
+from instadam.models.upload_session import UploadSession
 from instadam.models.user import PrivilegesEnum, User
 from instadam.utils import check_json, construct_msg
+from instadam.utils.content_store import release_blobs
 from instadam.utils.get_project import (maybe_get_project,
                                         maybe_get_project_read_only)
-from instadam.utils.user_identification import check_user_admin_privilege
+from instadam.utils.job_queue import enqueue_job, heartbeat, job_handler
+from instadam.utils.pagination import list_images
+from instadam.utils.request_context import get_request_context
+from instadam.utils.shared_cache import invalidate_permission_cache
+from instadam.utils.storage import get_storage
+from instadam.utils.thumbnail import get_thumbnail_cache
+from instadam.utils.user_identification import (check_user_admin_privilege,
+                                                get_current_user_id,
+                                                get_current_user_privileges)
 from .app import db
 from .models.project import Project
 
@@ -29,9 +38,8 @@ bp = Blueprint('project', __name__, url_prefix='')
 def create_project():
     """ Create a new project by the user currently signed in
 
-    Create a new project entry in the database and a new folder in the
-    filesystem
-    to hold image dataset upon receiving a `POST`request to the `/project` entry
+    Create a new project entry in the database, whose image dataset is kept
+    in the storage, upon receiving a `POST`request to the `/project` entry
     point. User must be signed in as an ADMIN and must provide a `project name`
     to create a new project.
 
@@ -53,11 +61,10 @@ def create_project():
     check_json(req, ['project_name'])
 
     # check user identity and privilege
-    identity = get_jwt_identity()
-    user = check_user_admin_privilege(identity)
+    check_user_admin_privilege()
 
     project_name = req['project_name']
-    user_id = user.id
+    user_id = get_current_user_id()
     project = Project(project_name=project_name, created_by=user_id)
 
     try:
@@ -75,7 +82,6 @@ def create_project():
             access_type=AccessTypeEnum.READ_WRITE,
             user_id=user_id,
             project_id=project.id)
-        user.project_permissions.append(project_permission)
         project.permissions.append(project_permission)
         try:
             db.session.add(project_permission)
@@ -85,12 +91,6 @@ def create_project():
 
     db.session.commit()
 
-    # create project directory
-    project_dir = os.path.join(app.config['STATIC_STORAGE_DIR'],
-                               str(project.id))
-    if not os.path.exists(project_dir):
-        os.makedirs(project_dir)
-
     return jsonify({
         'msg': 'project added successfully',
         'project_id': project.id
@@ -111,18 +111,22 @@ def get_projects():
         },
     """
 
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
+    is_admin_user = get_current_user_privileges() == PrivilegesEnum.ADMIN
+    permissions = db.session.query(
+        Project.id, Project.project_name, ProjectPermission.access_type).join(
+        ProjectPermission.project).filter(
+        ProjectPermission.user_id == get_current_user_id(),
+        Project.deleted_at.is_(None)).order_by(
+        ProjectPermission.id)
     projects = []
-    for project_permission in user.project_permissions:
+    for project_id, project_name, access_type in permissions:
         project_dict = {
             'id':
-            project_permission.project.id,
+            project_id,
             'name':
-            project_permission.project.project_name,
+            project_name,
             'is_admin':
-            (user.privileges == PrivilegesEnum.ADMIN and
-             project_permission.access_type == AccessTypeEnum.READ_WRITE)
+            (is_admin_user and access_type == AccessTypeEnum.READ_WRITE)
         }
         projects.append(project_dict)
     return jsonify(projects), 200
@@ -138,51 +142,53 @@ def get_unannotated_images(project_id):
     Args:
         project_id -- ID of the project
 
+    Query parameters, see utils/pagination.py:
+        fields -- comma separated fields of the images, among id, name, path,
+            project_id, is_annotated and modified_at
+        sort -- id, name or modified_at, prefixed with - to sort in
+            descending order [default: id]
+        limit -- number of images per page [default: IMAGE_PAGE_SIZE]
+        cursor -- next_cursor of the previous page
+
+    Raises:
+        400 if a query parameter is invalid
+
     Returns:
-        200 and a json object --
+        200 and a json object, with the cursor of the next page or null --
         {
             "unannotated_images": [
                 {
                     "id": 1,
-                    "is_annotated": false,
                     "name": "cf3179a2-6e0e-4dd8-938f-85e4147103ce.png",
                     "path": "static/1/cf3179a2-6e0e-4dd8-938f-85e4147103ce.png",
                     "project_id": 1
                 },
-            ]
+            ],
+            "next_cursor": "WzEsIDFd"
         }
     """
 
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
-
-    project_exists = Project.query.filter_by(id=project_id).first()
-    if project_exists is None:
-        abort(404, 'Project with id=%s does not exist' % (project_id))
-
-    has_permission = ProjectPermission.query.filter_by(
-        user_id=user.id, project_id=project_id).first()
-    if has_permission is None:
+    access_type = get_request_context().get_access_type(project_id)
+    if access_type is None:
+        project_exists = Project.query.filter_by(
+            id=project_id, deleted_at=None).first()
+        if project_exists is None:
+            abort(404, 'Project with id=%s does not exist' % (project_id))
         abort(
             401,
             'User does not have the privilege to view the unannotated images '
             'of project with id=%s' % (project_id))
 
-    unannotated_images = Image.query.filter_by(
-        is_annotated=False, project_id=project_id).all()
-    if not unannotated_images:
-        return jsonify({'unannotated_images': []}), 200
-
-    unannotated_images_res = []
-    for unannotated_image in unannotated_images:
-        unannotated_image_res = {}
-        unannotated_image_res['id'] = unannotated_image.id
-        unannotated_image_res['name'] = unannotated_image.image_name
-        unannotated_image_res['path'] = unannotated_image.image_url
-        unannotated_image_res['project_id'] = unannotated_image.project_id
-        unannotated_images_res.append(unannotated_image_res)
-
-    return jsonify({'unannotated_images': unannotated_images_res}), 200
+    unannotated_images, next_cursor = list_images(
+        [
+            Image.project_id == project_id,
+            Image.is_annotated.is_(False),
+            Image.ready.is_(True)
+        ], ['id', 'name', 'path', 'project_id'])
+    return jsonify({
+        'unannotated_images': unannotated_images,
+        'next_cursor': next_cursor
+    }), 200
 
 
 @bp.route('/projects/<project_id>/images')
@@ -194,8 +200,19 @@ def get_project_images(project_id):
     Args:
         project_id -- The id of the project
 
+    Query parameters, see utils/pagination.py:
+        fields -- comma separated fields of the images, among id, name, path,
+            project_id, is_annotated and modified_at
+        sort -- id, name or modified_at, prefixed with - to sort in
+            descending order [default: id]
+        limit -- number of images per page [default: IMAGE_PAGE_SIZE]
+        cursor -- next_cursor of the previous page
+
+    Raises:
+        400 if a query parameter is invalid
+
     Returns:
-        200 and a json object --
+        200 and a json object, with the cursor of the next page or null --
         {
             "project_images": [
                 {
@@ -205,40 +222,29 @@ def get_project_images(project_id):
                     "path": "static/1/cf3179a2-6e0e-4dd8-938f-85e4147103ce.png",
                     "project_id": 1
                 },
-            ]
+            ],
+            "next_cursor": "WzEsIDFd"
         }
     """
 
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
-
-    project_exists = Project.query.filter_by(id=project_id).first()
-    if project_exists is None:
-        abort(404, 'Project with id=%s does not exist' % (project_id))
-
-    has_permission = ProjectPermission.query.filter_by(
-        user_id=user.id, project_id=project_id).first()
-    if has_permission is None:
+    access_type = get_request_context().get_access_type(project_id)
+    if access_type is None:
+        project_exists = Project.query.filter_by(
+            id=project_id, deleted_at=None).first()
+        if project_exists is None:
+            abort(404, 'Project with id=%s does not exist' % (project_id))
         abort(
             401,
             'User does not have the privilege to view the images of project '
             'with id=%s' % project_id)
 
-    project_images = Image.query.filter_by(project_id=project_id).all()
-    if not project_images:
-        return jsonify({'project_images': []}), 200
-
-    project_images_res = []
-    for project_image in project_images:
-        project_image_res = dict()
-        project_image_res['id'] = project_image.id
-        project_image_res['name'] = project_image.image_name
-        project_image_res['path'] = project_image.image_url
-        project_image_res['project_id'] = project_image.project_id
-        project_image_res['is_annotated'] = project_image.is_annotated
-        project_images_res.append(project_image_res)
-
-    return jsonify({'project_images': project_images_res}), 200
+    project_images, next_cursor = list_images(
+        [Image.project_id == project_id, Image.ready.is_(True)],
+        ['id', 'name', 'path', 'project_id', 'is_annotated'])
+    return jsonify({
+        'project_images': project_images,
+        'next_cursor': next_cursor
+    }), 200
 
 
 @bp.route('/project/<project_id>/labels', methods=['POST'])
@@ -380,6 +386,7 @@ def update_user_permission(project_id):
     if permission is not None:
         permission.access_type = access_type
         db.session.commit()
+        invalidate_permission_cache()
         return construct_msg('Permission updated successfully'), 200
 
     new_permission = ProjectPermission(access_type=access_type)
@@ -391,6 +398,7 @@ def update_user_permission(project_id):
     except IntegrityError:
         db.session.rollback()
         abort(400, 'Update permission failed.')
+    invalidate_permission_cache()
 
     return construct_msg('Permission added successfully'), 201
 
@@ -428,13 +436,10 @@ def request_permission(project_id):
     req = request.get_json()
     check_json(req, ['message_type'])  # check missing keys
 
-    project = Project.query.filter_by(id=project_id).first()
+    project = Project.query.filter_by(id=project_id, deleted_at=None).first()
     if project is None:
         abort(404, 'Project with id=%s does not exist' % project_id)
 
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
-
     map_code_to_message_type = {
         'r': MessageTypeEnum.READ_ONLY_PERMISSION_REQUEST,
         'rw': MessageTypeEnum.READ_WRITE_PERMISSION_REQUEST,
@@ -450,10 +455,9 @@ def request_permission(project_id):
         if permission.access_type == AccessTypeEnum.READ_WRITE:
             admins.append(permission.user)
 
-    message = Message(type=message_type)
+    message = Message(type=message_type, sender_id=get_current_user_id())
     try:
         db.session.add(message)
-        user.sent_messages.append(message)
         for admin in admins:
             admin.received_messages.append(message)
         db.session.commit()
@@ -470,6 +474,10 @@ def delete_project(project_id):
     """
     Delete a project with specified project id. Doesn't require a body
 
+    The project is marked deleted and hidden from every listing right away,
+    and its images, files and other rows are removed by a background job.
+    The name of the project is taken until the job is done.
+
     Args:
         project_id -- The ID of the project
 
@@ -480,19 +488,76 @@ def delete_project(project_id):
             access)
 
     Returns:
-        200 and a json object --
+        200 and a json object, with the id of the job removing the project --
         {
-            'msg': 'Project deleted successfully'
+            'msg': 'Project deleted successfully',
+            'job_id': 1
         }
     """
     project = maybe_get_project(project_id)  # check privilege and get project
-    # Delete the whole image directory
-    shutil.rmtree(
-        os.path.join(app.config['STATIC_STORAGE_DIR'], str(project.id)))
-    db.session.delete(project)
+    project_id = project.id
+    project.deleted_at = dt.datetime.utcnow()
     db.session.commit()
+    invalidate_permission_cache()
 
-    return construct_msg('Project deleted successfully'), 200
+    job = enqueue_job(
+        'delete_project', {'project_id': project_id},
+        project_id=project_id,
+        created_by=get_current_user_id())
+    return jsonify({
+        'msg': 'Project deleted successfully',
+        'job_id': job.id
+    }), 200
+
+
+@job_handler('delete_project')
+def purge_project(job):
+    """
+    Job removing a deleted project, a batch of images per transaction so that
+    none holds its locks for long. The rows of the images of a batch, and
+    their annotations by cascade, are deleted together with their references
+    to shared blobs, then their files are removed. The labels, permissions
+    and uploads of the project go last, by cascade of the project itself.
+    Progress counts the removed images.
+
+    Payload:
+        project_id -- id of the deleted project
+    """
+    project_id = job.payload['project_id']
+    batch_size = app.config['PROJECT_DELETE_BATCH_SIZE']
+    storage = get_storage()
+    # Images removed by a previous attempt are counted already
+    job.progress_total = job.progress_done + Image.query.filter_by(
+        project_id=project_id).count()
+    db.session.commit()
+
+    while True:
+        images = db.session.query(
+            Image.id, Image.image_storage_path, Image.digest).filter(
+            Image.project_id == project_id).order_by(
+            Image.id).limit(batch_size).all()
+        if not images:
+            break
+        image_ids = [image.id for image in images]
+        Image.query.filter(Image.id.in_(image_ids)).delete(
+            synchronize_session=False)
+        job.progress_done += len(images)
+        heartbeat(job)
+        # Files shared with images of other projects are kept
+        release_blobs([image.digest for image in images])
+        db.session.commit()
+        # Files left by an interrupted attempt go with the project directory
+        for image in images:
+            if image.digest is None and image.image_storage_path:
+                storage.delete(image.image_storage_path)
+
+    # Sessions are discarded with their partial files
+    for upload in UploadSession.query.filter_by(project_id=project_id).all():
+        upload.discard()
+    Project.query.filter_by(id=project_id).delete(synchronize_session=False)
+    db.session.commit()
+    storage.delete_prefix(str(project_id))
+    get_thumbnail_cache().invalidate(project_id)
 
 
 @bp.route('/project/<project_id>/users', methods=['GET'])
@@ -0,0 +1,211 @@
+"""Module related to resumable uploads
+
+Large images and zips are uploaded in chunks through an upload session. The
+client creates a session, PUTs the chunks of the file at increasing offsets,
+and finalizes the session once all the bytes are received, which hands the
+file to the normal image or zip ingestion. If the connection drops, the
+client gets the offset of the session and resumes from there.
+"""
+import fcntl
+import os
+import shutil
+import uuid
+
+from flask import Blueprint, abort, jsonify, request
+from flask import current_app as app
+from flask_jwt_extended import jwt_required
+
+from instadam.app import db
+from instadam.image import ingest_image, ingest_zip
+from instadam.models.image import VALID_IMG_EXTENSIONS
+from instadam.models.upload_session import UploadSession
+from instadam.utils import check_json, construct_msg
+from instadam.utils.file import (get_upload_dir,
+                                 parse_and_validate_file_extension)
+from instadam.utils.get_project import maybe_get_project
+from instadam.utils.user_identification import get_current_user_id
+
+bp = Blueprint('upload', __name__, url_prefix='/image/upload/session')
+
+
+def maybe_get_upload_session(session_id, lock=False):
+    """
+    Load an upload session of the logged in user, and its project.
+
+    Args:
+        session_id -- id of the upload session
+        lock -- lock the row of the session until the transaction ends. A
+            request waiting on the lock of a session that is then deleted
+            gets a 404
+
+    Raises:
+        404 if the session does not exist
+        401 if the session is not of the logged in user, or the user lost
+        read write access to the project
+
+    Returns:
+        (UploadSession, Project)
+    """
+    query = UploadSession.query.filter_by(id=session_id)
+    if lock:
+        query = query.with_for_update()
+    upload = query.first()
+    if upload is None:
+        abort(404, 'Upload session with id=%s does not exist' % session_id)
+    if upload.created_by != get_current_user_id():
+        abort(401, 'Upload session is not of the logged in user.')
+    return upload, maybe_get_project(upload.project_id)
+
+
+def offset_mismatch(upload):
+    return jsonify({
+        'msg': 'Upload of session %s is at offset %d' % (upload.id,
+                                                          upload.offset),
+        'offset': upload.offset
+    }), 409
+
+
+def session_status(upload):
+    return {
+        'session_id': upload.id,
+        'file_name': upload.file_name,
+        'offset': upload.offset,
+        'size': upload.size,
+        'chunk_size': app.config['UPLOAD_CHUNK_SIZE']
+    }
+
+
+@bp.route('/<project_id>', methods=['POST'])
+@jwt_required
+def create_upload_session(project_id):
+    """
+    Start a resumable upload of an image or a zip to a project
+
+    Args:
+        project_id -- id of the project
+
+    Raises:
+        400 if the size is invalid
+        415 if the file is neither an image nor a zip
+    """
+    project = maybe_get_project(project_id)
+    req = request.get_json()
+    check_json(req, ['file_name', 'size'])
+    file_name = req['file_name']
+    parse_and_validate_file_extension(file_name,
+                                      VALID_IMG_EXTENSIONS | {'zip'})
+    size = req['size']
+    if (not isinstance(size, int) or size <= 0
+            or size > app.config['UPLOAD_MAX_SIZE']):
+        abort(400, 'Invalid size %s' % size)
+
+    session_id = str(uuid.uuid4())
+    upload = UploadSession(
+        id=session_id,
+        project_id=project.id,
+        created_by=get_current_user_id(),
+        file_name=file_name,
+        size=size,
+        partial_path=os.path.join(get_upload_dir(), '%s.part' % session_id))
+    open(upload.partial_path, 'wb').close()
+    db.session.add(upload)
+    db.session.commit()
+    return jsonify(session_status(upload)), 201
+
+
+@bp.route('/<session_id>', methods=['GET'])
+@jwt_required
+def get_upload_session(session_id):
+    """
+    Get the offset to resume an upload from
+
+    Args:
+        session_id -- id of the upload session
+    """
+    upload, _ = maybe_get_upload_session(session_id)
+    return jsonify(session_status(upload)), 200
+
+
+@bp.route('/<session_id>', methods=['PUT'])
+@jwt_required
+def upload_chunk(session_id):
+    """
+    Append a chunk to the uploaded file. The body of the request is the chunk
+    and the `offset` parameter its position in the file, which must be the
+    offset of the session.
+
+    Args:
+        session_id -- id of the upload session
+
+    Raises:
+        400 if the offset is invalid, or the chunk goes past the end of the
+        file
+        409 if the offset is not the offset of the session, or another chunk
+        is being uploaded
+    """
+    upload, _ = maybe_get_upload_session(session_id)
+    try:
+        offset = int(request.args['offset'])
+    except (KeyError, ValueError):
+        abort(400, 'Missing or invalid offset')
+    if request.content_length is None:
+        abort(400, 'Missing Content-Length')
+    if offset + request.content_length > upload.size:
+        abort(400, 'Chunk goes past the end of the file')
+
+    with open(upload.partial_path, 'ab') as fd:
+        # Chunks of the same session are written one at a time
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            abort(409, 'Another chunk of the session is being uploaded')
+        if offset != upload.offset:
+            return offset_mismatch(upload)
+        # Written as it arrives, what landed before a disconnection is kept
+        shutil.copyfileobj(request.stream, fd)
+    return jsonify(session_status(upload)), 200
+
+
+@bp.route('/<session_id>/finalize', methods=['POST'])
+@jwt_required
+def finalize_upload_session(session_id):
+    """
+    Complete an upload, and add the image or the images of the zip to the
+    project
+
+    Args:
+        session_id -- id of the upload session
+
+    Raises:
+        404 if the session is finalized already, by a concurrent request too
+        409 if the file is not fully uploaded
+    """
+    # Concurrent finalizations of the session wait here for the first one
+    upload, project = maybe_get_upload_session(session_id, lock=True)
+    if upload.offset != upload.size:
+        return offset_mismatch(upload)
+
+    file_name, path = upload.file_name, upload.partial_path
+    db.session.delete(upload)
+    db.session.commit()
+    if file_name.lower().endswith('.zip'):
+        zip_path = os.path.join(get_upload_dir(), '%s.zip' % uuid.uuid4())
+        os.replace(path, zip_path)
+        return ingest_zip(project, zip_path)
+    image = ingest_image(project, file_name, path)
+    return jsonify({'msg': 'Image added successfully', 'id': image.id}), 200
+
+
+@bp.route('/<session_id>', methods=['DELETE'])
+@jwt_required
+def delete_upload_session(session_id):
+    """
+    Abandon an upload
+
+    Args:
+        session_id -- id of the upload session
+    """
+    upload, _ = maybe_get_upload_session(session_id)
+    upload.discard()
+    db.session.commit()
+    return construct_msg('Upload session deleted successfully'), 200
@@ -1,5 +1,5 @@
 from flask import Blueprint, abort, jsonify, request
-from flask_jwt_extended import get_jwt_identity, jwt_required
+from flask_jwt_extended import jwt_required
 from sqlalchemy import or_
 from sqlalchemy.exc import IntegrityError
 
@@ -7,7 +7,12 @@ from instadam.app import db
 from instadam.auth import credential_checking, email_checking
 from instadam.models.user import PrivilegesEnum, User
 from instadam.utils import check_json, construct_msg
-from instadam.utils.user_identification import check_user_admin_privilege
+from instadam.utils.get_project import maybe_get_project
+from instadam.utils.shared_cache import invalidate_permission_cache
+from instadam.utils.user_identification import (bump_permission_version,
+                                                check_user_admin_privilege,
+                                                get_current_user)
+from instadam.utils.user_import import import_users, parse_user_file
 
 bp = Blueprint('user', __name__, url_prefix='')
 
@@ -27,8 +32,7 @@ def query_users():
 
     user_query = request.args.get('q')
 
-    current_user = get_jwt_identity()
-    check_user_admin_privilege(current_user)
+    check_user_admin_privilege()
 
     user_query_str = '%' + user_query + '%'
     users = User.query.filter(
@@ -51,6 +55,76 @@ def query_users():
     return jsonify({'users': users_res}), 200
 
 
+@bp.route('/users/import', methods=['POST'])
+@jwt_required
+def bulk_import_users():
+    """
+    Import many users at once. Requires the requester to login and be an
+    admin.
+
+    Takes either a json object --
+    {
+        "users": [
+            {
+                "username": "annotator1",
+                "email": "annotator1@illinois.edu",
+                "password": "Password1234",
+                "privilege": "annotator"
+            }
+        ],
+        "permissions": [
+            {
+                "project_id": 1,
+                "access_type": "r"
+            }
+        ]
+    }
+    or a CSV/json file in 'users' with the same user fields (CSV with a header
+    row), optionally with 'project_id' and 'access_type' form fields.
+
+    "privilege" defaults to "annotator". The optional permissions are granted
+    to every imported user in the same transaction, and the requester must
+    have read write access to those projects.
+
+    Returns:
+        400 if any user is invalid or already exists, nothing is imported then
+        401 if current user is not an admin, or can't grant the permissions
+        503 if the passwords can't be hashed because of the load
+        201 and the imported usernames if imported successfully
+    """
+    check_user_admin_privilege()
+
+    if 'users' in request.files:
+        file = request.files['users']
+        records = parse_user_file(file.stream, file.filename)
+        grants = []
+        if 'project_id' in request.form:
+            grants.append((request.form['project_id'],
+                           request.form.get('access_type', 'r')))
+    else:
+        json = request.get_json()
+        check_json(json, ['users'])
+        records = json['users']
+        grants = []
+        for permission in json.get('permissions', []):
+            check_json(permission, ('project_id', 'access_type'))
+            grants.append(
+                (permission['project_id'], permission['access_type']))
+    if not isinstance(records, list):
+        abort(400, 'users should be a list')
+
+    for project_id, _ in grants:
+        maybe_get_project(project_id)
+
+    usernames = import_users(records, grants)
+    if grants:
+        invalidate_permission_cache()
+    return jsonify({
+        'msg': 'Imported %d users successfully' % len(usernames),
+        'usernames': usernames
+    }), 201
+
+
 @bp.route('/user/privilege/', methods=['PUT'])
 @jwt_required
 def change_privilege():
@@ -75,8 +149,7 @@ def change_privilege():
         200 if updated successfully
 
     """
-    current_user = get_jwt_identity()
-    check_user_admin_privilege(current_user)
+    check_user_admin_privilege()
 
     json = request.get_json()
     check_json(json, ('username', 'privilege'))
@@ -96,8 +169,11 @@ def change_privilege():
     if privilege not in privilege_map:
         abort(400, 'Invalid privilege %s' % privilege)
 
-    user.privileges = privilege_map[privilege]
+    if user.privileges != privilege_map[privilege]:
+        user.privileges = privilege_map[privilege]
+        bump_permission_version(user)
     db.session.commit()
+    invalidate_permission_cache()
 
     return construct_msg(
         'Privilege updated to %s successfully' % privilege), 200
@@ -125,9 +201,8 @@ def update_info():
         400 if username or email is duplicate
         401 if the current password is not correct
     """
-    current_user = get_jwt_identity()
     json = request.get_json()
-    user = User.query.filter_by(username=current_user).first()
+    user = get_current_user()
     check_json(json, ['current_password'])
     if not user.verify_password(json['current_password']):
         abort(401, 'Current password incorrect')
@@ -140,12 +215,14 @@ def update_info():
         user.email = new_email
 
     new_username = json.get('username', None)
-    if new_username:
+    if new_username and new_username != user.username:
         user.username = new_username
+        bump_permission_version(user)
 
     try:
         db.session.commit()
     except IntegrityError:
         abort(400, 'Username or email already exist')
+    invalidate_permission_cache()
 
     return construct_msg('Successfully updated'), 200
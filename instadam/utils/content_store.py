@@ -0,0 +1,305 @@
+"""Content-addressed storage of image files.
+
+With `CONTENT_ADDRESSED_STORAGE`, the file of an image is stored once per
+content, named after the SHA-256 digest of its bytes, under `BLOB_DIR_NAME`.
+Images with the same content share the file, within a project or across
+projects. Files are hashed while they are written, the `blob` table counts
+the images referencing each file, and a file is removed once no image
+references it anymore.
+
+Files are only removed once the database agrees: the files of the blobs
+released by a transaction once it commits, and the files put in the storage
+by a transaction once it rolls back. Both lock the rows of the blobs, adding
+a placeholder row where there is none, as adding a reference does. So a file
+is never removed while another upload is counting on it, and a row never
+outlives its file. Blobs left unreferenced by a worker that died before
+removing them are removed by manage.py prune-blobs.
+"""
+import collections
+import datetime as dt
+import hashlib
+import os
+
+from flask import current_app as app
+from sqlalchemy import event, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+from instadam.app import db
+from instadam.models.blob import Blob
+from instadam.utils.storage import get_storage
+
+BlobLocation = collections.namedtuple('BlobLocation',
+                                      ['digest', 'storage_path', 'url'])
+
+# Keys of the session info holding the blobs to reclaim once the transaction
+# ends, by digest
+_RELEASED_KEY = 'instadam_released_blobs'
+_PUT_KEY = 'instadam_put_blobs'
+
+
+class HashingWriter(object):
+    """Binary file wrapper computing the digest of the bytes written through
+    it. Other attributes are those of the wrapped file."""
+
+    def __init__(self, fd):
+        self._fd = fd
+        self._hash = hashlib.sha256()
+
+    def write(self, data):
+        self._hash.update(data)
+        return self._fd.write(data)
+
+    @property
+    def digest(self):
+        return self._hash.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._fd, name)
+
+
+def is_content_addressed():
+    return app.config['CONTENT_ADDRESSED_STORAGE']
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """
+    Compute the digest of a file already on disk.
+    Args:
+        path: Path to the file
+        chunk_size: Number of bytes read at once
+
+    Returns:
+        Hex SHA-256 digest of the file
+    """
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_blob_location(digest, extension):
+    """
+    Return where the file of a new blob is stored, under a directory per two
+    first characters of the digest
+    Args:
+        digest: Hex digest of the file
+        extension: Extension of the file, so that it is served with its type
+
+    Returns:
+        BlobLocation
+    """
+    storage = get_storage()
+    parts = (app.config['BLOB_DIR_NAME'], digest[:2],
+             '%s.%s' % (digest, extension))
+    return BlobLocation(digest, storage.path(*parts), storage.url(*parts))
+
+
+def add_blobs(files):
+    """
+    Count a reference to the blob of each uploaded file, and put the files
+    whose content is not stored yet in the storage. The other files are
+    removed. The caller is responsible for committing the session, the files
+    put are removed again if it rolls back.
+
+    Args:
+        files: List of (local path to the uploaded file, hex digest of the
+            file, extension of the file)
+
+    Returns:
+        Dict of the BlobLocation of each digest
+    """
+    counts = collections.Counter(digest for _, digest, _ in files)
+    rows = {}
+    now = dt.datetime.utcnow()
+    for path, digest, extension in files:
+        if digest not in rows:
+            location = get_blob_location(digest, extension)
+            rows[digest] = {
+                'digest': digest,
+                'size': os.path.getsize(path),
+                'refcount': counts[digest],
+                'storage_path': location.storage_path,
+                'url': location.url,
+                'created_at': now
+            }
+    if not rows:
+        return {}
+
+    table = Blob.__table__
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # Blobs stored already keep their file, whatever the extension
+        insert = postgresql.insert(table).values(list(rows.values()))
+        stored = db.session.execute(
+            insert.on_conflict_do_update(
+                index_elements=[table.c.digest],
+                set_={
+                    'refcount': table.c.refcount + insert.excluded.refcount
+                }).returning(table.c.digest, table.c.storage_path,
+                             table.c.url)).fetchall()
+    else:
+        stored = db.session.execute(
+            select([table.c.digest, table.c.storage_path, table.c.url
+                    ]).where(table.c.digest.in_(rows))).fetchall()
+        existing = {digest for digest, _, _ in stored}
+        for digest in existing:
+            db.session.execute(table.update().where(
+                table.c.digest == digest).values(
+                    refcount=table.c.refcount + counts[digest]))
+        new_rows = [
+            row for digest, row in rows.items() if digest not in existing
+        ]
+        if new_rows:
+            db.session.execute(table.insert().values(new_rows))
+        stored += [(row['digest'], row['storage_path'], row['url'])
+                   for row in new_rows]
+
+    storage = get_storage()
+    blobs = {row[0]: BlobLocation(*row) for row in stored}
+    put = db.session.info.setdefault(_PUT_KEY, {})
+    for path, digest, _ in files:
+        storage_path = blobs[digest].storage_path
+        if storage.stat(storage_path) is not None:
+            os.remove(path)
+        else:
+            storage.put(storage_path, path)
+            put[digest] = blobs[digest]
+    return blobs
+
+
+def release_blobs(digests):
+    """
+    Drop a reference to the blob of each digest. The caller is responsible
+    for committing the session, the blobs that no image references anymore
+    are removed once it commits.
+
+    Args:
+        digests: Digests of the files of the removed images, with repetitions
+    """
+    counts = collections.Counter(
+        digest for digest in digests if digest is not None)
+    if not counts:
+        return
+    table = Blob.__table__
+    # One statement per distinct number of references dropped
+    by_count = collections.defaultdict(list)
+    for digest, count in counts.items():
+        by_count[count].append(digest)
+    for count, batch in by_count.items():
+        db.session.execute(table.update().where(
+            table.c.digest.in_(batch)).values(
+                refcount=table.c.refcount - count))
+    released = db.session.info.setdefault(_RELEASED_KEY, {})
+    for digest, storage_path, url in db.session.execute(
+            select([table.c.digest, table.c.storage_path, table.c.url
+                    ]).where(table.c.digest.in_(counts))):
+        released[digest] = BlobLocation(digest, storage_path, url)
+
+
+def reclaim_blobs(blobs):
+    """
+    Remove the blobs that no image references, with their files, in a
+    transaction of their own. The rows are locked first, with a placeholder
+    row for the blobs without one, so that a concurrent upload either counts
+    its reference before, and the blob is kept, or waits and stores the file
+    again.
+
+    Args:
+        blobs: List of BlobLocation
+
+    Returns:
+        Number of removed blobs
+    """
+    if not blobs:
+        return 0
+    table = Blob.__table__
+    # Locked in digest order, so that concurrent reclaims don't deadlock
+    blobs = sorted(blobs)
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            now = dt.datetime.utcnow()
+            insert = postgresql.insert(table).values([{
+                'digest': blob.digest,
+                'size': 0,
+                'refcount': 0,
+                'storage_path': blob.storage_path,
+                'url': blob.url,
+                'created_at': now
+            } for blob in blobs])
+            rows = connection.execute(
+                insert.on_conflict_do_update(
+                    index_elements=[table.c.digest],
+                    set_={
+                        'refcount': table.c.refcount
+                    }).returning(table.c.digest, table.c.storage_path,
+                                 table.c.refcount)).fetchall()
+        else:
+            digests = [blob.digest for blob in blobs]
+            rows = connection.execute(
+                select([table.c.digest, table.c.storage_path,
+                        table.c.refcount]).where(
+                            table.c.digest.in_(digests))).fetchall()
+            found = {digest for digest, _, _ in rows}
+            rows += [(blob.digest, blob.storage_path, 0) for blob in blobs
+                     if blob.digest not in found]
+        unreferenced = [(digest, storage_path)
+                        for digest, storage_path, refcount in rows
+                        if refcount <= 0]
+        storage = get_storage()
+        for _, storage_path in unreferenced:
+            storage.delete(storage_path)
+        if unreferenced:
+            connection.execute(table.delete().where(
+                table.c.digest.in_(
+                    [digest for digest, _ in unreferenced])))
+    return len(unreferenced)
+
+
+def prune_blobs(batch_size):
+    """
+    Remove the blobs left unreferenced by workers that died before removing
+    them, `batch_size` blobs per transaction.
+
+    Args:
+        batch_size: Maximum number of blobs removed per transaction
+
+    Returns:
+        Number of removed blobs
+    """
+    table = Blob.__table__
+    pruned = 0
+    last_digest = ''
+    while True:
+        blobs = [
+            BlobLocation(*row) for row in db.session.execute(
+                select([table.c.digest, table.c.storage_path, table.c.url
+                        ]).where(table.c.refcount <= 0).where(
+                            table.c.digest > last_digest).order_by(
+                                table.c.digest).limit(batch_size))
+        ]
+        db.session.commit()
+        if not blobs:
+            return pruned
+        pruned += reclaim_blobs(blobs)
+        last_digest = blobs[-1].digest
+
+
+@event.listens_for(Session, 'after_commit')
+def _reclaim_released_blobs(session):
+    session.info.pop(_PUT_KEY, None)
+    released = session.info.pop(_RELEASED_KEY, None)
+    if released:
+        reclaim_blobs(list(released.values()))
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _reclaim_put_blobs(session, transaction):
+    # Files still recorded when the transaction ends were not committed,
+    # whether it rolled back or the session was closed
+    if transaction.parent is not None:
+        return
+    session.info.pop(_RELEASED_KEY, None)
+    put = session.info.pop(_PUT_KEY, None)
+    if put:
+        reclaim_blobs(list(put.values()))
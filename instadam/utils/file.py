@@ -23,31 +23,15 @@ def parse_and_validate_file_extension(file_name, valid_extensions):
     abort(415, 'Invalid file extension for %s' % file_name)
 
 
-def get_project_dir(project):
+def get_upload_dir():
     """
-    Return the path to the project directory. And create one if doesn't exist.
-    Args:
-        project: Project
-
-    Returns:
-        Path
-    """
-    project_dir = os.path.join(app.config['STATIC_STORAGE_DIR'],
-                               str(project.id))
-    if not os.path.exists(project_dir):
-        os.mkdir(project_dir)
-    return project_dir
-
-
-def get_project_static_url(project):
-    """
-    Return the url path to the static file directory
-    Args:
-        project: The project
+    Return the local directory uploads are received in, before they are put
+    in the storage. And create one if doesn't exist.
 
     Returns:
         Path
-
     """
-    return os.path.join(app.config['STATIC_STORAGE_URL'],
-                        str(project.id))
+    upload_dir = os.path.join(app.config['STATIC_STORAGE_DIR'],
+                              app.config['UPLOAD_DIR_NAME'])
+    os.makedirs(upload_dir, exist_ok=True)
+    return upload_dir
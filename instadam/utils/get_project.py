@@ -1,31 +1,60 @@
 from flask import abort
-from flask_jwt_extended import get_jwt_identity
 
+from instadam.app import db
+from instadam.models.image import Image
+from instadam.models.project import Project
 from instadam.models.project_permission import AccessTypeEnum, ProjectPermission
-from instadam.models.user import User
+from instadam.utils.request_context import get_request_context
+from instadam.utils.shared_cache import get_shared_cache
 from instadam.utils.user_identification import check_user_admin_privilege
 
 
 def maybe_get_project(project_id):
-    current_user = get_jwt_identity()
-    user = check_user_admin_privilege(current_user)
-    permission = ProjectPermission.query.filter_by(
-        project_id=project_id,
-        user_id=user.id,
-        access_type=AccessTypeEnum.READ_WRITE).first()
-    if permission is None:
+    check_user_admin_privilege()
+    permission = get_request_context().get_permission(project_id)
+    if (permission is None
+            or permission.access_type != AccessTypeEnum.READ_WRITE):
         abort(401, 'User does not have read write access to this project')
     return permission.project
 
 
 def maybe_get_project_read_only(project_id):
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
-    permission = ProjectPermission.query.filter(
-        (ProjectPermission.user_id == user.id)
-        & (ProjectPermission.project_id == project_id)).filter(
-        (ProjectPermission.access_type == AccessTypeEnum.READ_ONLY)
-        | (ProjectPermission.access_type == AccessTypeEnum.READ_WRITE)).first()
-    if permission is None:
+    permission = get_request_context().get_permission(project_id)
+    if permission is None or permission.access_type not in (
+            AccessTypeEnum.READ_ONLY, AccessTypeEnum.READ_WRITE):
         abort(401, 'User does not have read access of this project')
     return permission.project
+
+
+def maybe_get_image_read_only(image_id):
+    """
+    Load the image together with the permission of the logged in user to its
+    project in a single query.
+    Args:
+        image_id: The id of the image
+
+    Raises:
+        404 if the image does not exist, is not extracted yet or its project
+            is deleted
+        401 if the user does not have read access to the project of the image
+
+    Returns:
+        Image
+    """
+    context = get_request_context()
+    # Taken before the database read, see utils/shared_cache.py
+    generation = get_shared_cache().generation()
+    row = db.session.query(Image, ProjectPermission).join(
+        Image.project).outerjoin(
+        ProjectPermission,
+        (ProjectPermission.project_id == Image.project_id)
+        & (ProjectPermission.user_id == context.user_id)).filter(
+        Image.id == image_id, Project.deleted_at.is_(None)).first()
+    if row is None:
+        abort(404, 'No image found with id=%s' % image_id)
+    image, permission = row
+    context.set_permission(image.project_id, permission, generation)
+    maybe_get_project_read_only(image.project_id)
+    if not image.ready:
+        abort(404, 'Image with id=%s is not ready yet' % image_id)
+    return image
@@ -0,0 +1,141 @@
+"""Ingest pipeline generating the standard thumbnails of uploaded images.
+
+Images are decoded once as they land and every size of
+`THUMBNAIL_STANDARD_SIZES` is written to the thumbnail cache, so that gallery
+loads are served from the cache without decoding the originals on request
+threads.
+
+Single uploads are handed to a small process pool shared by the requests of a
+worker process. The pool and its queue are bounded: when they are full the
+image is skipped and its thumbnails are rendered lazily on the first request
+instead, so a burst of uploads can't pile up work in the web workers. Zip
+uploads are extracted in a background process already, which generates the
+thumbnails of each member right after extracting it.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app as app
+
+from instadam.utils.storage import get_storage
+from instadam.utils.thumbnail import (ThumbnailCache, get_image_version,
+                                      get_thumbnail_cache, render_thumbnails)
+
+_lock = threading.Lock()
+_pool = None
+
+# Thumbnail caches of the pool worker processes, by cache directory
+_worker_caches = {}
+
+
+class _IngestPool(object):
+
+    def __init__(self, workers, queue_size):
+        self.pid = os.getpid()
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(queue_size)
+
+
+class ThumbnailIngest(object):
+    """Settings to generate the standard thumbnails of images, usable outside
+    of an app context and in other processes.
+
+    Args:
+        storage: Storage backend of the original images
+        cache_dir: Directory of the thumbnail cache
+        max_bytes: Byte budget of the thumbnail cache
+        sizes: Sizes to generate, as returned by `normalize_size`
+        fmt: Output format
+    """
+
+    def __init__(self, storage, cache_dir, max_bytes, sizes, fmt):
+        self.storage = storage
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.sizes = [tuple(size) for size in sizes]
+        self.fmt = fmt
+
+    def _get_cache(self):
+        cache = _worker_caches.get(self.cache_dir)
+        if cache is None:
+            cache = ThumbnailCache(self.cache_dir, self.max_bytes)
+            _worker_caches[self.cache_dir] = cache
+        return cache
+
+    def generate(self, project_id, image_id, storage_path, version,
+                 cache=None):
+        """
+        Generate the thumbnails of an image that aren't cached yet.
+        Args:
+            project_id: The id of the project of the image
+            image_id: The id of the image
+            storage_path: Storage path of the original image
+            version: Version of the image, see `get_image_version`
+            cache: ThumbnailCache to use, one per process by default
+        """
+        cache = cache or self._get_cache()
+        sizes = [
+            size for size in self.sizes if not os.path.exists(
+                cache.path(project_id, image_id, size, self.fmt, version))
+        ]
+        if not sizes:
+            return
+        try:
+            for size, data in render_thumbnails(self.storage, storage_path,
+                                                sizes, self.fmt):
+                cache.put(project_id, image_id, size, self.fmt, version, data)
+        except (IOError, OSError) as e:
+            print('Error when generating thumbnails of %s:' % storage_path, e)
+
+
+def get_thumbnail_ingest():
+    """
+    Return the thumbnail ingest settings of the current app.
+
+    Returns:
+        ThumbnailIngest
+    """
+    cache = get_thumbnail_cache()
+    return ThumbnailIngest(get_storage(), cache.cache_dir, cache.max_bytes,
+                           app.config['THUMBNAIL_STANDARD_SIZES'],
+                           app.config['THUMBNAIL_STANDARD_FORMAT'])
+
+
+def _get_pool():
+    global _pool
+    # Pool processes don't survive a fork, so each worker needs its own pool
+    if _pool is None or _pool.pid != os.getpid():
+        with _lock:
+            if _pool is None or _pool.pid != os.getpid():
+                _pool = _IngestPool(app.config['THUMBNAIL_INGEST_WORKERS'],
+                                    app.config['THUMBNAIL_INGEST_QUEUE_SIZE'])
+    return _pool
+
+
+def schedule_thumbnails(image):
+    """
+    Generate the standard thumbnails of a committed image in the ingest
+    pool. With `THUMBNAIL_INGEST_WORKERS` set to 0 they are generated inline.
+    Args:
+        image: Image whose original is saved to its storage path
+
+    Returns:
+        False if the pool is full and the image was skipped, True otherwise
+    """
+    ingest = get_thumbnail_ingest()
+    args = (image.project_id, image.id, image.image_storage_path,
+            get_image_version(image))
+    if app.config['THUMBNAIL_INGEST_WORKERS'] <= 0:
+        ingest.generate(*args, cache=get_thumbnail_cache())
+        return True
+    pool = _get_pool()
+    if not pool.slots.acquire(blocking=False):
+        return False
+    try:
+        future = pool.executor.submit(ingest.generate, *args)
+    except RuntimeError:
+        pool.slots.release()
+        return False
+    future.add_done_callback(lambda _: pool.slots.release())
+    return True
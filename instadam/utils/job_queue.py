@@ -0,0 +1,189 @@
+"""Background jobs backed by the job table.
+
+Long running work, like extracting uploaded zips, is recorded as a row of the
+job table and run by a fixed number of worker processes started with
+`manage.py run-jobs`, instead of being forked from the web workers. Workers
+claim jobs with `SELECT ... FOR UPDATE SKIP LOCKED`, so any number of them
+can poll the same table. A job that raises is retried with an exponential
+backoff until it runs out of attempts, and a job whose worker died is claimed
+again once its lease expired. Handlers renew the lease with `heartbeat` as
+they make progress, so long jobs keep it.
+
+Handlers are registered by kind with the `job_handler` decorator, and receive
+the job with its json payload. With `JOB_QUEUE_EAGER` set, jobs run on the
+enqueuing thread right away, which the development and testing configs use.
+"""
+import datetime as dt
+import os
+import socket
+import time
+import traceback
+
+from flask import current_app as app
+from sqlalchemy import and_, or_
+
+from instadam.app import db
+from instadam.models.job import Job, JobStatusEnum
+
+_handlers = {}
+
+
+def job_handler(kind):
+    """
+    Register the decorated function as the handler of the jobs of a kind.
+    Args:
+        kind: Name of the kind of jobs
+    """
+
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+
+    return decorator
+
+
+def enqueue_job(kind, payload, project_id=None, created_by=None):
+    """
+    Add a job to the queue and commit it.
+    Args:
+        kind: Name of the handler of the job
+        payload: Json serializable arguments of the handler
+        project_id: The id of the project the job works on
+        created_by: The id of the user that started the job
+
+    Returns:
+        The job
+    """
+    if kind not in _handlers:
+        raise ValueError('No handler for jobs of kind %s' % kind)
+    job = Job(
+        kind=kind,
+        payload=payload,
+        project_id=project_id,
+        created_by=created_by,
+        max_attempts=app.config['JOB_MAX_ATTEMPTS'])
+    db.session.add(job)
+    db.session.commit()
+    if app.config['JOB_QUEUE_EAGER']:
+        _start(job, 'eager')
+        run_job(job)
+    return job
+
+
+def _start(job, worker_name):
+    now = dt.datetime.utcnow()
+    job.status = JobStatusEnum.RUNNING
+    job.attempts += 1
+    job.locked_by = worker_name
+    job.locked_at = now
+    job.started_at = now
+    db.session.commit()
+
+
+def heartbeat(job):
+    """
+    Renew the lease of a running job, so that it is not claimed again while
+    it runs. Handlers call it with each progress update, before committing.
+    Args:
+        job: The running job
+    """
+    job.locked_at = dt.datetime.utcnow()
+
+
+def claim_job(worker_name):
+    """
+    Claim the next job to run, either a queued job that is due or a running
+    job whose lease expired. A job whose lease expired on its last attempt
+    is marked failed instead.
+    Args:
+        worker_name: Name of the claiming worker
+
+    Returns:
+        The claimed job, or None if there is nothing to run
+    """
+    while True:
+        now = dt.datetime.utcnow()
+        lease_expired_at = now - dt.timedelta(
+            seconds=app.config['JOB_LEASE_TIMEOUT'])
+        job = Job.query.filter(
+            or_(
+                and_(Job.status == JobStatusEnum.QUEUED, Job.run_at <= now),
+                and_(Job.status == JobStatusEnum.RUNNING,
+                     Job.locked_at < lease_expired_at))).order_by(
+                         Job.run_at).limit(1).with_for_update(
+                             skip_locked=True).first()
+        if job is None:
+            db.session.commit()
+            return None
+        if (job.status == JobStatusEnum.RUNNING
+                and job.attempts >= job.max_attempts):
+            job.status = JobStatusEnum.FAILED
+            job.error = 'Lease of %s expired' % job.locked_by
+            job.finished_at = now
+            db.session.commit()
+            continue
+        _start(job, worker_name)
+        return job
+
+
+def run_job(job):
+    """
+    Run a claimed job, and record its result. Failed jobs are queued again
+    with an exponential backoff until they run out of attempts.
+    Args:
+        job: The claimed job
+
+    Returns:
+        True if the job succeeded
+    """
+    job_id = job.id
+    try:
+        _handlers[job.kind](job)
+    except Exception:
+        error = traceback.format_exc()
+        db.session.rollback()
+        job = Job.query.get(job_id)
+        job.error = error
+        if job.attempts < job.max_attempts:
+            job.status = JobStatusEnum.QUEUED
+            job.run_at = dt.datetime.utcnow() + dt.timedelta(
+                seconds=app.config['JOB_RETRY_DELAY'] *
+                2**(job.attempts - 1))
+        else:
+            job.status = JobStatusEnum.FAILED
+            job.finished_at = dt.datetime.utcnow()
+        db.session.commit()
+        return False
+    job.status = JobStatusEnum.SUCCEEDED
+    job.finished_at = dt.datetime.utcnow()
+    db.session.commit()
+    return True
+
+
+def run_worker(worker_name=None, poll_interval=None, max_jobs=None):
+    """
+    Claim and run jobs, forever by default. With `max_jobs` set, return once
+    that many jobs ran or there is nothing left to run.
+    Args:
+        worker_name: Name of the worker, recorded on the jobs it runs
+        poll_interval: Seconds to wait when there is nothing to run
+        max_jobs: Number of jobs to run before returning
+
+    Returns:
+        Number of jobs run
+    """
+    if worker_name is None:
+        worker_name = '%s:%d' % (socket.gethostname(), os.getpid())
+    if poll_interval is None:
+        poll_interval = app.config['JOB_POLL_INTERVAL']
+    count = 0
+    while max_jobs is None or count < max_jobs:
+        job = claim_job(worker_name)
+        if job is None:
+            if max_jobs is not None:
+                break
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        count += 1
+    return count
@@ -0,0 +1,142 @@
+"""Keyset pagination of the image listings of a project.
+
+Listings are ordered by a sort key then by image id, and each page ends with
+an opaque cursor holding both values for its last image. The next page starts
+right after that image with a row comparison, so every page is a range scan of
+the index however deep into the listing, where an OFFSET would scan all the
+skipped rows. Only the selected fields are fetched, as tuples rather than
+`Image` entities.
+"""
+import base64
+import datetime as dt
+import json
+
+from flask import abort, request
+from flask import current_app as app
+from sqlalchemy import tuple_
+
+from instadam.app import db
+from instadam.models.image import Image
+
+IMAGE_FIELDS = {
+    'id': Image.id,
+    'name': Image.image_name,
+    'path': Image.image_url,
+    'project_id': Image.project_id,
+    'is_annotated': Image.is_annotated,
+    'modified_at': Image.modified_at
+}
+IMAGE_SORT_KEYS = {
+    'id': Image.id,
+    'name': Image.image_name,
+    'modified_at': Image.modified_at
+}
+_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def _encode_cursor(value, image_id):
+    if isinstance(value, dt.datetime):
+        value = value.strftime(_DATETIME_FORMAT)
+    data = json.dumps([value, image_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def _decode_cursor(cursor, sort_key):
+    try:
+        value, image_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        if sort_key == 'modified_at':
+            value = dt.datetime.strptime(value, _DATETIME_FORMAT)
+        elif sort_key == 'id':
+            value = int(value)
+        elif not isinstance(value, str):
+            raise TypeError(value)
+        return value, int(image_id)
+    except (ValueError, TypeError):
+        abort(400, 'Invalid cursor')
+
+
+def _parse_fields(default_fields):
+    if 'fields' not in request.args:
+        return default_fields
+    fields = [
+        field.strip() for field in request.args['fields'].split(',')
+        if field.strip()
+    ]
+    unknown = [field for field in fields if field not in IMAGE_FIELDS]
+    if not fields or unknown:
+        abort(400, 'Invalid fields, must be among %s' %
+              ', '.join(sorted(IMAGE_FIELDS)))
+    return fields
+
+
+def _parse_limit():
+    max_limit = app.config['IMAGE_PAGE_MAX_SIZE']
+    try:
+        limit = int(
+            request.args.get('limit', app.config['IMAGE_PAGE_SIZE']))
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= max_limit:
+        abort(400, 'Invalid limit, must be between 1 and %d' % max_limit)
+    return limit
+
+
+def list_images(filters, default_fields):
+    """
+    Return a page of an image listing, following the arguments of the
+    request:
+
+    * fields -- comma separated fields of the images, among IMAGE_FIELDS
+    * sort -- sort key among IMAGE_SORT_KEYS, prefixed with `-` to sort in
+      descending order. Images with the same key are ordered by id
+    * limit -- number of images of the page, at most IMAGE_PAGE_MAX_SIZE
+    * cursor -- next cursor returned with the previous page
+
+    Args:
+        filters: Criteria of the images of the listing
+        default_fields: Fields of the images without a `fields` argument
+
+    Raises:
+        400 if an argument is invalid
+
+    Returns:
+        (list of a dict of the fields of each image, cursor of the next page
+        or None if this is the last page)
+    """
+    fields = _parse_fields(default_fields)
+    limit = _parse_limit()
+    sort = request.args.get('sort', 'id')
+    descending = sort.startswith('-')
+    sort_key = sort.lstrip('-')
+    if sort_key not in IMAGE_SORT_KEYS:
+        abort(400, 'Invalid sort, must be among %s, optionally prefixed '
+              'with -' % ', '.join(sorted(IMAGE_SORT_KEYS)))
+    sort_column = IMAGE_SORT_KEYS[sort_key]
+
+    # The sort key and the id follow the fields, for the cursor
+    query = db.session.query(*[IMAGE_FIELDS[field] for field in fields],
+                             sort_column, Image.id).filter(*filters)
+    if 'cursor' in request.args:
+        value, image_id = _decode_cursor(request.args['cursor'], sort_key)
+        if sort_key == 'id':
+            after = Image.id < image_id if descending else Image.id > image_id
+        else:
+            key, last = tuple_(sort_column, Image.id), tuple_(value, image_id)
+            after = key < last if descending else key > last
+        query = query.filter(after)
+    if sort_key == 'id':
+        order = [Image.id.desc() if descending else Image.id]
+    elif descending:
+        order = [sort_column.desc(), Image.id.desc()]
+    else:
+        order = [sort_column, Image.id]
+    # One more row tells whether there is a next page
+    rows = query.order_by(*order).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1][-2], rows[-1][-1])
+    images = [dict(zip(fields, row[:len(fields)])) for row in rows]
+    return images, next_cursor
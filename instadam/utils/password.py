@@ -0,0 +1,168 @@
+"""Password hashing following the configured policy.
+
+Hashing a password takes the whole CPU time of the worker computing it, and
+the uWSGI workers serve one request each. So that a burst of logins can't take
+every worker away from the other endpoints, at most `PASSWORD_HASH_SLOTS`
+hashes run at once across all the worker processes. The slots are exclusive
+locks on files of `PASSWORD_HASH_LOCK_DIR`, released by the kernel even when
+a worker dies. Requests that can't get a slot within
+`PASSWORD_HASH_SLOT_TIMEOUT` are rejected with 503 right away instead of
+waiting for one.
+
+Bulk imports from the command line hash many passwords at once in worker
+processes instead, see `hash_passwords`.
+"""
+import fcntl
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from flask import abort, current_app, has_app_context
+from werkzeug.security import (DEFAULT_PBKDF2_ITERATIONS, check_password_hash,
+                               generate_password_hash)
+
+from instadam.config import Config
+
+SLOT_POLL_INTERVAL = 0.01  # seconds
+
+
+def _config(key):
+    if has_app_context():
+        return current_app.config[key]
+    return getattr(Config, key)
+
+
+def _acquire_slot(slots, lock_dir, timeout):
+    """
+    Take one of the hashing slots shared by the worker processes.
+    Args:
+        slots: Number of slots
+        lock_dir: Directory of the lock files of the slots
+        timeout: Seconds to wait for a free slot
+
+    Returns:
+        The open lock file of the slot, to close to release it, or None if no
+        slot got free in time
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        for slot in range(slots):
+            # A file opened per attempt, as locks of the same open file would
+            # be shared by the threads of a process
+            fd = os.open(
+                os.path.join(lock_dir, 'instadam-password-%d.lock' % slot),
+                os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            return fd
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(SLOT_POLL_INTERVAL)
+
+
+def _run(func, *args):
+    if not has_app_context():
+        return func(*args)
+    fd = _acquire_slot(_config('PASSWORD_HASH_SLOTS'),
+                       _config('PASSWORD_HASH_LOCK_DIR')
+                       or tempfile.gettempdir(),
+                       _config('PASSWORD_HASH_SLOT_TIMEOUT'))
+    if fd is None:
+        abort(503, 'Server is busy, please try again later.')
+    try:
+        return func(*args)
+    finally:
+        os.close(fd)
+
+
+def hashing_method():
+    """
+    Return the werkzeug hashing method of the configured policy, for example
+    'pbkdf2:sha256:260000'.
+    """
+    return '%s:%d' % (_config('PASSWORD_HASH_METHOD'),
+                      _config('PASSWORD_HASH_ITERATIONS'))
+
+
+def hash_password(password):
+    """
+    Hash the password with the configured policy.
+    Args:
+        password: The plain text password
+
+    Returns:
+        The salted hash
+    """
+    return _run(generate_password_hash, password, hashing_method())
+
+
+def hash_passwords(passwords, processes=0):
+    """
+    Hash many passwords with the configured policy. With several processes
+    they are hashed in parallel worker processes, which only the command line
+    should use. Otherwise each is hashed in a slot, as by `hash_password`.
+    Args:
+        passwords: List of plain text passwords
+        processes: Number of worker processes, 0 to hash in slots
+
+    Raises:
+        503 if a password can't get a slot in time
+
+    Returns:
+        List of salted hashes, in the same order
+    """
+    if processes <= 1 or len(passwords) <= 1:
+        return [hash_password(password) for password in passwords]
+    method = hashing_method()
+    processes = min(processes, len(passwords))
+    chunksize = max(1, len(passwords) // (processes * 4))
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(
+            executor.map(generate_password_hash, passwords, repeat(method),
+                         chunksize=chunksize))
+
+
+def verify_password(pwhash, password):
+    """
+    Check the password against a hash computed with any policy.
+    Args:
+        pwhash: The salted hash
+        password: The plain text password
+
+    Returns:
+        True if the password matches
+    """
+    return _run(check_password_hash, pwhash, password)
+
+
+def needs_rehash(pwhash):
+    """
+    Check whether the hash was computed with another method than the
+    configured one, or with fewer iterations. Hashes with more iterations are
+    kept, so that lowering the policy doesn't weaken them.
+    Args:
+        pwhash: The salted hash
+
+    Returns:
+        True if the password should be hashed again
+    """
+    method = pwhash.split('$', 1)[0]
+    iterations = None
+    if method.startswith('pbkdf2:'):
+        # pbkdf2:<hash function>[:<iterations>], werkzeug's default if omitted
+        parts = method.split(':')
+        method = ':'.join(parts[:2])
+        try:
+            iterations = (int(parts[2]) if len(parts) > 2 else
+                          DEFAULT_PBKDF2_ITERATIONS)
+        except ValueError:
+            return True
+    if method != _config('PASSWORD_HASH_METHOD'):
+        return True
+    return (iterations is not None
+            and iterations < _config('PASSWORD_HASH_ITERATIONS'))
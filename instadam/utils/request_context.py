@@ -0,0 +1,171 @@
+"""Request scoped cache of the logged in user and its project permissions.
+
+Helpers resolving the current user or its access to a project store their
+results on `flask.g`, so a request asking the same question several times
+only queries the database once. The number of SQL statements issued by each
+request is counted as well, and reported in the `X-Query-Count` response header
+when `QUERY_COUNT_HEADER` is enabled.
+"""
+from flask import g, has_request_context
+from flask_jwt_extended import get_jwt_claims
+from sqlalchemy import bindparam, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import contains_eager
+
+from instadam.app import db
+from instadam.models.project import Project
+from instadam.models.project_permission import AccessTypeEnum, ProjectPermission
+from instadam.models.user import PrivilegesEnum, User
+from instadam.utils.shared_cache import get_shared_cache
+
+bakery = baked.bakery()
+
+
+def _load_permission(user_id, project_id):
+    """
+    Load the permission of the user to the project, together with the user
+    and the project, in a single baked query. Deleted projects have none.
+    """
+    query = bakery(lambda session: session.query(ProjectPermission).join(
+        ProjectPermission.user).join(ProjectPermission.project).options(
+        contains_eager(ProjectPermission.user),
+        contains_eager(ProjectPermission.project)))
+    query += lambda q: q.filter(
+        (ProjectPermission.user_id == bindparam('user_id'))
+        & (ProjectPermission.project_id == bindparam('project_id'))
+        & Project.deleted_at.is_(None))
+    return query(db.session()).params(
+        user_id=user_id, project_id=project_id).first()
+
+
+class RequestContext(object):
+    """The logged in user of the current request and its project permissions.
+    """
+
+    def __init__(self):
+        self._claims = None
+        self._user = None
+        self._permissions = {}
+
+    @property
+    def claims(self):
+        if self._claims is None:
+            self._claims = get_jwt_claims()
+        return self._claims
+
+    @property
+    def user_id(self):
+        return self.claims['id']
+
+    @property
+    def privileges(self):
+        return PrivilegesEnum(self.claims['privileges'])
+
+    @property
+    def user(self):
+        """The logged in user, loaded from the database on first access."""
+        if self._user is None:
+            self._user = User.query.get(self.user_id)
+        return self._user
+
+    def get_permission(self, project_id):
+        """
+        Return the permission of the logged in user to the project, loaded
+        from the database on first access together with the project and the
+        user.
+        Args:
+            project_id: The id of the project
+
+        Returns:
+            ProjectPermission, or None if the user has no access
+        """
+        try:
+            project_id = int(project_id)
+        except (TypeError, ValueError):
+            return None
+        if project_id not in self._permissions:
+            # Taken before the database read, see utils/shared_cache.py
+            generation = get_shared_cache().generation()
+            permission = _load_permission(self.user_id, project_id)
+            if permission is not None and self._user is None:
+                self._user = permission.user
+            self.set_permission(project_id, permission, generation)
+        return self._permissions[project_id]
+
+    def get_access_type(self, project_id):
+        """
+        Return the access type of the logged in user to the project, from the
+        cache shared by the worker processes if possible.
+        Args:
+            project_id: The id of the project
+
+        Returns:
+            AccessTypeEnum, or None if the user has no access
+        """
+        try:
+            project_id = int(project_id)
+        except (TypeError, ValueError):
+            return None
+        if project_id not in self._permissions:
+            cached = get_shared_cache().get_access_type(
+                self.user_id, project_id)
+            if cached is not None:
+                return AccessTypeEnum(cached) if cached else None
+        permission = self.get_permission(project_id)
+        return permission.access_type if permission is not None else None
+
+    def set_permission(self, project_id, permission, generation):
+        """
+        Record a permission of the logged in user resolved elsewhere.
+        Args:
+            project_id: The id of the project
+            permission: ProjectPermission, or None if the user has no access
+            generation: Generation of the shared cache taken before the
+                permission was read from the database
+        """
+        self._permissions[int(project_id)] = permission
+        get_shared_cache().set_access_type(
+            self.user_id, project_id,
+            permission.access_type if permission is not None else None,
+            generation)
+
+
+def get_request_context():
+    """
+    Return the context of the current request. And create one if doesn't
+    exist.
+
+    Returns:
+        RequestContext
+    """
+    if 'instadam_context' not in g:
+        g.instadam_context = RequestContext()
+    return g.instadam_context
+
+
+def get_query_count():
+    """
+    Return the number of SQL statements issued so far by the current request.
+    """
+    return g.get('instadam_query_count', 0)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.instadam_query_count = g.get('instadam_query_count', 0) + 1
+
+
+def init_app(app):
+    """
+    Register the query count header on the app.
+    Args:
+        app: The Flask application
+    """
+
+    @app.after_request
+    def add_query_count_header(response):
+        if app.config['QUERY_COUNT_HEADER']:
+            response.headers['X-Query-Count'] = str(get_query_count())
+        return response
@@ -0,0 +1,152 @@
+"""In-process cache of revoked JWT identifiers.
+
+The blacklist check runs on every `@jwt_required` request, and in the common
+case the token is not revoked. The cache keeps a Bloom filter of every revoked
+`jti`, refreshed incrementally from the `invoken_token` table by id watermark,
+so a negative answer needs no database round trip. Positive answers from the
+filter are confirmed against a small LRU of known hits, and only fall back to
+the database for unconfirmed (possibly false positive) matches.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app as app
+
+from instadam.app import db
+from instadam.models.revoked_token import RevokedToken
+
+# Ids are assigned at insert time but become visible at commit time, so a
+# slightly older id can show up after a newer one. Re-read this many ids
+# below the watermark on every refresh to pick those up.
+REFRESH_ID_OVERLAP = 64
+
+
+class BloomFilter(object):
+    """A fixed-size Bloom filter over strings.
+
+    Args:
+        num_bits: Number of bits in the filter
+        num_hashes: Number of bit positions set per key
+    """
+
+    def __init__(self, num_bits, num_hashes):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray((num_bits + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+
+class RevokedTokenCache(object):
+    """Cache answering whether a token identifier has been revoked.
+
+    Tokens revoked by this process are visible immediately. Tokens revoked by
+    other worker processes become visible after at most `refresh_interval`
+    seconds.
+
+    Args:
+        refresh_interval: Seconds between incremental reloads from the table
+        bloom_bits: Size of the Bloom filter in bits
+        bloom_hashes: Number of hash functions of the Bloom filter
+        lru_size: Number of confirmed revoked identifiers to remember
+    """
+
+    def __init__(self, refresh_interval, bloom_bits, bloom_hashes, lru_size):
+        self.refresh_interval = refresh_interval
+        self.lru_size = lru_size
+        self._bloom = BloomFilter(bloom_bits, bloom_hashes)
+        self._hits = OrderedDict()
+        self._watermark = 0
+        self._last_refresh = None
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """Load revoked tokens added since the last refresh.
+
+        Args:
+            force: Refresh even if the refresh interval has not elapsed
+        """
+        now = time.monotonic()
+        if (not force and self._last_refresh is not None
+                and now - self._last_refresh < self.refresh_interval):
+            return
+        rows = db.session.query(RevokedToken.id, RevokedToken.jti).filter(
+            RevokedToken.id > self._watermark - REFRESH_ID_OVERLAP).order_by(
+            RevokedToken.id).all()
+        with self._lock:
+            for row_id, jti in rows:
+                self._bloom.add(jti)
+                self._watermark = max(self._watermark, row_id)
+            self._last_refresh = now
+
+    def _remember(self, jti):
+        self._hits[jti] = True
+        self._hits.move_to_end(jti)
+        while len(self._hits) > self.lru_size:
+            self._hits.popitem(last=False)
+
+    def add(self, jti):
+        """Record a token revoked by this process.
+
+        Args:
+            jti: The unique identifier of the revoked token
+        """
+        with self._lock:
+            self._bloom.add(jti)
+            self._remember(jti)
+
+    def is_revoked(self, jti):
+        """Check whether the token identifier has been revoked.
+
+        Args:
+            jti: The unique identifier of the token
+
+        Returns:
+            True if the token is revoked, False otherwise
+        """
+        self.refresh()
+        with self._lock:
+            if jti in self._hits:
+                self._hits.move_to_end(jti)
+                return True
+            if jti not in self._bloom:
+                return False
+        revoked = RevokedToken.query.filter_by(jti=jti).first() is not None
+        if revoked:
+            with self._lock:
+                self._remember(jti)
+        return revoked
+
+
+def get_revoked_token_cache():
+    """
+    Return the revoked token cache of the current app. And create one if
+    doesn't exist.
+
+    Returns:
+        RevokedTokenCache
+    """
+    cache = app.extensions.get('instadam_revoked_tokens')
+    if cache is None:
+        cache = RevokedTokenCache(
+            app.config['REVOKED_TOKEN_CACHE_REFRESH_INTERVAL'],
+            app.config['REVOKED_TOKEN_BLOOM_BITS'],
+            app.config['REVOKED_TOKEN_BLOOM_HASHES'],
+            app.config['REVOKED_TOKEN_LRU_SIZE'])
+        app.extensions['instadam_revoked_tokens'] = cache
+    return cache
@@ -0,0 +1,76 @@
+"""Upgrade of the schema of an existing PostgreSQL database.
+
+The schema is built with `db.create_all()`, which creates the missing tables
+but never alters the existing ones. The columns, indexes and constraints added
+to existing tables since are applied here with ALTER TABLE statements. Every
+statement is idempotent, so the upgrade can run on any database, upgraded or
+not, through manage.py upgrade-db.
+"""
+from instadam.app import db
+
+# Foreign keys to a project, image or label row, recreated with ON DELETE
+# CASCADE. Named as PostgreSQL names the foreign keys of create_all
+_CASCADE_FOREIGN_KEYS = [
+    ('image', 'project_id', 'project'),
+    ('label', 'project_id', 'project'),
+    ('project_permission', 'project_id', 'project'),
+    ('annotation', 'image_id', 'image'),
+    ('annotation', 'project_id', 'project'),
+    ('annotation', 'label_id', 'label'),
+]
+
+UPGRADE_STATEMENTS = [
+    # Expiry of the revoked tokens, for prune-tokens
+    'ALTER TABLE invoken_token '
+    'ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP WITHOUT TIME ZONE',
+    'CREATE INDEX IF NOT EXISTS ix_invoken_token_expires_at '
+    'ON invoken_token (expires_at)',
+    # Version of the claims of the tokens of a user
+    'ALTER TABLE "user" '
+    'ADD COLUMN IF NOT EXISTS permission_version INTEGER NOT NULL DEFAULT 0',
+    # One permission per user and project, the most recent one is kept
+    'DELETE FROM project_permission AS old USING project_permission AS new '
+    'WHERE old.user_id = new.user_id AND old.project_id = new.project_id '
+    'AND old.id < new.id',
+    'ALTER TABLE project_permission '
+    'DROP CONSTRAINT IF EXISTS uq_project_permission_user_project, '
+    'ADD CONSTRAINT uq_project_permission_user_project '
+    'UNIQUE (user_id, project_id)',
+    # Tombstone of the projects deleted in the background
+    'ALTER TABLE project '
+    'ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITHOUT TIME ZONE',
+    # Images of zips not extracted yet, and content-addressed images
+    'ALTER TABLE image '
+    'ADD COLUMN IF NOT EXISTS ready BOOLEAN NOT NULL DEFAULT TRUE',
+    'ALTER TABLE image ADD COLUMN IF NOT EXISTS digest VARCHAR(64)',
+    'ALTER TABLE image DROP CONSTRAINT IF EXISTS image_digest_fkey, '
+    'ADD CONSTRAINT image_digest_fkey FOREIGN KEY (digest) '
+    'REFERENCES blob (digest)',
+    'CREATE INDEX IF NOT EXISTS ix_image_digest ON image (digest)',
+    # Keyset pagination of the image listings
+    'CREATE INDEX IF NOT EXISTS ix_image_project_id_id '
+    'ON image (project_id, id)',
+] + [
+    'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_{column}_fkey, '
+    'ADD CONSTRAINT {table}_{column}_fkey FOREIGN KEY ({column}) '
+    'REFERENCES {parent} (id) ON DELETE CASCADE'.format(
+        table=table, column=column, parent=parent)
+    for table, column, parent in _CASCADE_FOREIGN_KEYS
+]
+
+
+def upgrade_schema():
+    """Create the missing tables, then bring the existing tables to the
+    current schema, in one transaction.
+
+    Raises:
+        RuntimeError if the database is not PostgreSQL
+    """
+    if db.engine.dialect.name != 'postgresql':
+        raise RuntimeError('Schema upgrades require PostgreSQL, the %s '
+                           'database is created from scratch' %
+                           db.engine.dialect.name)
+    db.create_all()
+    for statement in UPGRADE_STATEMENTS:
+        db.session.execute(statement)
+    db.session.commit()
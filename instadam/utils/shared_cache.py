@@ -0,0 +1,169 @@
+"""Permission and identity cache shared by all worker processes.
+
+Under uWSGI the entries live in the uWSGI cache framework, which is shared
+memory visible to every worker (see `cache2` in uwsgi.ini). Elsewhere, and in
+tests, a local in-memory backend stands in for it.
+
+Every key is namespaced by a generation counter. Writes that change
+permissions bump the generation after committing, which makes every entry
+cached before unreachable in all workers at once. Readers take the generation
+before reading the database, and store what they read under that generation,
+so a value read before a bump is never stored under the new generation.
+"""
+import threading
+import time
+
+from flask import current_app as app
+
+GENERATION_KEY = 'generation'
+
+
+class LocalCacheBackend(object):
+    """In-memory cache backend, shared by the threads of one process only.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value, timeout=0):
+        expires_at = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self.get(key) or 0) + 1
+            self._entries[key] = (str(value), None)
+        return value
+
+
+class UwsgiCacheBackend(object):
+    """Cache backend on top of a cache of the uWSGI cache framework.
+
+    Args:
+        name: Name of the cache declared with `cache2` in uwsgi.ini
+    """
+
+    def __init__(self, name):
+        import uwsgi
+        self._uwsgi = uwsgi
+        self.name = name
+
+    def get(self, key):
+        value = self._uwsgi.cache_get(key, self.name)
+        if value is None:
+            return None
+        return value.decode('utf-8')
+
+    def set(self, key, value, timeout=0):
+        self._uwsgi.cache_update(key, value, timeout, self.name)
+
+    def incr(self, key):
+        self._uwsgi.lock()
+        try:
+            value = int(self.get(key) or 0) + 1
+            self._uwsgi.cache_update(key, str(value), 0, self.name)
+        finally:
+            self._uwsgi.unlock()
+        return value
+
+
+class SharedPermissionCache(object):
+    """Cache of user permission versions and project access types.
+
+    Args:
+        backend: LocalCacheBackend or UwsgiCacheBackend
+        timeout: Seconds an entry is kept, as a safety net next to the
+            generation based invalidation
+    """
+
+    def __init__(self, backend, timeout):
+        self.backend = backend
+        self.timeout = timeout
+
+    def generation(self):
+        """
+        Return the current generation. Must be taken before reading the
+        database, and passed to the `set_*` methods storing what was read.
+        """
+        return self.backend.get(GENERATION_KEY) or '0'
+
+    def _key(self, generation, *parts):
+        if generation is None:
+            generation = self.generation()
+        return ':'.join((generation, ) + tuple(str(part) for part in parts))
+
+    def bump_generation(self):
+        """Invalidate every cached entry in all worker processes."""
+        self.backend.incr(GENERATION_KEY)
+
+    def get_permission_version(self, user_id, generation=None):
+        value = self.backend.get(self._key(generation, 'pv', user_id))
+        return int(value) if value is not None else None
+
+    def set_permission_version(self, user_id, permission_version,
+                               generation=None):
+        self.backend.set(
+            self._key(generation, 'pv', user_id), str(permission_version),
+            self.timeout)
+
+    def get_access_type(self, user_id, project_id, generation=None):
+        """
+        Return the cached access type value of the user to the project, '' if
+        the user is known to have no access, or None if not cached.
+        """
+        return self.backend.get(
+            self._key(generation, 'access', user_id, project_id))
+
+    def set_access_type(self, user_id, project_id, access_type,
+                        generation=None):
+        self.backend.set(
+            self._key(generation, 'access', user_id, project_id),
+            access_type.value if access_type is not None else '',
+            self.timeout)
+
+
+def _create_backend():
+    backend = app.config['SHARED_CACHE_BACKEND']
+    if backend in ('auto', 'uwsgi'):
+        try:
+            return UwsgiCacheBackend(app.config['SHARED_CACHE_NAME'])
+        except ImportError:
+            if backend == 'uwsgi':
+                raise
+    return LocalCacheBackend()
+
+
+def get_shared_cache():
+    """
+    Return the shared permission cache of the current app. And create one if
+    doesn't exist.
+
+    Returns:
+        SharedPermissionCache
+    """
+    cache = app.extensions.get('instadam_shared_cache')
+    if cache is None:
+        cache = SharedPermissionCache(_create_backend(),
+                                      app.config['SHARED_CACHE_TIMEOUT'])
+        app.extensions['instadam_shared_cache'] = cache
+    return cache
+
+
+def invalidate_permission_cache():
+    """
+    Invalidate the cached permissions in all worker processes. Must be called
+    after committing the change of permissions.
+    """
+    get_shared_cache().bump_generation()
@@ -0,0 +1,266 @@
+"""Storage of the image files.
+
+Image files are kept by a storage backend, selected with `STORAGE_BACKEND`:
+the local filesystem under `STATIC_STORAGE_DIR`, or an S3 compatible object
+store such as AWS S3 or MinIO, which requires boto3. Every backend has the
+same interface:
+
+* `path(*parts)` and `url(*parts)` build the storage path of a file, kept in
+  `Image.image_storage_path`, and the url it is served at
+* `put(storage_path, local_path)` moves a local file to the storage
+* `get`, `open` and `stream` read a file whole, as a file object or in chunks
+* `stat` returns the size of a file, or None if it doesn't exist
+* `move(storage_path, new_storage_path)` moves a file within the storage
+* `delete` and `delete_prefix` remove a file, or every file under a path
+* `serve(storage_path, mimetype)` returns a response sending the file to the
+  client, without the app reading the file
+
+Uploads are received in the local `UPLOAD_DIR_NAME` directory first, and
+handed to the backend once complete. For the local backend that is a rename.
+
+The files of a project are spread over `STORAGE_SHARD_LEVELS` levels of
+directories named after the leading characters of their random names, which
+keeps directories small for projects of hundreds of thousands of images.
+"""
+import os
+import shutil
+import tempfile
+from urllib.parse import quote
+
+from flask import Response, redirect, send_file
+from flask import current_app as app
+
+
+class LocalStorage(object):
+    """Storage backend keeping the files in a local directory. Storage paths
+    are filesystem paths.
+
+    Args:
+        root: Directory of the files
+        url_root: Url path the directory is served at
+        accel_location: Internal nginx location of the directory. Files are
+            then sent by nginx with X-Accel-Redirect, otherwise by the app
+    """
+
+    def __init__(self, root, url_root, accel_location=None):
+        self.root = root
+        self.url_root = url_root
+        self.accel_location = accel_location
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def url(self, *parts):
+        return os.path.join(self.url_root, *parts)
+
+    def put(self, storage_path, local_path):
+        os.makedirs(os.path.dirname(storage_path), exist_ok=True)
+        os.replace(local_path, storage_path)
+
+    def move(self, storage_path, new_storage_path):
+        self.put(new_storage_path, storage_path)
+
+    def get(self, storage_path):
+        with open(storage_path, 'rb') as fd:
+            return fd.read()
+
+    def open(self, storage_path):
+        return open(storage_path, 'rb')
+
+    def stream(self, storage_path, chunk_size=1024 * 1024):
+        with open(storage_path, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(chunk_size), b''):
+                yield chunk
+
+    def stat(self, storage_path):
+        try:
+            return os.path.getsize(storage_path)
+        except OSError:
+            return None
+
+    def delete(self, storage_path):
+        try:
+            os.remove(storage_path)
+        except OSError:
+            pass
+
+    def delete_prefix(self, *parts):
+        shutil.rmtree(self.path(*parts), ignore_errors=True)
+
+    def serve(self, storage_path, mimetype):
+        if self.accel_location:
+            # nginx sends the file, and answers Range requests itself
+            relative_path = os.path.relpath(storage_path, self.root)
+            response = Response(mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = '%s/%s' % (
+                self.accel_location.rstrip('/'),
+                quote(relative_path.replace(os.sep, '/')))
+            return response
+        # Sent with the file wrapper of the server (sendfile under uWSGI),
+        # and with support for Range and conditional requests
+        return send_file(
+            os.path.abspath(storage_path), mimetype=mimetype,
+            conditional=True)
+
+
+class S3Storage(object):
+    """Storage backend keeping the files in a bucket of an S3 compatible
+    object store. Storage paths are object keys.
+
+    Args:
+        bucket: Name of the bucket
+        prefix: Prefix of the keys of the files
+        url_root: Url the bucket is served at
+        endpoint_url: Url of the object store, None for AWS S3
+        url_expiry: Seconds the presigned urls of the served files are valid
+            for
+        spool_size: Files bigger than this many bytes are spooled to a
+            temporary file when opened, instead of kept in memory
+    """
+
+    def __init__(self, bucket, prefix, url_root, endpoint_url=None,
+                 url_expiry=300, spool_size=16 * 1024 * 1024):
+        import boto3  # Fails early if the optional dependency is missing
+        self._boto3 = boto3
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.url_root = url_root
+        self.endpoint_url = endpoint_url
+        self.url_expiry = url_expiry
+        self.spool_size = spool_size
+        self._client = None
+
+    def __getstate__(self):
+        # Clients can't be pickled, processes of a pool create their own
+        state = self.__dict__.copy()
+        state.update(_boto3=None, _client=None)
+        return state
+
+    @property
+    def client(self):
+        if self._client is None:
+            if self._boto3 is None:
+                import boto3
+                self._boto3 = boto3
+            self._client = self._boto3.client(
+                's3', endpoint_url=self.endpoint_url)
+        return self._client
+
+    def path(self, *parts):
+        return '/'.join(part for part in (self.prefix, ) + parts if part)
+
+    def url(self, *parts):
+        return '/'.join((self.url_root.rstrip('/'), ) + parts)
+
+    def put(self, storage_path, local_path):
+        self.client.upload_file(local_path, self.bucket, storage_path)
+        os.remove(local_path)
+
+    def move(self, storage_path, new_storage_path):
+        self.client.copy({
+            'Bucket': self.bucket,
+            'Key': storage_path
+        }, self.bucket, new_storage_path)
+        self.delete(storage_path)
+
+    def get(self, storage_path):
+        return self.client.get_object(
+            Bucket=self.bucket, Key=storage_path)['Body'].read()
+
+    def open(self, storage_path):
+        fd = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        self.client.download_fileobj(self.bucket, storage_path, fd)
+        fd.seek(0)
+        return fd
+
+    def stream(self, storage_path, chunk_size=1024 * 1024):
+        body = self.client.get_object(
+            Bucket=self.bucket, Key=storage_path)['Body']
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                yield chunk
+        finally:
+            body.close()
+
+    def stat(self, storage_path):
+        try:
+            return self.client.head_object(
+                Bucket=self.bucket, Key=storage_path)['ContentLength']
+        except self.client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+
+    def delete(self, storage_path):
+        self.client.delete_object(Bucket=self.bucket, Key=storage_path)
+
+    def delete_prefix(self, *parts):
+        paginator = self.client.get_paginator('list_objects_v2')
+        # Pages hold at most 1000 keys, as many as a delete request takes
+        for page in paginator.paginate(
+                Bucket=self.bucket, Prefix=self.path(*parts) + '/'):
+            objects = [{
+                'Key': item['Key']
+            } for item in page.get('Contents', [])]
+            if objects:
+                self.client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={'Objects': objects, 'Quiet': True})
+
+    def serve(self, storage_path, mimetype):
+        # The object store sends the file, and answers Range requests itself
+        return redirect(
+            self.client.generate_presigned_url(
+                'get_object',
+                Params={
+                    'Bucket': self.bucket,
+                    'Key': storage_path,
+                    'ResponseContentType': mimetype
+                },
+                ExpiresIn=self.url_expiry))
+
+
+def get_image_parts(project_id, file_name, levels):
+    """
+    Return the path parts of the file of an image, in the directory of its
+    project.
+    Args:
+        project_id: The id of the project of the image
+        file_name: Random name of the file
+        levels: Number of levels of shard directories, 0 for none
+
+    Returns:
+        Tuple of parts for `path` and `url`, for example
+        ('1', 'b2', '68', 'b268235e-37c6-4863-805e-77175a574647.jpg')
+    """
+    shards = tuple(file_name[2 * level:2 * level + 2]
+                   for level in range(levels))
+    return (str(project_id), ) + shards + (file_name, )
+
+
+def get_storage():
+    """
+    Return the storage backend of the current app. And create one if doesn't
+    exist.
+
+    Returns:
+        LocalStorage or S3Storage
+    """
+    storage = app.extensions.get('instadam_storage')
+    if storage is None:
+        if app.config['STORAGE_BACKEND'] == 's3':
+            storage = S3Storage(
+                app.config['STORAGE_S3_BUCKET'],
+                app.config['STORAGE_S3_PREFIX'],
+                app.config['STORAGE_S3_URL']
+                or app.config['STATIC_STORAGE_URL'],
+                app.config['STORAGE_S3_ENDPOINT_URL'],
+                app.config['STORAGE_S3_URL_EXPIRY'])
+        else:
+            storage = LocalStorage(
+                app.config['STATIC_STORAGE_DIR'],
+                app.config['STATIC_STORAGE_URL'],
+                app.config['STORAGE_ACCEL_REDIRECT_LOCATION'])
+        app.extensions['instadam_storage'] = storage
+    return storage
+
@@ -0,0 +1,259 @@
+"""Thumbnail rendering and the on-disk thumbnail cache.
+
+Rendered thumbnails are kept under `STATIC_STORAGE_DIR`, one file per (image,
+size, format), with a configurable byte budget. The modification time of a
+file is its last access time, and the least recently used files are evicted
+once the cache grows over budget. The cache key includes a version derived
+from the stored file of the image, so a changed file never serves a stale
+thumbnail, while saving annotations leaves the thumbnails cached.
+"""
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+from io import BytesIO
+
+from PIL import Image as PILImage
+from flask import abort
+from flask import current_app as app
+
+from instadam.utils.storage import get_storage
+
+# Fraction of the budget the cache is brought down to when evicting
+EVICTION_TARGET = 0.9
+
+# Supported thumbnail formats and their mimetypes
+THUMBNAIL_FORMATS = {'png': 'image/png', 'webp': 'image/webp'}
+
+
+def get_image_version(image):
+    """
+    Return the version of the file of the image used in thumbnail cache keys
+    and entity tags: the digest of the file in content-addressed storage,
+    otherwise derived from its storage path. Stored files have unique names
+    and are never rewritten, so the storage isn't looked at.
+    Args:
+        image: Image, or a row with its digest and image_storage_path
+
+    Returns:
+        str
+    """
+    if image.digest is not None:
+        return image.digest
+    return hashlib.sha1(image.image_storage_path.encode('utf-8')).hexdigest()
+
+
+def get_thumbnail_etag(image, size, fmt):
+    """
+    Return the entity tag of a thumbnail, which changes whenever the file of
+    the image changes.
+    Args:
+        image: Image
+        size: Normalized size of the thumbnail
+        fmt: Output format
+
+    Returns:
+        str
+    """
+    key = '%d:%s:%dx%d:%s' % (image.id, get_image_version(image), size[0],
+                              size[1], fmt)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _encode_thumbnail(img, size, fmt):
+    img.thumbnail(size, PILImage.LANCZOS)
+    buffer = BytesIO()
+    img.save(buffer, format=fmt.upper())
+    return buffer.getvalue()
+
+
+def render_thumbnail(storage, storage_path, size, fmt):
+    """
+    Decode the original image and render a thumbnail of it.
+    Args:
+        storage: Storage backend of the original image, see utils/storage.py
+        storage_path: Storage path of the original image
+        size: (width, height) bound of the thumbnail
+        fmt: Output format, for example 'png'
+
+    Returns:
+        Encoded thumbnail bytes
+    """
+    with storage.open(storage_path) as fd:
+        return _encode_thumbnail(PILImage.open(fd), size, fmt)
+
+
+def render_thumbnails(storage, storage_path, sizes, fmt):
+    """
+    Decode the original image once and render a thumbnail of it for each
+    size.
+    Args:
+        storage: Storage backend of the original image
+        storage_path: Storage path of the original image
+        sizes: List of (width, height) bounds
+        fmt: Output format
+
+    Returns:
+        Generator of (size, encoded thumbnail bytes)
+    """
+    with storage.open(storage_path) as fd:
+        img = PILImage.open(fd)
+        img.load()
+    for size in sizes:
+        yield size, _encode_thumbnail(img.copy(), size, fmt)
+
+
+class ThumbnailCache(object):
+    """On-disk LRU cache of rendered thumbnails.
+
+    Args:
+        cache_dir: Directory holding the cached thumbnails
+        max_bytes: Byte budget of the cache
+        scan_interval: Number of writes after which the size of the cache is
+            recomputed from disk, since other processes write to it too
+    """
+
+    def __init__(self, cache_dir, max_bytes, scan_interval=256):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.scan_interval = scan_interval
+        self._size = None
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def path(self, project_id, image_id, size, fmt, version):
+        return os.path.join(self.cache_dir, str(project_id), str(image_id),
+                            '%dx%d-%s.%s' % (size[0], size[1], version, fmt))
+
+    def get(self, project_id, image_id, size, fmt, version):
+        """
+        Return the cached thumbnail, or None if not cached.
+        """
+        path = self.path(project_id, image_id, size, fmt, version)
+        try:
+            with open(path, 'rb') as fd:
+                data = fd.read()
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            return None
+        return data
+
+    def put(self, project_id, image_id, size, fmt, version, data):
+        """
+        Store a thumbnail, evicting the least recently used ones if the cache
+        goes over budget.
+        """
+        path = self.path(project_id, image_id, size, fmt, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as fd:
+            fd.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._writes += 1
+            if self._size is None or self._writes >= self.scan_interval:
+                self._size = self._scan_size()
+                self._writes = 0
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._size = self.evict(int(self.max_bytes * EVICTION_TARGET))
+
+    def invalidate(self, project_id, image_id=None):
+        """
+        Drop the cached thumbnails of an image, or of a whole project if no
+        image id is given.
+        """
+        path = os.path.join(self.cache_dir, str(project_id))
+        if image_id is not None:
+            path = os.path.join(path, str(image_id))
+        shutil.rmtree(path, ignore_errors=True)
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, target_bytes):
+        """
+        Remove the least recently used thumbnails until the cache is at most
+        `target_bytes` big.
+
+        Returns:
+            The size of the cache after eviction
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= target_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        return total
+
+
+def get_thumbnail_cache():
+    """
+    Return the thumbnail cache of the current app. And create one if doesn't
+    exist.
+
+    Returns:
+        ThumbnailCache
+    """
+    cache = app.extensions.get('instadam_thumbnails')
+    if cache is None:
+        cache = ThumbnailCache(
+            os.path.join(app.config['STATIC_STORAGE_DIR'],
+                         app.config['THUMBNAIL_CACHE_DIR_NAME']),
+            app.config['THUMBNAIL_CACHE_MAX_BYTES'])
+        app.extensions['instadam_thumbnails'] = cache
+    return cache
+
+
+def normalize_size(size_h, size_w):
+    """
+    Clamp the requested thumbnail size to the supported range, which also
+    bounds the number of cached sizes per image.
+
+    Raises:
+        400 if the size is not an integer
+    """
+    max_size = app.config['THUMBNAIL_MAX_SIZE']
+    try:
+        size_h, size_w = int(size_h), int(size_w)
+    except ValueError:
+        abort(400, 'Invalid thumbnail size')
+    return (min(max(size_h, 1), max_size), min(max(size_w, 1), max_size))
+
+
+def get_thumbnail(image, size, fmt='png'):
+    """
+    Return the thumbnail of the image, from the cache if possible.
+    Args:
+        image: Image
+        size: Normalized size of the thumbnail, see `normalize_size`
+        fmt: Output format
+
+    Returns:
+        Encoded thumbnail bytes
+    """
+    cache = get_thumbnail_cache()
+    version = get_image_version(image)
+    data = cache.get(image.project_id, image.id, size, fmt, version)
+    if data is None:
+        data = render_thumbnail(get_storage(), image.image_storage_path, size,
+                                fmt)
+        cache.put(image.project_id, image.id, size, fmt, version, data)
+    return data
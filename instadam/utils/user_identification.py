@@ -1,9 +1,93 @@
-from instadam.models.user import User, PrivilegesEnum
+"""Helpers to identify the logged in user from the custom claims of the token
+"""
 from flask import abort
 
+from instadam.app import db
+from instadam.models.user import PrivilegesEnum, User
+from instadam.utils.request_context import get_request_context
+from instadam.utils.shared_cache import get_shared_cache
 
-def check_user_admin_privilege(username):
-    user = User.query.filter_by(username=username).first()
-    if user.privileges != PrivilegesEnum.ADMIN:
+
+def user_claims(user):
+    """
+    Construct the custom claims embedded in the access token of the user.
+    Args:
+        user: The user
+
+    Returns:
+        A dict of the user id, privileges and permission version
+    """
+    return {
+        'id': user.id,
+        'privileges': user.privileges.value,
+        'permission_version': user.permission_version
+    }
+
+
+def get_current_user_id():
+    """
+    Return the id of the logged in user without querying the database.
+    """
+    return get_request_context().user_id
+
+
+def get_current_user_privileges():
+    """
+    Return the privileges of the logged in user without querying the database.
+    """
+    return get_request_context().privileges
+
+
+def get_current_user():
+    """
+    Load the logged in user from the database, once per request.
+    """
+    return get_request_context().user
+
+
+def check_user_admin_privilege():
+    """
+    Check the logged in user is an admin.
+
+    Raises:
+        401 if the logged in user is not an admin
+    """
+    if get_current_user_privileges() != PrivilegesEnum.ADMIN:
         abort(401, 'Logged in user is not an admin.')
-    return user
+
+
+def bump_permission_version(user):
+    """
+    Invalidate the claims in the tokens issued to the user. Should be called
+    whenever the identity or the privileges of the user change. The caller is
+    responsible for committing the session and then calling
+    `invalidate_permission_cache`.
+    Args:
+        user: The user
+    """
+    user.permission_version = User.permission_version + 1
+
+
+def is_permission_version_current(user_id, permission_version):
+    """
+    Check the permission version in the claims is still the current one.
+    Versions are kept in the cache shared by all worker processes.
+    Args:
+        user_id: The id of the user
+        permission_version: The permission version in the claims
+
+    Returns:
+        True if the claims are up to date
+    """
+    cache = get_shared_cache()
+    # Taken before the database read, so a version read before a concurrent
+    # invalidation is not stored under the new generation
+    generation = cache.generation()
+    current_version = cache.get_permission_version(user_id, generation)
+    if current_version is None:
+        current_version = db.session.query(User.permission_version).filter_by(
+            id=user_id).scalar()
+        if current_version is None:
+            return False
+        cache.set_permission_version(user_id, current_version, generation)
+    return current_version == permission_version
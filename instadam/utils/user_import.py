@@ -0,0 +1,189 @@
+"""Bulk import of users, shared by the import endpoint and manage.py
+"""
+import csv
+import datetime as dt
+import io
+import json
+
+from flask import abort
+from flask import current_app as app
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import HTTPException
+
+from instadam.app import db
+from instadam.auth import credential_checking, email_checking
+from instadam.models.project import Project
+from instadam.models.project_permission import AccessTypeEnum, ProjectPermission
+from instadam.models.user import PrivilegesEnum, User
+from instadam.utils.password import hash_passwords
+
+PRIVILEGE_MAP = {
+    'admin': PrivilegesEnum.ADMIN,
+    'annotator': PrivilegesEnum.ANNOTATOR
+}
+
+ACCESS_TYPE_MAP = {
+    'r': AccessTypeEnum.READ_ONLY,
+    'rw': AccessTypeEnum.READ_WRITE,
+}
+
+
+def parse_user_file(fd, file_name):
+    """
+    Parse the users to import from a CSV or JSON file. CSV files must have a
+    header row with `username`, `email`, `password` and optionally `privilege`.
+    JSON files hold a list of objects with the same keys.
+    Args:
+        fd: Binary file object
+        file_name: Name of the file, its extension selects the format
+
+    Raises:
+        400 if the file can't be parsed
+        415 if the file is neither CSV nor JSON
+
+    Returns:
+        List of dicts
+    """
+    extension = file_name.lower().rsplit('.', 1)[-1]
+    text = io.TextIOWrapper(fd, encoding='utf-8-sig')
+    if extension == 'csv':
+        return list(csv.DictReader(text))
+    if extension == 'json':
+        try:
+            records = json.load(text)
+        except ValueError:
+            abort(400, 'Invalid json file %s' % file_name)
+        if not isinstance(records, list):
+            abort(400, 'Json file %s should contain a list' % file_name)
+        return records
+    abort(415, 'Invalid file extension for %s' % file_name)
+
+
+def _validate(records):
+    usernames = set()
+    emails = set()
+    for row, record in enumerate(records, 1):
+        if not isinstance(record, dict):
+            abort(400, 'Row %d: Invalid user' % row)
+        for key in ('username', 'email', 'password'):
+            if not record.get(key):
+                abort(400, 'Row %d: Missing %s' % (row, key))
+        try:
+            credential_checking(record['password'])
+            email_checking(record['email'])
+        except HTTPException as exception:
+            abort(400, 'Row %d: %s' % (row, exception.description))
+        privilege = record.get('privilege') or 'annotator'
+        if privilege not in PRIVILEGE_MAP:
+            abort(400, 'Row %d: Invalid privilege %s' % (row, privilege))
+        if record['username'] in usernames or record['email'] in emails:
+            abort(400,
+                  'Row %d: Duplicate user %s' % (row, record['username']))
+        usernames.add(record['username'])
+        emails.add(record['email'])
+
+    existing = []
+    batch_size = app.config['USER_IMPORT_BATCH_SIZE']
+    for start in range(0, len(records), batch_size):
+        batch = records[start:start + batch_size]
+        existing.extend(
+            username for username, in db.session.query(User.username).filter(
+                or_(
+                    User.username.in_(
+                        [record['username'] for record in batch]),
+                    User.email.in_([record['email'] for record in batch]))))
+    if existing:
+        abort(400, 'User/Email already exist: %s' % ', '.join(existing))
+
+
+def import_users(records, grants=(), hash_processes=0):
+    """
+    Validate, hash and insert users in a single transaction, optionally
+    granting them permissions to projects. The rows are inserted with batched
+    multi-row statements.
+    Args:
+        records: List of dicts with `username`, `email`, `password` and
+            optionally `privilege` ('admin' or 'annotator', the default)
+        grants: List of (project_id, access_type) with access_type one of 'r'
+            or 'rw', granted to every imported user. Repeated grants are
+            granted once
+        hash_processes: Number of processes hashing the passwords in
+            parallel, for the command line. 0 to hash them in the password
+            hashing slots shared with the logins, for requests
+
+    Raises:
+        400 if any user is invalid or already exists, any grant is invalid,
+            or a project is granted with two access types
+        404 if a project to grant permission to does not exist
+        503 if a password can't get a hashing slot in time
+
+    Returns:
+        List of the imported usernames
+    """
+    if not records:
+        abort(400, 'No user to import')
+    _validate(records)
+
+    granted = {}
+    for project_id, access_type in grants:
+        if access_type not in ACCESS_TYPE_MAP:
+            abort(400, 'Not able to interpret access_type.')
+        try:
+            project_id = int(project_id)
+        except (TypeError, ValueError):
+            abort(400, 'Invalid project id %s' % project_id)
+        # A project granted twice the same way is granted once
+        if granted.get(project_id, access_type) != access_type:
+            abort(400, 'Conflicting access types for project with id=%s' %
+                  project_id)
+        if project_id in granted:
+            continue
+        if Project.query.filter_by(id=project_id,
+                                   deleted_at=None).first() is None:
+            abort(404, 'Project with id=%s does not exist' % project_id)
+        granted[project_id] = access_type
+    access_types = [(project_id, ACCESS_TYPE_MAP[access_type])
+                    for project_id, access_type in granted.items()]
+
+    hashes = hash_passwords([record['password'] for record in records],
+                            hash_processes)
+    now = dt.datetime.utcnow()
+    rows = [{
+        'username': record['username'],
+        'email': record['email'],
+        'password': pwhash,
+        'privileges': PRIVILEGE_MAP[record.get('privilege') or 'annotator'],
+        'permission_version': 0,
+        'created_at': now,
+        'updated_at': now,
+    } for record, pwhash in zip(records, hashes)]
+
+    batch_size = app.config['USER_IMPORT_BATCH_SIZE']
+    table = User.__table__
+    returning = db.session.get_bind().dialect.implicit_returning
+    try:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            if not access_types:
+                db.session.execute(table.insert().values(batch))
+                continue
+            if returning:
+                user_ids = [user_id for user_id, in db.session.execute(
+                    table.insert().values(batch).returning(table.c.id))]
+            else:
+                db.session.execute(table.insert().values(batch))
+                user_ids = [user_id for user_id, in db.session.query(
+                    User.id).filter(
+                    User.username.in_([row['username'] for row in batch]))]
+            db.session.execute(ProjectPermission.__table__.insert().values([{
+                'user_id': user_id,
+                'project_id': project_id,
+                'access_type': access_type
+            } for user_id in user_ids for project_id, access_type in
+                access_types]))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        abort(400, 'User/Email already exist')
+    return [row['username'] for row in rows]
@@ -0,0 +1,93 @@
+"""Extraction of uploaded zip files, serially or across worker processes.
+
+Decompressing members is CPU bound, so large archives are extracted by a pool
+of worker processes. Each worker opens its own `ZipFile` handle once, and the
+member list is partitioned into batches handed out to the workers. Batches
+are reported back in order as they complete, which lets the caller record
+the progress of the extraction.
+"""
+import hashlib
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from zipfile import BadZipFile, ZipFile
+
+# Errors of a single zip member, which don't fail the whole extraction
+MEMBER_ERRORS = (BadZipFile, EOFError, IOError, KeyError, NotImplementedError,
+                 RuntimeError, zlib.error)
+
+# ZipFile handle of a worker process
+_worker_zip_file = None
+
+
+def _extract_member(zip_file, name, path, chunk_size, digest):
+    member_hash = hashlib.sha256() if digest else None
+    try:
+        with zip_file.open(name) as src, open(path, 'wb') as dst:
+            for chunk in iter(lambda: src.read(chunk_size), b''):
+                if member_hash is not None:
+                    member_hash.update(chunk)
+                dst.write(chunk)
+    except MEMBER_ERRORS as e:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return name, str(e), None
+    return name, None, member_hash and member_hash.hexdigest()
+
+
+def _open_worker_zip_file(zip_path):
+    global _worker_zip_file
+    _worker_zip_file = ZipFile(zip_path)
+
+
+def _extract_batch(batch, chunk_size, digest):
+    return [
+        _extract_member(_worker_zip_file, name, path, chunk_size, digest)
+        for name, path in batch
+    ]
+
+
+def unzip_process(zip_path, members, chunk_size, processes=1,
+                  batch_size=100, digest=False):
+    """
+    Extract members of a zip file. Members are streamed to their path in
+    chunks, and a member that can't be extracted doesn't stop the extraction
+    of the others.
+    Args:
+        zip_path: Path to the zip file
+        members: List of (member name, path to extract it to)
+        chunk_size: Number of bytes extracted at once
+        processes: Number of worker processes, 1 to extract in this process
+        batch_size: Number of members handed to a worker at once
+        digest: Whether to hash the members as they are extracted
+
+    Returns:
+        Generator of (member name, None or the error message of the member,
+        hex SHA-256 digest of the member if hashed), in the order of
+        `members`
+    """
+    if processes <= 1 or len(members) <= batch_size:
+        with ZipFile(zip_path) as zip_file:
+            for name, path in members:
+                yield _extract_member(zip_file, name, path, chunk_size,
+                                      digest)
+        return
+
+    # Open the zip once here, so that a corrupted zip fails the whole
+    # extraction instead of every batch
+    ZipFile(zip_path).close()
+    batches = [
+        members[start:start + batch_size]
+        for start in range(0, len(members), batch_size)
+    ]
+    with ProcessPoolExecutor(
+            max_workers=min(processes, len(batches)),
+            initializer=_open_worker_zip_file,
+            initargs=(zip_path, )) as executor:
+        for results in executor.map(_extract_batch, batches,
+                                    [chunk_size] * len(batches),
+                                    [digest] * len(batches)):
+            for result in results:
+                yield result
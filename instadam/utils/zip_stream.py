@@ -0,0 +1,231 @@
+"""Extraction of zip archives read sequentially from a stream.
+
+A zip archive keeps its table of contents, the central directory, at the end.
+But every member is also preceded by a local header holding its name and
+compression method, which is enough to extract the members one after the
+other while the archive is still arriving, without ever seeking back.
+
+This works as long as the end of the data of each member can be found from
+its local header: either the header holds the compressed size, or the member
+is deflated, in which case the deflate stream marks its own end. Archives
+with encrypted members, with compression methods other than stored and
+deflated, or with stored members whose size is only known from a data
+descriptor can't be streamed and raise `ZipStreamUnsupported`.
+"""
+import struct
+import zlib
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+# Signatures of the records following the last member
+END_SIGNATURES = {0x02014b50, 0x05054b50, 0x06054b50, 0x06064b50, 0x08064b50}
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+FLAG_ENCRYPTED = 0x1
+FLAG_DATA_DESCRIPTOR = 0x8
+FLAG_UTF8 = 0x800
+
+ZIP64_EXTRA_ID = 0x0001
+ZIP64_LIMIT = 0xFFFFFFFF
+
+
+class ZipStreamError(Exception):
+    """The archive is corrupted or truncated."""
+
+
+class ZipStreamUnsupported(ZipStreamError):
+    """The layout of the archive doesn't allow extracting it sequentially."""
+
+
+class _Reader(object):
+    """Reads a stream exactly, with a buffer to push back read ahead bytes.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = b''
+
+    def read(self, size):
+        if self.buffer:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+            return data
+        return self.stream.read(size)
+
+    def read_exact(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.read(size - len(data))
+            if not chunk:
+                raise ZipStreamError('Unexpected end of zip file')
+            data += chunk
+        return data
+
+    def unread(self, data):
+        self.buffer = data + self.buffer
+
+
+def _parse_zip64_extra(extra, compressed_size, size):
+    """Return the sizes of a member, reading the zip64 extra field if the
+    local header doesn't hold them."""
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, length = struct.unpack_from('<HH', extra, offset)
+        if header_id == ZIP64_EXTRA_ID:
+            values = extra[offset + 4:offset + 4 + length]
+            fields = list(struct.unpack_from('<%dQ' % (len(values) // 8),
+                                             values))
+            if size == ZIP64_LIMIT and fields:
+                size = fields.pop(0)
+            if compressed_size == ZIP64_LIMIT and fields:
+                compressed_size = fields.pop(0)
+            return compressed_size, size, True
+        offset += 4 + length
+    return compressed_size, size, False
+
+
+class ZipStreamMember(object):
+    """A member of a zip archive being read from a stream. Its data can only
+    be read once, with either `copy_to` or `skip`.
+
+    Attributes:
+        name: Name of the member in the archive
+    """
+
+    def __init__(self, reader, name, method, flags, crc, compressed_size,
+                 zip64, chunk_size):
+        self.name = name
+        self._reader = reader
+        self._method = method
+        self._has_descriptor = bool(flags & FLAG_DATA_DESCRIPTOR)
+        self._crc = crc
+        self._compressed_size = compressed_size
+        self._zip64 = zip64
+        self._chunk_size = chunk_size
+        self.consumed = False
+
+    def _raw_chunks(self):
+        remaining = self._compressed_size
+        while remaining > 0:
+            chunk = self._reader.read(min(self._chunk_size, remaining))
+            if not chunk:
+                raise ZipStreamError('Unexpected end of zip file')
+            remaining -= len(chunk)
+            yield chunk
+
+    def _inflated_chunks(self):
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        if self._has_descriptor:
+            # The compressed size is unknown, read until the deflate stream
+            # ends and push back what was read past it
+            while not decompressor.eof:
+                chunk = self._reader.read(self._chunk_size)
+                if not chunk:
+                    raise ZipStreamError('Unexpected end of zip file')
+                yield self._decompress(decompressor, chunk)
+            self._reader.unread(decompressor.unused_data)
+        else:
+            for chunk in self._raw_chunks():
+                yield self._decompress(decompressor, chunk)
+            if not decompressor.eof:
+                raise ZipStreamError('Corrupted member %s' % self.name)
+        yield decompressor.flush()
+
+    def _decompress(self, decompressor, chunk):
+        try:
+            return decompressor.decompress(chunk)
+        except zlib.error:
+            raise ZipStreamError('Corrupted member %s' % self.name)
+
+    def _read_descriptor(self):
+        data = self._reader.read_exact(4)
+        if struct.unpack('<I', data)[0] == DATA_DESCRIPTOR_SIGNATURE:
+            data = self._reader.read_exact(4)
+        self._crc = struct.unpack('<I', data)[0]
+        self._reader.read_exact(16 if self._zip64 else 8)
+
+    def copy_to(self, fd):
+        """
+        Decompress the member into a file object, in chunks.
+        Args:
+            fd: Binary file object, or None to discard the data
+
+        Raises:
+            ZipStreamError if the data is corrupted
+        """
+        self.consumed = True
+        if self._method == ZIP_STORED:
+            chunks = self._raw_chunks()
+        else:
+            chunks = self._inflated_chunks()
+        crc = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            if fd is not None:
+                fd.write(chunk)
+        if self._has_descriptor:
+            self._read_descriptor()
+        if crc != self._crc:
+            raise ZipStreamError('Bad CRC for member %s' % self.name)
+
+    def skip(self):
+        """
+        Skip the data of the member.
+        """
+        if self.consumed:
+            return
+        if self._has_descriptor:
+            self.copy_to(None)
+            return
+        self.consumed = True
+        for _ in self._raw_chunks():
+            pass
+
+
+def iter_zip_members(stream, chunk_size):
+    """
+    Iterate over the members of a zip archive read from a stream. The data of
+    a member must be read before moving on to the next one, otherwise it is
+    skipped.
+    Args:
+        stream: Binary file object, only read sequentially
+        chunk_size: Number of bytes read at once
+
+    Raises:
+        ZipStreamError if the archive is corrupted
+        ZipStreamUnsupported if the archive can't be extracted sequentially
+
+    Returns:
+        Generator of ZipStreamMember
+    """
+    reader = _Reader(stream)
+    while True:
+        data = reader.read_exact(4)
+        signature = struct.unpack('<I', data)[0]
+        if signature in END_SIGNATURES:
+            return
+        if signature != LOCAL_HEADER_SIGNATURE:
+            raise ZipStreamError('Not a zip file')
+        (_, _, flags, method, _, _, crc, compressed_size, size, name_length,
+         extra_length) = LOCAL_HEADER.unpack(
+             data + reader.read_exact(LOCAL_HEADER.size - 4))
+        raw_name = reader.read_exact(name_length)
+        extra = reader.read_exact(extra_length)
+        name = raw_name.decode('utf-8' if flags & FLAG_UTF8 else 'cp437')
+        compressed_size, size, zip64 = _parse_zip64_extra(
+            extra, compressed_size, size)
+
+        if flags & FLAG_ENCRYPTED:
+            raise ZipStreamUnsupported('Encrypted member %s' % name)
+        if method not in (ZIP_STORED, ZIP_DEFLATED):
+            raise ZipStreamUnsupported(
+                'Unsupported compression for member %s' % name)
+        if method == ZIP_STORED and flags & FLAG_DATA_DESCRIPTOR:
+            raise ZipStreamUnsupported('Unknown size of member %s' % name)
+
+        member = ZipStreamMember(reader, name, method, flags, crc,
+                                 compressed_size, zip64, chunk_size)
+        yield member
+        member.skip()
@@ -5,12 +5,28 @@ Commands:
     initdb          Initialize the database
     cleartable      Clear all the table content
     cleardb         Clear the database
+    upgrade-db      Upgrade the tables of an existing database
+    prune-tokens    Delete expired revoked tokens
+    import-users    Import users from a CSV or JSON file
+    run-jobs        Run the background job workers
+    prune-uploads   Discard abandoned resumable uploads
+    prune-blobs     Remove the unreferenced content-addressed files
+    shard-storage   Move the image files to the shard directories
+    benchmark-unzip Time the extraction of a zip with more and more processes
 
 Usage:
     manage.py start [--mode]
     manage.py initdb [--mode]
     manage.py cleardb [--mode]
     manage.py cleartable [--mode]
+    manage.py upgrade-db [--mode]
+    manage.py prune-tokens [--mode] [--batch-size] [--interval]
+    manage.py import-users FILE [--mode] [--project-id] [--access-type]
+    manage.py run-jobs [--mode] [--workers] [--poll-interval]
+    manage.py prune-uploads [--mode]
+    manage.py prune-blobs [--mode] [--batch-size]
+    manage.py shard-storage [--mode] [--levels] [--batch-size]
+    manage.py benchmark-unzip FILE [--processes] [--chunk-size] [--batch-size]
 
 Options:
     --mode          Start the api on specific mode, one of
@@ -18,10 +34,27 @@ Options:
                     [default : production]
 
 """
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from zipfile import ZipFile
+
 import click
+from werkzeug.exceptions import HTTPException
 
 from instadam.app import create_app, db
+from instadam.models.image import Image
+from instadam.models.revoked_token import RevokedToken
+from instadam.models.upload_session import UploadSession
 from instadam.models.user import PrivilegesEnum, User
+from instadam.utils.content_store import prune_blobs as prune_blob_records
+from instadam.utils.job_queue import run_worker
+from instadam.utils.schema import upgrade_schema
+from instadam.utils.user_import import import_users as import_user_records
+from instadam.utils.user_import import parse_user_file
+from instadam.utils.zip_extract import unzip_process
 
 
 @click.group()
@@ -40,7 +73,7 @@ def deploy():
             db.session.execute(table.delete())
             db.session.commit()
 
-        db.create_all()
+        upgrade_schema()
         admin = User(
             username='admin',
             email='admin@default.com',
@@ -97,5 +130,165 @@ def cleardb(mode):
         db.drop_all()
 
 
+@cli.command()
+@click.option('--mode', default='development', help='production/development')
+def upgrade_db(mode):
+    app = create_app(mode)
+    with app.app_context():
+        try:
+            upgrade_schema()
+        except RuntimeError as exception:
+            raise click.ClickException(str(exception))
+        print('Upgraded the database schema')
+
+
+@cli.command()
+@click.option('--mode', default='development', help='production/development')
+@click.option('--batch-size', default=None, type=int,
+              help='Rows deleted per transaction')
+@click.option('--interval', default=0, type=int,
+              help='Keep pruning every INTERVAL seconds, 0 to prune once')
+def prune_tokens(mode, batch_size, interval):
+    app = create_app(mode)
+    with app.app_context():
+        if batch_size is None:
+            batch_size = app.config['REVOKED_TOKEN_PRUNE_BATCH_SIZE']
+        while True:
+            deleted = RevokedToken.prune_expired(batch_size)
+            print('Pruned %d expired revoked tokens' % deleted)
+            if interval <= 0:
+                break
+            time.sleep(interval)
+
+
+@cli.command()
+@click.argument('file', type=click.File('rb'))
+@click.option('--mode', default='development', help='production/development')
+@click.option('--project-id', multiple=True, type=int,
+              help='Grant the imported users access to this project')
+@click.option('--access-type', default='r', help='r/rw')
+def import_users(file, mode, project_id, access_type):
+    app = create_app(mode)
+    with app.app_context():
+        try:
+            records = parse_user_file(file, file.name)
+            usernames = import_user_records(
+                records, [(pid, access_type) for pid in project_id],
+                app.config['USER_IMPORT_HASH_PROCESSES'])
+        except HTTPException as exception:
+            raise click.ClickException(exception.description)
+        print('Imported %d users' % len(usernames))
+
+
+def job_worker(mode, poll_interval):
+    app = create_app(mode)
+    with app.app_context():
+        run_worker(poll_interval=poll_interval)
+
+
+@cli.command()
+@click.option('--mode', default='development', help='production/development')
+@click.option('--workers', default=None, type=int,
+              help='Number of worker processes')
+@click.option('--poll-interval', default=None, type=float,
+              help='Seconds between polls of the job table when idle')
+def run_jobs(mode, workers, poll_interval):
+    app = create_app(mode)
+    if workers is None:
+        workers = app.config['JOB_WORKERS']
+    processes = [None] * workers
+    try:
+        while True:
+            # Start the workers, and restart the ones that died
+            for i, process in enumerate(processes):
+                if process is None or not process.is_alive():
+                    if process is not None:
+                        print('Job worker %d exited with %s, restarting' %
+                              (i, process.exitcode))
+                    process = multiprocessing.Process(
+                        target=job_worker, args=(mode, poll_interval))
+                    process.start()
+                    processes[i] = process
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+@cli.command()
+@click.option('--mode', default='development', help='production/development')
+def prune_uploads(mode):
+    app = create_app(mode)
+    with app.app_context():
+        discarded = UploadSession.prune_expired(
+            app.config['UPLOAD_SESSION_MAX_AGE'])
+        print('Discarded %d abandoned uploads' % discarded)
+
+
+@cli.command()
+@click.option('--mode', default='development', help='production/development')
+@click.option('--batch-size', default=None, type=int,
+              help='Blobs removed per transaction')
+def prune_blobs(mode, batch_size):
+    app = create_app(mode)
+    with app.app_context():
+        if batch_size is None:
+            batch_size = app.config['BLOB_PRUNE_BATCH_SIZE']
+        pruned = prune_blob_records(batch_size)
+        print('Removed %d unreferenced blobs' % pruned)
+
+
+@cli.command()
+@click.option('--mode', default='development', help='production/development')
+@click.option('--levels', default=None, type=int,
+              help='Levels of shard directories, STORAGE_SHARD_LEVELS by '
+              'default')
+@click.option('--batch-size', default=None, type=int,
+              help='Images moved per transaction')
+def shard_storage(mode, levels, batch_size):
+    app = create_app(mode)
+    with app.app_context():
+        if levels is None:
+            levels = app.config['STORAGE_SHARD_LEVELS']
+        if batch_size is None:
+            batch_size = app.config['STORAGE_SHARD_BATCH_SIZE']
+        moved = Image.shard_storage(levels, batch_size)
+        print('Moved %d image files' % moved)
+
+
+@cli.command()
+@click.argument('file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--processes', multiple=True, type=int,
+              help='Number of processes to try, 1, 2, 4... by default')
+@click.option('--chunk-size', default=1024 * 1024,
+              help='Bytes extracted at once')
+@click.option('--batch-size', default=100,
+              help='Members handed to a process at once')
+def benchmark_unzip(file, processes, chunk_size, batch_size):
+    with ZipFile(file) as zip_file:
+        names = [info.filename for info in zip_file.infolist()
+                 if not info.is_dir()]
+    if not processes:
+        processes = [1]
+        while processes[-1] * 2 <= os.cpu_count():
+            processes.append(processes[-1] * 2)
+    print('Extracting %d members of %s' % (len(names), file))
+    baseline = None
+    for count in processes:
+        output_dir = tempfile.mkdtemp()
+        members = [(name, os.path.join(output_dir, str(i)))
+                   for i, name in enumerate(names)]
+        start = time.perf_counter()
+        failed = sum(1 for _, error, _ in unzip_process(
+            file, members, chunk_size, count, batch_size) if error)
+        elapsed = time.perf_counter() - start
+        shutil.rmtree(output_dir)
+        baseline = baseline or elapsed
+        print('%3d processes: %7.2fs  %5.2fx speedup  %d failed' %
+              (count, elapsed, baseline / elapsed, failed))
+
+
 if __name__ == '__main__':
     cli()  # Execute the function specified by the user.
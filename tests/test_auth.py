@@ -1,8 +1,13 @@
 """Module related to testing authentication (login, signup) 
 functionality
 """
+import os
+
 import pytest
 
+from instadam.models.user import User
+from instadam.utils.password import _acquire_slot
+
 
 def register(client, email, username, password):
     return client.post(
@@ -125,3 +130,83 @@ def test_credential_validation(email, username, password, status, in_json,
     json_data = rv.get_json()
     assert code == status
     assert in_json in json_data
+
+
+def test_refresh(client):
+    rv = register(client, 'someone5@illinois.edu', 'test5', 'Password0')
+    assert rv.status == '201 CREATED'
+    json_data = rv.get_json()
+    assert 'refresh_token' in json_data
+    refresh_token = json_data['refresh_token']
+
+    # Refresh token can't be used as access token
+    rv = client.delete(
+        '/logout', headers={'Authorization': 'Bearer %s' % refresh_token})
+    assert rv.status_code == 422
+
+    rv = client.post(
+        '/refresh', headers={'Authorization': 'Bearer %s' % refresh_token})
+    assert rv.status == '201 CREATED'
+    access_token = rv.get_json()['access_token']
+
+    rv = client.delete(
+        '/logout', headers={'Authorization': 'Bearer %s' % access_token})
+    assert rv.status == '200 OK'
+
+    rv = client.delete(
+        '/logout/refresh',
+        headers={'Authorization': 'Bearer %s' % refresh_token})
+    assert rv.status == '200 OK'
+
+    rv = client.post(
+        '/refresh', headers={'Authorization': 'Bearer %s' % refresh_token})
+    assert rv.status == '401 UNAUTHORIZED'
+
+
+def test_rehash_on_login(client):
+    rv = register(client, 'someone6@illinois.edu', 'test6', 'Password0')
+    assert rv.status == '201 CREATED'
+
+    app = client.application
+    app.config['PASSWORD_HASH_ITERATIONS'] += 1000
+    try:
+        rv = login(client, 'test6', 'Password0')
+        assert rv.status == '201 CREATED'
+        with app.app_context():
+            user = User.query.filter_by(username='test6').first()
+            assert user.password.startswith(
+                'pbkdf2:sha256:%d$' % app.config['PASSWORD_HASH_ITERATIONS'])
+            assert not user.password_needs_rehash()
+            assert user.verify_password('Password0')
+    finally:
+        app.config['PASSWORD_HASH_ITERATIONS'] -= 1000
+
+    # Lowering the policy doesn't weaken the stored hash
+    with app.app_context():
+        stored = User.query.filter_by(username='test6').first().password
+    rv = login(client, 'test6', 'Password0')
+    assert rv.status == '201 CREATED'
+    with app.app_context():
+        user = User.query.filter_by(username='test6').first()
+        assert stored == user.password
+
+
+def test_login_busy(client, tmp_path):
+    rv = register(client, 'someone7@illinois.edu', 'test7', 'Password0')
+    assert rv.status == '201 CREATED'
+
+    app = client.application
+    app.config['PASSWORD_HASH_LOCK_DIR'] = str(tmp_path)
+    # Other worker processes hash on every slot
+    held = [_acquire_slot(app.config['PASSWORD_HASH_SLOTS'], str(tmp_path), 0)
+            for _ in range(app.config['PASSWORD_HASH_SLOTS'])]
+    try:
+        assert None not in held
+        rv = login(client, 'test7', 'Password0')
+        assert rv.status == '503 SERVICE UNAVAILABLE'
+    finally:
+        for fd in held:
+            os.close(fd)
+        app.config['PASSWORD_HASH_LOCK_DIR'] = None
+    rv = login(client, 'test7', 'Password0')
+    assert rv.status == '201 CREATED'
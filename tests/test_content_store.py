@@ -0,0 +1,203 @@
+"""Module related to testing the content-addressed storage of images
+"""
+
+import io
+import os
+import shutil
+import zipfile
+
+import pytest
+from PIL import Image as PILImage
+from werkzeug.datastructures import FileStorage
+
+from instadam.app import create_app, db
+from instadam.config import Config
+from instadam.models.blob import Blob
+from instadam.models.image import Image
+from instadam.models.project import Project
+from instadam.models.project_permission import AccessTypeEnum, ProjectPermission
+from instadam.models.user import User
+from instadam.utils.content_store import (add_blobs, hash_file, prune_blobs,
+                                          release_blobs)
+from tests.conftest import TEST_MODE
+
+
+@pytest.fixture
+def local_client():
+    if os.path.isdir(Config.STATIC_STORAGE_DIR):
+        shutil.rmtree(Config.STATIC_STORAGE_DIR)
+    app = create_app(TEST_MODE)
+    app.config['CONTENT_ADDRESSED_STORAGE'] = True
+    with app.app_context():
+        db.reflect()
+        db.drop_all()
+        db.create_all()
+
+        user = User(username='test_blob_user', email='email@test_blob.com')
+        user.set_password('TestTest1')
+        db.session.add(user)
+        db.session.commit()
+
+        for name in ['test/blob1', 'test/blob2']:
+            project = Project(project_name=name, created_by=user.id)
+            db.session.add(project)
+            db.session.commit()
+            permission = ProjectPermission(
+                access_type=AccessTypeEnum.READ_WRITE)
+            user.project_permissions.append(permission)
+            project.permissions.append(permission)
+        db.session.commit()
+
+    client = app.test_client()
+    yield client
+
+
+def successful_login(client, username, password):
+    rv = client.post(
+        '/login', json={
+            'username': username,
+            'password': password
+        })
+    assert '201 CREATED' == rv.status
+    return rv.get_json()['access_token']
+
+
+def zip_of(*names):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w') as zip_file:
+        for name in names:
+            zip_file.write(name, os.path.basename(name))
+    return data.getvalue()
+
+
+def stored_files(directory):
+    return [
+        os.path.join(root, name) for root, _, names in os.walk(directory)
+        for name in names
+    ]
+
+
+def test_deduplicated_uploads(local_client, tmp_path):
+    other = str(tmp_path / 'other.png')
+    PILImage.new('RGB', (32, 32), 'red').save(other)
+    access_token = successful_login(local_client, 'test_blob_user',
+                                    'TestTest1')
+    headers = {'Authorization': 'Bearer %s' % access_token}
+
+    with open('tests/cat.jpg', 'rb') as img:
+        rv = local_client.post(
+            '/image/upload/1',
+            data={'image': FileStorage(img)},
+            headers=headers)
+        assert '200 OK' == rv.status
+    rv = local_client.post(
+        '/image/upload/zip/1',
+        data=zip_of('tests/cat.jpg'),
+        content_type='application/zip',
+        headers=headers)
+    assert '200 OK' == rv.status
+    with open('tests/cat.jpg', 'rb') as cat, \
+            open(other, 'rb') as other_img:
+        rv = local_client.post(
+            '/image/upload/batch/2',
+            data={
+                'images':
+                [FileStorage(cat),
+                 FileStorage(other_img, 'other.png')]
+            },
+            headers=headers)
+        assert '200 OK' == rv.status
+    rv = local_client.post(
+        '/image/upload/zip/2',
+        data={
+            'zip': (io.BytesIO(zip_of('tests/cat.jpg', other)),
+                    'cats.zip')
+        },
+        headers=headers)
+    assert '200 OK' == rv.status
+
+    cat_digest = hash_file('tests/cat.jpg')
+    other_digest = hash_file(other)
+    blob_dir = os.path.join(Config.STATIC_STORAGE_DIR, Config.BLOB_DIR_NAME)
+    with local_client.application.app_context():
+        blobs = {blob.digest: blob for blob in Blob.query}
+        assert {cat_digest: 4, other_digest: 2} == {
+            digest: blob.refcount
+            for digest, blob in blobs.items()
+        }
+        images = Image.query.all()
+        assert 6 == len(images)
+        for image in images:
+            assert image.ready
+            assert image.image_storage_path == blobs[
+                image.digest].storage_path
+            assert image.image_url == blobs[image.digest].url
+    # Each content is stored once, and nothing is left in the projects
+    assert 2 == len(stored_files(blob_dir))
+    assert [] == stored_files(os.path.join(Config.STATIC_STORAGE_DIR, '1'))
+    assert [] == stored_files(os.path.join(Config.STATIC_STORAGE_DIR, '2'))
+
+    rv = local_client.delete('/project/1', headers=headers)
+    assert '200 OK' == rv.status
+    with local_client.application.app_context():
+        assert {cat_digest: 2, other_digest: 2} == {
+            blob.digest: blob.refcount
+            for blob in Blob.query
+        }
+    assert 2 == len(stored_files(blob_dir))
+
+    rv = local_client.delete('/project/2', headers=headers)
+    assert '200 OK' == rv.status
+    with local_client.application.app_context():
+        assert 0 == Blob.query.count()
+    assert [] == stored_files(blob_dir)
+
+
+def test_blob_files_follow_transactions(local_client, tmp_path):
+    upload = str(tmp_path / 'cat.jpg')
+    shutil.copy('tests/cat.jpg', upload)
+    digest = hash_file(upload)
+    with local_client.application.app_context():
+        blob = add_blobs([(upload, digest, 'jpg')])[digest]
+        assert os.path.isfile(blob.storage_path)
+        # The file put by a rolled back upload is removed with its row
+        db.session.rollback()
+        assert not os.path.exists(blob.storage_path)
+        assert 0 == Blob.query.count()
+
+        # Or by a request that failed and closed its session
+        shutil.copy('tests/cat.jpg', upload)
+        add_blobs([(upload, digest, 'jpg')])
+        db.session.remove()
+        assert not os.path.exists(blob.storage_path)
+
+        shutil.copy('tests/cat.jpg', upload)
+        add_blobs([(upload, digest, 'jpg')])
+        db.session.commit()
+        release_blobs([digest])
+        # The file of a rolled back release is kept
+        db.session.rollback()
+        assert os.path.isfile(blob.storage_path)
+        assert 1 == Blob.query.get(digest).refcount
+
+        release_blobs([digest])
+        assert os.path.isfile(blob.storage_path)
+        db.session.commit()
+        assert not os.path.exists(blob.storage_path)
+        assert 0 == Blob.query.count()
+
+
+def test_prune_blobs(local_client, tmp_path):
+    upload = str(tmp_path / 'cat.jpg')
+    shutil.copy('tests/cat.jpg', upload)
+    digest = hash_file(upload)
+    with local_client.application.app_context():
+        blob = add_blobs([(upload, digest, 'jpg')])[digest]
+        db.session.commit()
+        # Released by a worker that died before removing the blob
+        Blob.query.get(digest).refcount = 0
+        db.session.commit()
+        assert 1 == prune_blobs(10)
+        assert not os.path.exists(blob.storage_path)
+        assert 0 == Blob.query.count()
+        assert 0 == prune_blobs(10)
@@ -6,6 +6,9 @@ from werkzeug.exceptions import HTTPException
 
 from instadam.app import create_app, db
 from instadam.models.image import Image
+from instadam.models.project import Project
+from instadam.models.user import User
+from instadam.utils.request_context import get_query_count
 from tests.conftest import TEST_MODE
 
 
@@ -29,3 +32,34 @@ def test_invalid_project():
                 assert False
             except HTTPException as exception:
                 assert 400 == exception.code
+
+
+def test_bulk_create_empty():
+    app = create_app(TEST_MODE)
+    with app.app_context():
+        db.reflect()
+        db.drop_all()
+        db.create_all()
+        user = User(username='test_bulk_image', email='email@test_bulk.com')
+        user.set_password('TestTest1')
+        db.session.add(user)
+        db.session.commit()
+        project = Project(project_name='test/bulk', created_by=user.id)
+        db.session.add(project)
+        db.session.commit()
+        project_id = project.id
+
+        names = ['%d.png' % i for i in range(25)] + ['cat.jpg']
+        with app.test_request_context():
+            images = Image.bulk_create_empty(project, names, 10)
+            # One statement per batch of rows
+            assert 3 == get_query_count()
+        db.session.commit()
+
+        assert names == [image.image_name for image in images]
+        for image in images:
+            stored = Image.query.get(image.id)
+            assert stored.image_name == image.image_name
+            assert stored.image_storage_path == image.image_storage_path
+            assert stored.project_id == project_id
+            assert not stored.is_annotated
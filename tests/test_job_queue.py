@@ -0,0 +1,213 @@
+"""Module related to testing the background job queue
+"""
+
+import datetime as dt
+
+import pytest
+
+from instadam.app import create_app, db
+from instadam.models.job import Job, JobStatusEnum
+from instadam.models.user import PrivilegesEnum, User
+from instadam.utils.job_queue import (claim_job, enqueue_job, heartbeat,
+                                      job_handler, run_worker)
+from tests.conftest import TEST_MODE
+
+calls = []
+
+
+@job_handler('test_record')
+def record(job):
+    calls.append(job.payload['value'])
+
+
+@job_handler('test_flaky')
+def flaky(job):
+    if job.attempts < 2:
+        raise ValueError('Flaky failure')
+    calls.append(job.attempts)
+
+
+@job_handler('test_broken')
+def broken(job):
+    raise ValueError('Broken job')
+
+
+@pytest.fixture
+def app():
+    app = create_app(TEST_MODE)
+    app.config['JOB_QUEUE_EAGER'] = False
+    with app.app_context():
+        db.reflect()
+        db.drop_all()
+        db.create_all()
+
+        admin = User(
+            username='test_job_admin',
+            email='admin@test_job.com',
+            privileges=PrivilegesEnum.ADMIN)
+        admin.set_password('TestTest1')
+        owner = User(
+            username='test_job_owner',
+            email='owner@test_job.com',
+            privileges=PrivilegesEnum.ANNOTATOR)
+        owner.set_password('TestTest1')
+        other = User(
+            username='test_job_other',
+            email='other@test_job.com',
+            privileges=PrivilegesEnum.ANNOTATOR)
+        other.set_password('TestTest1')
+        db.session.add_all([admin, owner, other])
+        db.session.commit()
+    del calls[:]
+    yield app
+
+
+def make_due(job_id):
+    job = Job.query.get(job_id)
+    job.run_at = dt.datetime.utcnow()
+    db.session.commit()
+
+
+def test_run_worker(app):
+    with app.app_context():
+        for value in range(3):
+            enqueue_job('test_record', {'value': value})
+        assert calls == []
+        assert 3 == run_worker('test', max_jobs=10)
+        assert calls == [0, 1, 2]
+        for job in Job.query.all():
+            assert job.status == JobStatusEnum.SUCCEEDED
+            assert job.attempts == 1
+            assert job.locked_by == 'test'
+            assert job.finished_at is not None
+
+
+def test_eager(app):
+    app.config['JOB_QUEUE_EAGER'] = True
+    with app.app_context():
+        job = enqueue_job('test_record', {'value': 'eager'})
+        assert calls == ['eager']
+        assert job.status == JobStatusEnum.SUCCEEDED
+
+
+def test_retry(app):
+    with app.app_context():
+        job_id = enqueue_job('test_flaky', {}).id
+        assert 1 == run_worker('test', max_jobs=10)
+        job = Job.query.get(job_id)
+        assert job.status == JobStatusEnum.QUEUED
+        assert 'Flaky failure' in job.error
+        # Retried after a delay only
+        assert job.run_at > dt.datetime.utcnow()
+        assert claim_job('test') is None
+
+        make_due(job_id)
+        assert 1 == run_worker('test', max_jobs=10)
+        job = Job.query.get(job_id)
+        assert job.status == JobStatusEnum.SUCCEEDED
+        assert calls == [2]
+
+
+def test_fail(app):
+    with app.app_context():
+        job_id = enqueue_job('test_broken', {}).id
+        for _ in range(app.config['JOB_MAX_ATTEMPTS']):
+            make_due(job_id)
+            run_worker('test', max_jobs=1)
+        job = Job.query.get(job_id)
+        assert job.status == JobStatusEnum.FAILED
+        assert job.attempts == app.config['JOB_MAX_ATTEMPTS']
+        make_due(job_id)
+        assert claim_job('test') is None
+
+
+def test_expired_lease(app):
+    with app.app_context():
+        job_id = enqueue_job('test_record', {'value': 'lost'}).id
+        job = claim_job('dead worker')
+        assert job.id == job_id
+        assert claim_job('test') is None
+
+        job.locked_at = dt.datetime.utcnow() - dt.timedelta(
+            seconds=app.config['JOB_LEASE_TIMEOUT'] + 1)
+        db.session.commit()
+        assert 1 == run_worker('test', max_jobs=10)
+        job = Job.query.get(job_id)
+        assert job.status == JobStatusEnum.SUCCEEDED
+        assert job.attempts == 2
+        assert calls == ['lost']
+
+
+def expire_lease(app, job):
+    job.locked_at = dt.datetime.utcnow() - dt.timedelta(
+        seconds=app.config['JOB_LEASE_TIMEOUT'] + 1)
+    db.session.commit()
+
+
+def test_heartbeat(app):
+    with app.app_context():
+        enqueue_job('test_record', {'value': 'slow'})
+        job = claim_job('slow worker')
+        expire_lease(app, job)
+        # The worker is still making progress
+        heartbeat(job)
+        db.session.commit()
+        assert claim_job('test') is None
+
+
+def test_expired_lease_last_attempt(app):
+    with app.app_context():
+        job_id = enqueue_job('test_record', {'value': 'lost'}).id
+        for _ in range(app.config['JOB_MAX_ATTEMPTS']):
+            job = claim_job('dead worker')
+            assert job.id == job_id
+            expire_lease(app, job)
+        assert claim_job('test') is None
+        job = Job.query.get(job_id)
+        assert job.status == JobStatusEnum.FAILED
+        assert job.attempts == app.config['JOB_MAX_ATTEMPTS']
+        assert 'Lease of dead worker expired' == job.error
+        assert job.finished_at is not None
+        assert calls == []
+
+
+def successful_login(client, username, password):
+    rv = client.post(
+        '/login', json={
+            'username': username,
+            'password': password
+        })
+    assert '201 CREATED' == rv.status
+    return rv.get_json()['access_token']
+
+
+def test_get_job(app):
+    with app.app_context():
+        owner_id = User.query.filter_by(username='test_job_owner').first().id
+        job_id = enqueue_job('test_broken', {}, created_by=owner_id).id
+        run_worker('test', max_jobs=1)
+
+    client = app.test_client()
+    token = successful_login(client, 'test_job_owner', 'TestTest1')
+    rv = client.get(
+        '/jobs/%d' % job_id, headers={'Authorization': 'Bearer %s' % token})
+    assert '200 OK' == rv.status
+    json_data = rv.get_json()
+    assert json_data['kind'] == 'test_broken'
+    assert json_data['status'] == 'queued'
+    assert json_data['attempts'] == 1
+    assert json_data['error'] == 'ValueError: Broken job'
+
+    token = successful_login(client, 'test_job_admin', 'TestTest1')
+    rv = client.get(
+        '/jobs/%d' % job_id, headers={'Authorization': 'Bearer %s' % token})
+    assert '200 OK' == rv.status
+    rv = client.get(
+        '/jobs/%d' % (job_id + 1),
+        headers={'Authorization': 'Bearer %s' % token})
+    assert '404 NOT FOUND' == rv.status
+
+    token = successful_login(client, 'test_job_other', 'TestTest1')
+    rv = client.get(
+        '/jobs/%d' % job_id, headers={'Authorization': 'Bearer %s' % token})
+    assert '401 UNAUTHORIZED' == rv.status
@@ -3,6 +3,7 @@ images
 """
 
 import base64
+import datetime as dt
 import os
 import shutil
 from io import BytesIO
@@ -199,6 +200,79 @@ def test_load_project_images_fail_2(local_client):
     assert '401 UNAUTHORIZED' == res.status
 
 
+def test_load_project_images_pages(local_client):
+    access_token = successful_login(local_client, 'test_upload_annotator1',
+                                    'TestTest2')
+    headers = {'Authorization': 'Bearer %s' % access_token}
+
+    pages = []
+    query = {'limit': 2}
+    while True:
+        res = local_client.get(
+            '/projects/1/images', query_string=query, headers=headers)
+        assert '200 OK' == res.status
+        json_res = res.get_json()
+        pages.append([image['id'] for image in json_res['project_images']])
+        if json_res['next_cursor'] is None:
+            break
+        query['cursor'] = json_res['next_cursor']
+    assert [[1, 2], [3]] == pages
+
+    # Images with the same name are ordered by id
+    res = local_client.get(
+        '/projects/1/images',
+        query_string={
+            'sort': '-name',
+            'fields': 'id,name',
+            'limit': 2
+        },
+        headers=headers)
+    json_res = res.get_json()
+    assert [{
+        'id': 2,
+        'name': 'dog.png'
+    }, {
+        'id': 3,
+        'name': 'cat.jpg'
+    }] == json_res['project_images']
+    res = local_client.get(
+        '/projects/1/unannotated',
+        query_string={
+            'sort': '-name',
+            'fields': 'id',
+            'cursor': json_res['next_cursor']
+        },
+        headers=headers)
+    assert [{'id': 1}] == res.get_json()['unannotated_images']
+    assert res.get_json()['next_cursor'] is None
+
+
+@pytest.mark.parametrize('query', [{
+    'limit': 0
+}, {
+    'limit': 'all'
+}, {
+    'sort': 'path'
+}, {
+    'fields': 'id,image_storage_path'
+}, {
+    'cursor': 'not a cursor'
+}, {
+    'sort': 'modified_at',
+    'cursor': 'WzEsIDFd'
+}])
+def test_load_project_images_invalid_page(local_client, query):
+    access_token = successful_login(local_client, 'test_upload_annotator1',
+                                    'TestTest2')
+
+    res = local_client.get(
+        '/projects/1/images',
+        query_string=query,
+        headers={'Authorization': 'Bearer %s' % access_token})
+
+    assert '400 BAD REQUEST' == res.status
+
+
 def test_load_image(local_client):
     access_token = successful_login(local_client, 'test_upload_annotator1',
                                     'TestTest2')
@@ -247,3 +321,125 @@ def test_get_thumbnail(local_client):
     img = PILImage.open('tests/cat.jpg')
     img.thumbnail((16, 15), PILImage.ANTIALIAS)
     assert img.size == rep_img.size
+
+
+def test_get_thumbnail_cached(local_client):
+    access_token = successful_login(local_client, 'test_upload_annotator1',
+                                    'TestTest2')
+    res = local_client.get(
+        '/image/3/thumbnail?size_h=16&size_w=15',
+        headers={'Authorization': 'Bearer %s' % access_token})
+    assert '200 OK' == res.status
+    cache_dir = os.path.join(Config.STATIC_STORAGE_DIR,
+                             Config.THUMBNAIL_CACHE_DIR_NAME, '1', '3')
+    cached = os.listdir(cache_dir)
+    assert len(cached) == 1
+
+    res_cached = local_client.get(
+        '/image/3/thumbnail?size_h=16&size_w=15',
+        headers={'Authorization': 'Bearer %s' % access_token})
+    assert res.get_json() == res_cached.get_json()
+    assert os.listdir(cache_dir) == cached
+
+    res = local_client.get(
+        '/image/3/thumbnail?size_h=abc',
+        headers={'Authorization': 'Bearer %s' % access_token})
+    assert '400 BAD REQUEST' == res.status
+
+
+def test_get_thumbnail_binary(local_client):
+    access_token = successful_login(local_client, 'test_upload_annotator1',
+                                    'TestTest2')
+    res = local_client.get(
+        '/image/3/thumbnail?size_h=16&size_w=15&binary=true',
+        headers={'Authorization': 'Bearer %s' % access_token})
+    assert '200 OK' == res.status
+    assert 'image/png' == res.mimetype
+    assert res.headers['ETag']
+    assert 'Last-Modified' not in res.headers
+    img = PILImage.open(BytesIO(res.data))
+    assert img.format == 'PNG'
+
+    res_etag = local_client.get(
+        '/image/3/thumbnail?size_h=16&size_w=15&binary=true',
+        headers={
+            'Authorization': 'Bearer %s' % access_token,
+            'If-None-Match': res.headers['ETag']
+        })
+    assert '304 NOT MODIFIED' == res_etag.status
+    assert not res_etag.data
+
+    # Saving annotations leaves the thumbnails of the image cached
+    with local_client.application.app_context():
+        image = Image.query.get(3)
+        image.modified_at = dt.datetime.utcnow() + dt.timedelta(days=1)
+        db.session.commit()
+    res_annotated = local_client.get(
+        '/image/3/thumbnail?size_h=16&size_w=15&binary=true',
+        headers={
+            'Authorization': 'Bearer %s' % access_token,
+            'If-None-Match': res.headers['ETag']
+        })
+    assert '304 NOT MODIFIED' == res_annotated.status
+
+    res_other = local_client.get(
+        '/image/3/thumbnail?size_h=8&size_w=8&binary=true&format=webp',
+        headers={
+            'Authorization': 'Bearer %s' % access_token,
+            'If-None-Match': res.headers['ETag']
+        })
+    assert '200 OK' == res_other.status
+    assert 'image/webp' == res_other.mimetype
+
+    res = local_client.get(
+        '/image/3/thumbnail?format=gif',
+        headers={'Authorization': 'Bearer %s' % access_token})
+    assert '400 BAD REQUEST' == res.status
+
+
+def test_get_original(local_client):
+    access_token = successful_login(local_client, 'test_upload_annotator1',
+                                    'TestTest2')
+    headers = {'Authorization': 'Bearer %s' % access_token}
+    with open('tests/cat.jpg', 'rb') as fd:
+        data = fd.read()
+    res = local_client.get('/image/3/original', headers=headers)
+    assert '200 OK' == res.status
+    assert 'image/jpeg' == res.mimetype
+    assert data == res.data
+    res.close()
+
+    res = local_client.get(
+        '/image/3/original', headers=dict(headers, Range='bytes=10-19'))
+    assert '206 PARTIAL CONTENT' == res.status
+    assert data[10:20] == res.data
+    res.close()
+
+    access_token = successful_login(local_client, 'test_upload_annotator2',
+                                    'TestTest3')
+    res = local_client.get(
+        '/image/3/original',
+        headers={'Authorization': 'Bearer %s' % access_token})
+    assert '401 UNAUTHORIZED' == res.status
+
+
+def test_get_original_accel_redirect(local_client):
+    app = local_client.application
+    app.config['STORAGE_ACCEL_REDIRECT_LOCATION'] = '/_storage/'
+    app.extensions.pop('instadam_storage', None)
+    storage_path = os.path.join(Config.STATIC_STORAGE_DIR, '1', 'cat.jpg')
+    os.makedirs(os.path.dirname(storage_path), exist_ok=True)
+    shutil.copy('tests/cat.jpg', storage_path)
+    with app.app_context():
+        Image.query.get(3).image_storage_path = storage_path
+        db.session.commit()
+
+    access_token = successful_login(local_client, 'test_upload_annotator1',
+                                    'TestTest2')
+    res = local_client.get(
+        '/image/3/original',
+        headers={'Authorization': 'Bearer %s' % access_token})
+    assert '200 OK' == res.status
+    assert '/_storage/1/cat.jpg' == res.headers['X-Accel-Redirect']
+    assert 'image/jpeg' == res.mimetype
+    assert not res.data
@@ -5,14 +5,17 @@ blueprint '/project/...'
 import os
 
 import pytest
+from sqlalchemy import event
 
 from instadam.app import create_app, db
 from instadam.models.annotation import Annotation
 from instadam.models.image import Image
+from instadam.models.job import Job, JobStatusEnum
 from instadam.models.label import Label
 from instadam.models.project import Project
 from instadam.models.project_permission import AccessTypeEnum, ProjectPermission
 from instadam.models.user import PrivilegesEnum, User
+from instadam.utils.job_queue import run_worker
 from tests.conftest import TEST_MODE
 
 ADMIN_USERNAME = "success"
@@ -269,6 +272,73 @@ def test_delete_project_success(get_project_fixture):
     assert not os.path.isdir('static-dir/1')
 
 
+def test_delete_project_in_background(get_project_fixture):
+    """
+    Tests whether or not a deleted project is hidden right away, then removed
+    by the deletion job in batches
+
+    """
+    app = get_project_fixture.application
+    app.config['JOB_QUEUE_EAGER'] = False
+    app.config['PROJECT_DELETE_BATCH_SIZE'] = 1
+    with app.app_context():
+        image = Image(project_id=1, image_name='cat.jpg',
+                      image_storage_path='static-dir/1/cat.jpg')
+        db.session.add(image)
+        db.session.commit()
+    with open('static-dir/1/cat.jpg', 'wb') as fd:
+        fd.write(b'1234')
+    token = login(get_project_fixture, ADMIN_USERNAME, ADMIN_PWD)
+
+    response = get_project_fixture.delete(
+        '%s/%d' % (PROJECT_ENDPOINT, 1),
+        headers={'Authorization': 'Bearer %s' % token})
+    assert response.status_code == 200
+    job_id = response.get_json()['job_id']
+    response = get_project_fixture.get(
+        LIST_PROJECT_ENDPOINT, headers={'Authorization': 'Bearer %s' % token})
+    assert [] == response.get_json()
+    assert get_labels_helper(get_project_fixture, token) == 401
+    assert get_images_helper(get_project_fixture, token, 1) == 404
+    assert os.path.isfile('static-dir/1/cat.jpg')
+
+    with app.app_context():
+        assert Project.query.get(1).deleted_at is not None
+        assert 1 == run_worker('test', max_jobs=1)
+        job = Job.query.get(job_id)
+        assert JobStatusEnum.SUCCEEDED == job.status
+        assert 2 == job.progress_total
+        assert 2 == job.progress_done
+        for model in (Project, Image, Annotation, Label, ProjectPermission):
+            assert 0 == model.query.count()
+    assert not os.path.isdir('static-dir/1')
+
+
+def test_delete_project_cascade(get_project_fixture):
+    """
+    Tests whether or not deleting a project deletes its children in the
+    database, without loading them
+
+    """
+    with get_project_fixture.application.app_context():
+        project = Project.query.get(1)
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            db.session.delete(project)
+            db.session.commit()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        assert 1 == len(statements)
+        assert statements[0].startswith('DELETE FROM project')
+        for model in (Image, Annotation, Label, ProjectPermission):
+            assert 0 == model.query.count()
+
+
 def test_delete_project_permissions_fail1(get_project_fixture):
     """
     Tests whether or not the request to delete project fails with the wrong 
@@ -0,0 +1,75 @@
+"""Module related to testing the request scoped user and permission context
+"""
+
+import pytest
+from flask_jwt_extended import verify_jwt_in_request
+
+from instadam.app import create_app, db
+from instadam.models.project import Project
+from instadam.models.project_permission import AccessTypeEnum, ProjectPermission
+from instadam.models.user import PrivilegesEnum, User
+from instadam.utils.get_project import (maybe_get_project,
+                                        maybe_get_project_read_only)
+from instadam.utils.request_context import get_query_count
+from instadam.utils.user_identification import get_current_user
+from tests.conftest import TEST_MODE
+
+
+@pytest.fixture
+def app():
+    app = create_app(TEST_MODE)
+    with app.app_context():
+        db.reflect()
+        db.drop_all()
+        db.create_all()
+
+        admin = User(
+            username='test_context_admin',
+            email='admin@test_context.com',
+            privileges=PrivilegesEnum.ADMIN)
+        admin.set_password('TestTest1')
+        db.session.add(admin)
+        db.session.commit()
+
+        project = Project(project_name='test_context', created_by=admin.id)
+        permission = ProjectPermission(access_type=AccessTypeEnum.READ_WRITE)
+        admin.project_permissions.append(permission)
+        project.permissions.append(permission)
+        db.session.add(project)
+        db.session.commit()
+    yield app
+
+
+def login(client):
+    response = client.post(
+        '/login',
+        json={
+            'username': 'test_context_admin',
+            'password': 'TestTest1'
+        })
+    assert response.status_code == 201
+    return response.get_json()['access_token']
+
+
+def test_permission_resolved_once(app):
+    token = login(app.test_client())
+    with app.test_request_context(
+            headers={'Authorization': 'Bearer %s' % token}):
+        verify_jwt_in_request()
+        count = get_query_count()
+        project = maybe_get_project_read_only(1)
+        assert project.project_name == 'test_context'
+        assert maybe_get_project(1) is project
+        assert get_current_user() is get_current_user()
+        queries = get_query_count() - count
+    # The permission, its project and the user are loaded in a single query
+    assert queries == 1
+
+
+def test_query_count_header(app):
+    client = app.test_client()
+    token = login(client)
+    response = client.get(
+        '/project/1/labels', headers={'Authorization': 'Bearer %s' % token})
+    assert response.status_code == 200
+    assert int(response.headers['X-Query-Count']) > 0
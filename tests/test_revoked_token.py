@@ -1,11 +1,74 @@
 """Module related to testing if revoked token is invalid
 """
+import datetime as dt
 
+from sqlalchemy import event
+
+from instadam.app import create_app, db
 from instadam.models.revoked_token import RevokedToken
+from instadam.utils.revoked_token_cache import (BloomFilter,
+                                                RevokedTokenCache)
 from flask_jwt_extended import create_access_token
+from tests.conftest import TEST_MODE
 
 
 def test_token_repr(client):
     jti = 'jtitesttesttsettest'
     token = RevokedToken(jti=jti)
-    assert token.__repr__() == jti
\ No newline at end of file
+    assert token.__repr__() == jti
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(1 << 12, 5)
+    bloom.add('revoked')
+    assert 'revoked' in bloom
+    assert 'not-revoked' not in bloom
+
+
+def test_revoked_token_cache():
+    app = create_app(TEST_MODE)
+    with app.app_context():
+        db.reflect()
+        db.drop_all()
+        db.create_all()
+        db.session.add(RevokedToken(jti='revoked-by-other-worker'))
+        db.session.commit()
+
+        cache = RevokedTokenCache(60, 1 << 12, 5, 2)
+        assert cache.is_revoked('revoked-by-other-worker')
+        cache.add('revoked-here')
+        assert cache.is_revoked('revoked-here')
+
+        queries = []
+
+        def count(*args):
+            queries.append(args)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            assert not cache.is_revoked('never-revoked')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        assert not queries
+
+
+def test_prune_expired():
+    app = create_app(TEST_MODE)
+    with app.app_context():
+        db.reflect()
+        db.drop_all()
+        db.create_all()
+        now = dt.datetime.utcnow()
+        for i in range(5):
+            db.session.add(
+                RevokedToken(
+                    jti='expired%d' % i,
+                    expires_at=now - dt.timedelta(minutes=1)))
+        db.session.add(
+            RevokedToken(jti='valid', expires_at=now + dt.timedelta(days=1)))
+        db.session.add(RevokedToken(jti='never_expire'))
+        db.session.commit()
+
+        assert RevokedToken.prune_expired(2) == 5
+        remaining = {token.jti for token in RevokedToken.query.all()}
+        assert remaining == {'valid', 'never_expire'}
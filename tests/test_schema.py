@@ -0,0 +1,48 @@
+from sqlalchemy import inspect
+
+from instadam.app import create_app, db
+from instadam.utils.schema import upgrade_schema
+from tests.conftest import TEST_MODE
+
+
+def test_upgrade_schema():
+    app = create_app(TEST_MODE)
+    with app.app_context():
+        db.create_all()
+        # Bring some tables back to the schema of the first version
+        for statement in [
+                'ALTER TABLE project DROP COLUMN deleted_at',
+                'ALTER TABLE image DROP COLUMN ready',
+                'ALTER TABLE image DROP COLUMN digest',
+                'DROP INDEX ix_image_project_id_id',
+                'ALTER TABLE "user" DROP COLUMN permission_version',
+                'ALTER TABLE label DROP CONSTRAINT label_project_id_fkey, '
+                'ADD CONSTRAINT label_project_id_fkey '
+                'FOREIGN KEY (project_id) REFERENCES project (id)'
+        ]:
+            db.session.execute(statement)
+        db.session.commit()
+
+        upgrade_schema()
+        # Upgrading an upgraded database changes nothing
+        upgrade_schema()
+
+        inspector = inspect(db.engine)
+        columns = {
+            table: {column['name'] for column in inspector.get_columns(table)}
+            for table in ('project', 'image', 'user')
+        }
+        assert 'deleted_at' in columns['project']
+        assert {'ready', 'digest'} <= columns['image']
+        assert 'permission_version' in columns['user']
+        assert {'ix_image_digest', 'ix_image_project_id_id'} <= {
+            index['name'] for index in inspector.get_indexes('image')
+        }
+        foreign_keys = {
+            key['name']: key
+            for key in inspector.get_foreign_keys('label')
+            + inspector.get_foreign_keys('image')
+        }
+        assert 'CASCADE' == foreign_keys['label_project_id_fkey'][
+            'options']['ondelete']
+        assert 'blob' == foreign_keys['image_digest_fkey']['referred_table']
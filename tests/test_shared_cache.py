@@ -0,0 +1,152 @@
+"""Module related to testing the permission cache shared by worker processes
+"""
+
+import pytest
+from sqlalchemy import event
+
+from instadam.app import create_app, db
+from instadam.models.project import Project
+from instadam.models.project_permission import AccessTypeEnum, ProjectPermission
+from instadam.models.user import PrivilegesEnum, User
+from instadam.utils.request_context import RequestContext
+from instadam.utils.shared_cache import (LocalCacheBackend,
+                                         SharedPermissionCache,
+                                         get_shared_cache,
+                                         invalidate_permission_cache)
+from instadam.utils.user_identification import is_permission_version_current
+from tests.conftest import TEST_MODE
+
+ADMIN_USERNAME = 'test_cache_admin'
+ANNOTATOR_USERNAME = 'test_cache_annotator'
+PASSWORD = 'TestTest1'
+
+
+@pytest.fixture
+def workers():
+    """Two apps sharing one cache backend, as two uWSGI workers would."""
+    app = create_app(TEST_MODE)
+    with app.app_context():
+        db.reflect()
+        db.drop_all()
+        db.create_all()
+
+        admin = User(
+            username=ADMIN_USERNAME,
+            email='admin@test_cache.com',
+            privileges=PrivilegesEnum.ADMIN)
+        admin.set_password(PASSWORD)
+        annotator = User(
+            username=ANNOTATOR_USERNAME,
+            email='annotator@test_cache.com',
+            privileges=PrivilegesEnum.ANNOTATOR)
+        annotator.set_password(PASSWORD)
+        db.session.add(admin)
+        db.session.add(annotator)
+        db.session.commit()
+
+        project = Project(project_name='test_cache', created_by=admin.id)
+        permission = ProjectPermission(access_type=AccessTypeEnum.READ_WRITE)
+        admin.project_permissions.append(permission)
+        project.permissions.append(permission)
+        db.session.add(project)
+        db.session.commit()
+        shared_cache = get_shared_cache()
+
+    other_app = create_app(TEST_MODE)
+    other_app.extensions['instadam_shared_cache'] = shared_cache
+    yield app.test_client(), other_app.test_client()
+
+
+def login(client, username):
+    response = client.post(
+        '/login', json={
+            'username': username,
+            'password': PASSWORD
+        })
+    assert response.status_code == 201
+    return response.get_json()['access_token']
+
+
+def test_generation_invalidates_entries():
+    cache = SharedPermissionCache(LocalCacheBackend(), 60)
+    cache.set_permission_version(1, 3)
+    cache.set_access_type(1, 2, AccessTypeEnum.READ_ONLY)
+    cache.set_access_type(1, 3, None)
+    assert cache.get_permission_version(1) == 3
+    assert cache.get_access_type(1, 2) == 'r'
+    assert cache.get_access_type(1, 3) == ''
+
+    cache.bump_generation()
+    assert cache.get_permission_version(1) is None
+    assert cache.get_access_type(1, 2) is None
+
+
+def test_invalidation_during_read_not_cached(workers):
+    """A value read before an invalidation is not cached under the new
+    generation."""
+    worker, _ = workers
+    with worker.application.test_request_context():
+        cache = get_shared_cache()
+
+        def invalidate(conn, cursor, statement, *args):
+            # Another worker commits a change right after the read
+            invalidate_permission_cache()
+
+        event.listen(db.engine, 'after_cursor_execute', invalidate)
+        try:
+            assert is_permission_version_current(1, 0)
+            context = RequestContext()
+            context._claims = {'id': 1}
+            assert context.get_permission(1) is not None
+        finally:
+            event.remove(db.engine, 'after_cursor_execute', invalidate)
+        assert cache.get_permission_version(1) is None
+        assert cache.get_access_type(1, 1) is None
+
+
+def test_permission_update_seen_by_other_worker(workers):
+    worker, other_worker = workers
+    admin_token = login(worker, ADMIN_USERNAME)
+    annotator_token = login(other_worker, ANNOTATOR_USERNAME)
+
+    response = other_worker.get(
+        '/projects/1/images',
+        headers={'Authorization': 'Bearer %s' % annotator_token})
+    assert response.status_code == 401
+
+    response = worker.put(
+        '/project/1/permissions',
+        json={
+            'username': ANNOTATOR_USERNAME,
+            'access_type': 'r'
+        },
+        headers={'Authorization': 'Bearer %s' % admin_token})
+    assert response.status_code == 201
+
+    response = other_worker.get(
+        '/projects/1/images',
+        headers={'Authorization': 'Bearer %s' % annotator_token})
+    assert response.status_code == 200
+
+
+def test_privilege_change_seen_by_other_worker(workers):
+    worker, other_worker = workers
+    admin_token = login(worker, ADMIN_USERNAME)
+    annotator_token = login(other_worker, ANNOTATOR_USERNAME)
+
+    response = other_worker.get(
+        '/projects', headers={'Authorization': 'Bearer %s' % annotator_token})
+    assert response.status_code == 200
+
+    response = worker.put(
+        '/user/privilege/',
+        json={
+            'username': ANNOTATOR_USERNAME,
+            'privilege': 'admin'
+        },
+        headers={'Authorization': 'Bearer %s' % admin_token})
+    assert response.status_code == 200
+
+    response = other_worker.get(
+        '/projects', headers={'Authorization': 'Bearer %s' % annotator_token})
+    assert response.status_code == 401
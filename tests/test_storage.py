@@ -0,0 +1,83 @@
+"""Module related to testing the storage backends of image files
+
+The S3 backend is tested against the object store at
+INSTADAM_TEST_S3_ENDPOINT_URL, for example a local MinIO server, with the
+credentials of the usual AWS environment variables.
+"""
+
+import os
+import uuid
+
+import pytest
+
+from instadam.utils.storage import LocalStorage, S3Storage
+
+S3_ENDPOINT_URL = os.environ.get('INSTADAM_TEST_S3_ENDPOINT_URL')
+
+
+@pytest.fixture(params=['local', 's3'])
+def storage(request, tmp_path):
+    if request.param == 'local':
+        yield LocalStorage(str(tmp_path / 'storage'), 'static')
+        return
+    pytest.importorskip('boto3')
+    if not S3_ENDPOINT_URL:
+        pytest.skip('INSTADAM_TEST_S3_ENDPOINT_URL is not set')
+    storage = S3Storage(
+        os.environ.get('INSTADAM_TEST_S3_BUCKET', 'instadam-test'),
+        'test-%s' % uuid.uuid4(), 'http://static', S3_ENDPOINT_URL)
+    try:
+        storage.client.create_bucket(Bucket=storage.bucket)
+    except storage.client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    yield storage
+    storage.delete_prefix()
+
+
+def local_file(tmp_path, data):
+    path = str(tmp_path / ('%s.part' % uuid.uuid4()))
+    with open(path, 'wb') as fd:
+        fd.write(data)
+    return path
+
+
+def test_put_and_read(storage, tmp_path):
+    path = storage.path('1', 'cat.jpg')
+    assert storage.stat(path) is None
+    with open('tests/cat.jpg', 'rb') as fd:
+        data = fd.read()
+    local_path = local_file(tmp_path, data)
+    storage.put(path, local_path)
+    assert not os.path.exists(local_path)
+
+    assert len(data) == storage.stat(path)
+    assert data == storage.get(path)
+    with storage.open(path) as fd:
+        assert data == fd.read()
+    assert data == b''.join(storage.stream(path, 1000))
+    assert storage.url('1', 'cat.jpg').endswith('/1/cat.jpg')
+
+    storage.delete(path)
+    assert storage.stat(path) is None
+
+
+def test_delete_prefix(storage, tmp_path):
+    paths = [storage.path('1', '%d.png' % i) for i in range(3)]
+    paths.append(storage.path('10', 'other.png'))
+    for path in paths:
+        storage.put(path, local_file(tmp_path, b'data'))
+
+    storage.delete_prefix('1')
+    for path in paths[:3]:
+        assert storage.stat(path) is None
+    assert 4 == storage.stat(paths[3])
+
+
+def test_move(storage, tmp_path):
+    path = storage.path('1', 'cat.jpg')
+    new_path = storage.path('1', 'ca', 'cat.jpg')
+    storage.put(path, local_file(tmp_path, b'data'))
+
+    storage.move(path, new_path)
+    assert storage.stat(path) is None
+    assert b'data' == storage.get(new_path)
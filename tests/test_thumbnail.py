@@ -0,0 +1,80 @@
+"""Module related to testing the on-disk thumbnail cache
+"""
+
+import collections
+import os
+import time
+from io import BytesIO
+
+from PIL import Image as PILImage
+
+from instadam.utils.ingest import ThumbnailIngest
+from instadam.utils.storage import LocalStorage
+from instadam.utils.thumbnail import (ThumbnailCache, get_image_version,
+                                      render_thumbnail)
+
+ImageRow = collections.namedtuple('ImageRow', 'digest image_storage_path')
+
+
+def test_render_thumbnail():
+    data = render_thumbnail(LocalStorage('tests', 'static'), 'tests/cat.jpg',
+                            (16, 15), 'png')
+    img = PILImage.open('tests/cat.jpg')
+    img.thumbnail((16, 15))
+    assert data[:8] == b'\x89PNG\r\n\x1a\n'
+    assert PILImage.open(BytesIO(data)).size == img.size
+
+
+def test_get_image_version():
+    # Derived without the storage, which isn't even configured here
+    version = get_image_version(ImageRow(None, '1/ab/cd/a.png'))
+    assert version == get_image_version(ImageRow(None, '1/ab/cd/a.png'))
+    assert version != get_image_version(ImageRow(None, '1/ef/gh/b.png'))
+    assert 'digest' == get_image_version(ImageRow('digest', '1/ab/cd/a.png'))
+
+
+def test_cache_get_put(tmp_path):
+    cache = ThumbnailCache(str(tmp_path), 1024)
+    assert cache.get(1, 2, (10, 10), 'png', 'v1') is None
+    cache.put(1, 2, (10, 10), 'png', 'v1', b'thumbnail')
+    assert cache.get(1, 2, (10, 10), 'png', 'v1') == b'thumbnail'
+    # A new version of the image doesn't see the old thumbnail
+    assert cache.get(1, 2, (10, 10), 'png', 'v2') is None
+
+    cache.invalidate(1, 2)
+    assert cache.get(1, 2, (10, 10), 'png', 'v1') is None
+
+
+def test_cache_lru_eviction(tmp_path):
+    cache = ThumbnailCache(str(tmp_path), 350)
+    for image_id in range(3):
+        cache.put(1, image_id, (10, 10), 'png', 'v', b'x' * 100)
+        path = cache.path(1, image_id, (10, 10), 'png', 'v')
+        past = time.time() - 100 + image_id
+        os.utime(path, (past, past))
+    # Image 0 is the least recently written, but is now used again
+    assert cache.get(1, 0, (10, 10), 'png', 'v') is not None
+
+    cache.put(1, 3, (10, 10), 'png', 'v', b'x' * 100)
+    assert cache.get(1, 1, (10, 10), 'png', 'v') is None
+    assert cache.get(1, 0, (10, 10), 'png', 'v') is not None
+    assert cache.get(1, 3, (10, 10), 'png', 'v') is not None
+
+
+def test_ingest_generate(tmp_path):
+    ingest = ThumbnailIngest(LocalStorage('tests', 'static'), str(tmp_path),
+                             1 << 20, [(16, 15), (8, 8)], 'png')
+    ingest.generate(1, 2, 'tests/cat.jpg', 'v1')
+    cache = ThumbnailCache(str(tmp_path), 1 << 20)
+    data = cache.get(1, 2, (16, 15), 'png', 'v1')
+    expected = render_thumbnail(LocalStorage('tests', 'static'),
+                                'tests/cat.jpg', (16, 15), 'png')
+    assert PILImage.open(BytesIO(data)).size == PILImage.open(
+        BytesIO(expected)).size
+    assert cache.get(1, 2, (8, 8), 'png', 'v1') is not None
+
+    # Already generated thumbnails are left untouched
+    path = cache.path(1, 2, (8, 8), 'png', 'v1')
+    mtime = os.stat(path).st_mtime
+    ingest.generate(1, 2, 'tests/cat.jpg', 'v1')
+    assert os.stat(path).st_mtime == mtime
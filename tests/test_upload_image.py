@@ -2,18 +2,23 @@
 """
 
 import filecmp
+import io
 import os
 import shutil
 import time
+import zipfile
 
 import pytest
 from werkzeug.datastructures import FileStorage
 
 from instadam.app import create_app, db
 from instadam.config import Config
+from instadam.models.image import Image
+from instadam.models.job import Job
 from instadam.models.project import Project
 from instadam.models.project_permission import AccessTypeEnum, ProjectPermission
 from instadam.models.user import User
+from instadam.utils.job_queue import run_worker
 from tests.conftest import TEST_MODE
 
 
@@ -69,6 +74,13 @@ def successful_login(client, username, password):
     return json_data['access_token']
 
 
+def stored_files(directory):
+    return [
+        os.path.join(root, name) for root, _, names in os.walk(directory)
+        for name in names
+    ]
+
+
 def test_upload_image(local_client):
     access_token = successful_login(local_client, 'test_upload_user1',
                                     'TestTest1')
@@ -86,10 +98,21 @@ def test_upload_image(local_client):
 
     storage_path = os.path.join(Config.STATIC_STORAGE_DIR, '1')
     assert os.path.isdir(storage_path)
-    files = os.listdir(storage_path)
+    files = stored_files(storage_path)
     assert 1 == len(files)
-    saved_file = files[0]
-    assert filecmp.cmp('tests/cat.jpg', os.path.join(storage_path, saved_file))
+    assert filecmp.cmp('tests/cat.jpg', files[0])
+    # Files are sharded by the leading characters of their names
+    file_name = os.path.basename(files[0])
+    assert os.path.join(storage_path, file_name[:2], file_name[2:4],
+                        file_name) == files[0]
+
+    # Standard thumbnails are generated at upload
+    thumbnail_dir = os.path.join(Config.STATIC_STORAGE_DIR,
+                                 Config.THUMBNAIL_CACHE_DIR_NAME, '1')
+    thumbnails = [
+        name for _, _, names in os.walk(thumbnail_dir) for name in names
+    ]
+    assert len(Config.THUMBNAIL_STANDARD_SIZES) == len(thumbnails)
 
 
 def test_upload_image_fail_1(local_client):
@@ -169,17 +192,22 @@ def test_upload_zip(local_client):
         assert 'msg' in json_data
         assert 'Zip uploaded successfully, please wait for unzip' == json_data[
             'msg']
+        job_id = json_data['job_id']
+
+    rv = local_client.get(
+        '/jobs/%d' % job_id,
+        headers={'Authorization': 'Bearer %s' % access_token})
+    assert '200 OK' == rv.status
+    assert 'succeeded' == rv.get_json()['status']
 
     time.sleep(1)
 
     storage_path = os.path.join(Config.STATIC_STORAGE_DIR, '1')
     assert os.path.isdir(storage_path)
-    files = os.listdir(storage_path)
+    files = stored_files(storage_path)
     assert 2 == len(files)
-    assert filecmp.cmp(
-        os.path.join(storage_path, files[0]),
-        os.path.join(storage_path, files[1]))
-    assert filecmp.cmp(os.path.join(storage_path, files[0]), 'tests/cat.jpg')
+    assert filecmp.cmp(files[0], files[1])
+    assert filecmp.cmp(files[0], 'tests/cat.jpg')
 
 
 def test_upload_zip_failed(local_client):
@@ -204,3 +232,170 @@ def test_upload_zip_failed2(local_client):
             data={'image': file},
             headers={'Authorization': 'Bearer %s' % access_token})
         assert '400 BAD REQUEST' == rv.status
+
+
+def test_upload_zip_stream(local_client):
+    access_token = successful_login(local_client, 'test_upload_user1',
+                                    'TestTest1')
+    with open('tests/test.zip', 'rb') as fd:
+        rv = local_client.post(
+            '/image/upload/zip/1',
+            data=fd.read(),
+            content_type='application/zip',
+            headers={'Authorization': 'Bearer %s' % access_token})
+    assert '200 OK' == rv.status
+    assert 'Zip uploaded successfully' == rv.get_json()['msg']
+    with local_client.application.app_context():
+        job = Job.query.get(rv.get_json()['job_id'])
+        assert 'generate_thumbnails' == job.kind
+        assert 2 == len(job.payload['image_ids'])
+
+    storage_path = os.path.join(Config.STATIC_STORAGE_DIR, '1')
+    files = stored_files(storage_path)
+    assert 2 == len(files)
+    for file in files:
+        assert filecmp.cmp(file, 'tests/cat.jpg')
+    with local_client.application.app_context():
+        assert 2 == Image.query.filter_by(project_id=1).count()
+
+    rv = local_client.post(
+        '/image/upload/zip/1',
+        data=b'not a zip file',
+        content_type='application/zip',
+        headers={'Authorization': 'Bearer %s' % access_token})
+    assert '400 BAD REQUEST' == rv.status
+    assert 2 == len(stored_files(storage_path))
+
+
+def test_upload_zip_progress(local_client, tmp_path):
+    app = local_client.application
+    app.config['JOB_QUEUE_EAGER'] = False
+    access_token = successful_login(local_client, 'test_upload_user1',
+                                    'TestTest1')
+    zip_path = str(tmp_path / 'broken.zip')
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zip_file:
+        zip_file.write('tests/cat.jpg', 'cat.jpg')
+        zip_file.writestr('broken.jpg', b'x' * 100)
+    with open(zip_path, 'rb') as fd:
+        data = fd.read().replace(b'x' * 100, b'y' * 100)
+
+    rv = local_client.post(
+        '/image/upload/zip/1',
+        data={'zip': (io.BytesIO(data), 'broken.zip')},
+        headers={'Authorization': 'Bearer %s' % access_token})
+    assert '200 OK' == rv.status
+    job_id = rv.get_json()['job_id']
+
+    # Images are left out of the listings until extracted
+    rv = local_client.get(
+        '/projects/1/images',
+        headers={'Authorization': 'Bearer %s' % access_token})
+    assert [] == rv.get_json()['project_images']
+    rv = local_client.get(
+        '/jobs/%d' % job_id,
+        headers={'Authorization': 'Bearer %s' % access_token})
+    assert 'queued' == rv.get_json()['status']
+
+    with app.app_context():
+        run_worker('test', max_jobs=10)
+
+    rv = local_client.get(
+        '/jobs/%d' % job_id,
+        headers={'Authorization': 'Bearer %s' % access_token})
+    json_data = rv.get_json()
+    assert 'succeeded' == json_data['status']
+    assert {'total': 2, 'done': 1, 'failed': 1} == json_data['progress']
+    assert ['broken.jpg'] == [
+        failure['name'] for failure in json_data['failures']
+    ]
+
+    rv = local_client.get(
+        '/projects/1/images',
+        headers={'Authorization': 'Bearer %s' % access_token})
+    images = rv.get_json()['project_images']
+    assert ['cat.jpg'] == [image['name'] for image in images]
+    storage_path = os.path.join(Config.STATIC_STORAGE_DIR, '1')
+    assert 1 == len(stored_files(storage_path))
+
+
+def test_upload_images_batch(local_client):
+    access_token = successful_login(local_client, 'test_upload_user1',
+                                    'TestTest1')
+    with open('tests/cat.jpg', 'rb') as fd:
+        cat = fd.read()
+    with open('tests/cat2.jpg', 'rb') as fd:
+        cat2 = fd.read()
+    rv = local_client.post(
+        '/image/upload/batch/1',
+        data={
+            'images': [(io.BytesIO(cat), 'cat.jpg'),
+                       (io.BytesIO(b'text'), 'notes.txt'),
+                       (io.BytesIO(cat2), 'cat2.jpg')]
+        },
+        headers={'Authorization': 'Bearer %s' % access_token})
+    assert '200 OK' == rv.status
+    results = rv.get_json()['results']
+    assert ['cat.jpg', 'notes.txt', 'cat2.jpg'] == [
+        result['name'] for result in results
+    ]
+    assert 'error' in results[1] and 'id' not in results[1]
+
+    with local_client.application.app_context():
+        for result, data in ((results[0], cat), (results[2], cat2)):
+            image = Image.query.get(result['id'])
+            assert image.image_name == result['name']
+            with open(image.image_storage_path, 'rb') as fd:
+                assert data == fd.read()
+    storage_path = os.path.join(Config.STATIC_STORAGE_DIR, '1')
+    assert 2 == len(stored_files(storage_path))
+
+    rv = local_client.post(
+        '/image/upload/batch/1',
+        data={'image': (io.BytesIO(cat), 'cat.jpg')},
+        headers={'Authorization': 'Bearer %s' % access_token})
+    assert '400 BAD REQUEST' == rv.status
+
+    access_token = successful_login(local_client, 'test_upload_user2',
+                                    'TestTest1')
+    rv = local_client.post(
+        '/image/upload/batch/1',
+        data={'images': [(io.BytesIO(cat), 'cat.jpg')]},
+        headers={'Authorization': 'Bearer %s' % access_token})
+    assert '401 UNAUTHORIZED' == rv.status
+    assert 2 == len(stored_files(storage_path))
+
+
+def test_shard_storage(local_client):
+    local_client.application.config['STORAGE_SHARD_LEVELS'] = 0
+    access_token = successful_login(local_client, 'test_upload_user1',
+                                    'TestTest1')
+    with open('tests/cat.jpg', 'rb') as cat:
+        data = cat.read()
+    rv = local_client.post(
+        '/image/upload/batch/1',
+        data={
+            'images': [(io.BytesIO(data), 'cat%d.jpg' % i) for i in range(3)]
+        },
+        headers={'Authorization': 'Bearer %s' % access_token})
+    assert '200 OK' == rv.status
+    storage_path = os.path.join(Config.STATIC_STORAGE_DIR, '1')
+    assert 3 == len(os.listdir(storage_path))
+
+    with local_client.application.app_context():
+        # Interrupted after moving a file, before committing its new path
+        image = Image.query.first()
+        file_name = os.path.basename(image.image_storage_path)
+        os.makedirs(os.path.join(storage_path, file_name[:2]))
+        os.rename(image.image_storage_path,
+                  os.path.join(storage_path, file_name[:2], file_name))
+
+        assert 3 == Image.shard_storage(1, 2)
+        assert 0 == Image.shard_storage(1, 2)
+        for image in Image.query:
+            file_name = os.path.basename(image.image_storage_path)
+            assert os.path.join(storage_path, file_name[:2],
+                                file_name) == image.image_storage_path
+            assert image.image_url.endswith('/1/%s/%s' % (file_name[:2],
+                                                          file_name))
+            assert filecmp.cmp('tests/cat.jpg', image.image_storage_path)
+    assert 3 == len(stored_files(storage_path))
@@ -0,0 +1,225 @@
+"""Module related to testing resumable uploads
+"""
+
+import filecmp
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+from instadam.app import create_app, db
+from instadam.config import Config
+from instadam.models.image import Image
+from instadam.models.project import Project
+from instadam.models.project_permission import AccessTypeEnum, ProjectPermission
+from instadam.models.upload_session import UploadSession
+from instadam.models.user import PrivilegesEnum, User
+from tests.conftest import TEST_MODE
+
+
+@pytest.fixture
+def local_client():
+    if os.path.isdir(Config.STATIC_STORAGE_DIR):
+        shutil.rmtree(Config.STATIC_STORAGE_DIR)
+    app = create_app(TEST_MODE)
+    with app.app_context():
+        db.reflect()
+        db.drop_all()
+        db.create_all()
+
+        user = User(
+            username='test_session_user1',
+            email='email1@test_session.com',
+            privileges=PrivilegesEnum.ADMIN)
+        user.set_password('TestTest1')
+        other = User(
+            username='test_session_user2',
+            email='email2@test_session.com',
+            privileges=PrivilegesEnum.ADMIN)
+        other.set_password('TestTest1')
+        db.session.add_all([user, other])
+        db.session.commit()
+
+        project = Project(project_name='test/session', created_by=user.id)
+        db.session.add(project)
+        db.session.commit()
+        for member in (user, other):
+            permission = ProjectPermission(
+                access_type=AccessTypeEnum.READ_WRITE)
+            member.project_permissions.append(permission)
+            project.permissions.append(permission)
+        db.session.commit()
+
+    client = app.test_client()
+    yield client
+
+
+def successful_login(client, username, password):
+    rv = client.post(
+        '/login', json={
+            'username': username,
+            'password': password
+        })
+    assert '201 CREATED' == rv.status
+    return rv.get_json()['access_token']
+
+
+def stored_files(directory):
+    return [
+        os.path.join(root, name) for root, _, names in os.walk(directory)
+        for name in names
+    ]
+
+
+def upload(client, token, file_name, data, chunk_size, size=None):
+    headers = {'Authorization': 'Bearer %s' % token}
+    rv = client.post(
+        '/image/upload/session/1',
+        json={
+            'file_name': file_name,
+            'size': size or len(data)
+        },
+        headers=headers)
+    assert '201 CREATED' == rv.status
+    session_id = rv.get_json()['session_id']
+    assert 0 == rv.get_json()['offset']
+    for offset in range(0, len(data), chunk_size):
+        rv = client.put(
+            '/image/upload/session/%s?offset=%d' % (session_id, offset),
+            data=data[offset:offset + chunk_size],
+            headers=headers)
+        assert '200 OK' == rv.status
+    return session_id
+
+
+def test_upload_session_image(local_client):
+    token = successful_login(local_client, 'test_session_user1', 'TestTest1')
+    headers = {'Authorization': 'Bearer %s' % token}
+    with open('tests/cat.jpg', 'rb') as fd:
+        data = fd.read()
+    session_id = upload(local_client, token, 'cat.jpg', data[:1000], 400,
+                        len(data))
+
+    # Resume after a dropped connection
+    rv = local_client.get(
+        '/image/upload/session/%s' % session_id, headers=headers)
+    assert 1000 == rv.get_json()['offset']
+    rv = local_client.post(
+        '/image/upload/session/%s/finalize' % session_id, headers=headers)
+    assert '409 CONFLICT' == rv.status
+    rv = local_client.put(
+        '/image/upload/session/%s?offset=500' % session_id,
+        data=data[500:],
+        headers=headers)
+    assert '409 CONFLICT' == rv.status
+    assert 1000 == rv.get_json()['offset']
+    rv = local_client.put(
+        '/image/upload/session/%s?offset=1000' % session_id,
+        data=data[1000:] + b'extra',
+        headers=headers)
+    assert '400 BAD REQUEST' == rv.status
+    rv = local_client.put(
+        '/image/upload/session/%s?offset=1000' % session_id,
+        data=data[1000:],
+        headers=headers)
+    assert len(data) == rv.get_json()['offset']
+
+    rv = local_client.post(
+        '/image/upload/session/%s/finalize' % session_id, headers=headers)
+    assert '200 OK' == rv.status
+    image_id = rv.get_json()['id']
+    with local_client.application.app_context():
+        image = Image.query.get(image_id)
+        assert 'cat.jpg' == image.image_name
+        assert filecmp.cmp('tests/cat.jpg', image.image_storage_path)
+        assert UploadSession.query.get(session_id) is None
+    storage_path = os.path.join(Config.STATIC_STORAGE_DIR, '1')
+    assert 1 == len(stored_files(storage_path))
+
+
+def test_upload_session_concurrent_finalize(local_client):
+    token = successful_login(local_client, 'test_session_user1', 'TestTest1')
+    with open('tests/cat.jpg', 'rb') as fd:
+        data = fd.read()
+    session_id = upload(local_client, token, 'cat.jpg', data, len(data))
+
+    results = []
+
+    def finalize():
+        rv = local_client.post(
+            '/image/upload/session/%s/finalize' % session_id,
+            headers={'Authorization': 'Bearer %s' % token})
+        results.append(rv.status)
+
+    with local_client.application.app_context():
+        # Another request finalizing the session holds its row
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        connection.execute(
+            UploadSession.__table__.select().where(
+                UploadSession.id == session_id).with_for_update())
+        thread = threading.Thread(target=finalize)
+        thread.start()
+        time.sleep(0.5)
+        connection.execute(UploadSession.__table__.delete().where(
+            UploadSession.id == session_id))
+        transaction.commit()
+        connection.close()
+        thread.join()
+    assert ['404 NOT FOUND'] == results
+
+
+def test_upload_session_zip(local_client):
+    token = successful_login(local_client, 'test_session_user1', 'TestTest1')
+    headers = {'Authorization': 'Bearer %s' % token}
+    with open('tests/test.zip', 'rb') as fd:
+        data = fd.read()
+    session_id = upload(local_client, token, 'test.zip', data, 1000)
+    rv = local_client.post(
+        '/image/upload/session/%s/finalize' % session_id, headers=headers)
+    assert '200 OK' == rv.status
+    assert 'job_id' in rv.get_json()
+
+    rv = local_client.get('/projects/1/images', headers=headers)
+    assert 2 == len(rv.get_json()['project_images'])
+
+
+def test_upload_session_fail(local_client):
+    token = successful_login(local_client, 'test_session_user1', 'TestTest1')
+    headers = {'Authorization': 'Bearer %s' % token}
+    rv = local_client.post(
+        '/image/upload/session/1',
+        json={
+            'file_name': 'notes.txt',
+            'size': 10
+        },
+        headers=headers)
+    assert '415 UNSUPPORTED MEDIA TYPE' == rv.status
+    rv = local_client.post(
+        '/image/upload/session/1',
+        json={
+            'file_name': 'cat.jpg',
+            'size': -1
+        },
+        headers=headers)
+    assert '400 BAD REQUEST' == rv.status
+
+    session_id = upload(local_client, token, 'cat.jpg', b'x' * 10, 5)
+    other_token = successful_login(local_client, 'test_session_user2',
+                                   'TestTest1')
+    rv = local_client.get(
+        '/image/upload/session/%s' % session_id,
+        headers={'Authorization': 'Bearer %s' % other_token})
+    assert '401 UNAUTHORIZED' == rv.status
+
+    rv = local_client.delete(
+        '/image/upload/session/%s' % session_id, headers=headers)
+    assert '200 OK' == rv.status
+    rv = local_client.get(
+        '/image/upload/session/%s' % session_id, headers=headers)
+    assert '404 NOT FOUND' == rv.status
+    upload_dir = os.path.join(Config.STATIC_STORAGE_DIR,
+                              Config.UPLOAD_DIR_NAME)
+    assert [] == os.listdir(upload_dir)
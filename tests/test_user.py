@@ -1,6 +1,8 @@
 """Module related to testing all endpoint functionality with the user model
 """
 
+from werkzeug.security import generate_password_hash
+
 from instadam.models.user import User
 
 
@@ -14,3 +16,22 @@ def test_verify_password(client):
     user.set_password('testasdfasdfasdf')
     assert not user.verify_password('asdf')
     assert user.verify_password('testasdfasdfasdf')
+
+
+def test_password_needs_rehash(client):
+    user = User(username='test_name', email='test@example.com')
+    user.password = generate_password_hash('testasdfasdfasdf',
+                                           'pbkdf2:sha1:1000')
+    assert user.password_needs_rehash()
+    assert user.verify_password('testasdfasdfasdf')
+    user.set_password('testasdfasdfasdf')
+    assert not user.password_needs_rehash()
+
+    # Stronger hashes are kept
+    iterations = int(user.password.split('$', 1)[0].rsplit(':', 1)[1])
+    user.password = generate_password_hash(
+        'testasdfasdfasdf', 'pbkdf2:sha256:%d' % (iterations + 1000))
+    assert not user.password_needs_rehash()
+    user.password = generate_password_hash(
+        'testasdfasdfasdf', 'pbkdf2:sha256:%d' % (iterations - 1))
+    assert user.password_needs_rehash()
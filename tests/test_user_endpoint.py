@@ -132,3 +132,36 @@ def test_change_info_auth_fail3(local_client):
         headers={'Authorization': 'Bearer %s' % token})
 
     assert '400 BAD REQUEST' == response.status
+
+
+def test_change_privilege_outdates_token(local_client):
+    annotator_token = successful_login(local_client, 'test_upload_annotator1',
+                                       'TestTest2')
+    response = local_client.get(
+        '/projects',
+        headers={'Authorization': 'Bearer %s' % annotator_token})
+    assert '200 OK' == response.status
+
+    admin_token = successful_login(local_client, 'test_upload_admin1',
+                                   'TestTest1')
+    response = local_client.put(
+        '/user/privilege/',
+        json={
+            'username': 'test_upload_annotator1',
+            'privilege': 'admin'
+        },
+        headers={'Authorization': 'Bearer %s' % admin_token})
+    assert '200 OK' == response.status
+
+    # Token issued before the privilege change has outdated claims
+    response = local_client.get(
+        '/projects',
+        headers={'Authorization': 'Bearer %s' % annotator_token})
+    assert '401 UNAUTHORIZED' == response.status
+
+    new_token = successful_login(local_client, 'test_upload_annotator1',
+                                 'TestTest2')
+    response = local_client.get(
+        '/users/search?q=test',
+        headers={'Authorization': 'Bearer %s' % new_token})
+    assert '200 OK' == response.status
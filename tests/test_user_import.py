@@ -0,0 +1,225 @@
+"""Module related to testing the bulk import of users
+"""
+
+import io
+import os
+
+import pytest
+
+from instadam.app import create_app, db
+from instadam.models.project import Project
+from instadam.models.project_permission import AccessTypeEnum, ProjectPermission
+from instadam.models.user import PrivilegesEnum, User
+from instadam.utils.password import _acquire_slot
+from instadam.utils.user_import import import_users
+from tests.conftest import TEST_MODE
+
+
+@pytest.fixture
+def local_client():
+    app = create_app(TEST_MODE)
+    with app.app_context():
+        db.reflect()
+        db.drop_all()
+        db.create_all()
+
+        admin = User(
+            username='test_import_admin',
+            email='admin@test_import.com',
+            privileges=PrivilegesEnum.ADMIN)
+        admin.set_password('TestTest1')
+        annotator = User(
+            username='test_import_annotator',
+            email='annotator@test_import.com',
+            privileges=PrivilegesEnum.ANNOTATOR)
+        annotator.set_password('TestTest2')
+        db.session.add(admin)
+        db.session.add(annotator)
+        db.session.commit()
+
+        project = Project(project_name='test_import', created_by=admin.id)
+        permission = ProjectPermission(access_type=AccessTypeEnum.READ_WRITE)
+        admin.project_permissions.append(permission)
+        project.permissions.append(permission)
+        db.session.add(project)
+        db.session.commit()
+
+    client = app.test_client()
+    yield client
+
+
+def successful_login(client, username, password):
+    rv = client.post(
+        '/login', json={
+            'username': username,
+            'password': password
+        })
+    assert '201 CREATED' == rv.status
+    return rv.get_json()['access_token']
+
+
+def test_import_users_json(local_client):
+    token = successful_login(local_client, 'test_import_admin', 'TestTest1')
+    users = [{
+        'username': 'imported%d' % i,
+        'email': 'imported%d@test_import.com' % i,
+        'password': 'Password%d' % i
+    } for i in range(5)]
+    rv = local_client.post(
+        '/users/import',
+        json={
+            'users': users,
+            'permissions': [{
+                'project_id': 1,
+                'access_type': 'r'
+            }]
+        },
+        headers={'Authorization': 'Bearer %s' % token})
+    assert '201 CREATED' == rv.status
+    assert len(rv.get_json()['usernames']) == 5
+
+    imported_token = successful_login(local_client, 'imported3', 'Password3')
+    rv = local_client.get(
+        '/project/1/labels',
+        headers={'Authorization': 'Bearer %s' % imported_token})
+    assert '200 OK' == rv.status
+
+
+def test_import_users_duplicate_grants(local_client):
+    token = successful_login(local_client, 'test_import_admin', 'TestTest1')
+    users = [{
+        'username': 'granted',
+        'email': 'granted@test_import.com',
+        'password': 'Password0'
+    }]
+    grant = {'project_id': 1, 'access_type': 'r'}
+    rv = local_client.post(
+        '/users/import',
+        json={
+            'users': users,
+            'permissions': [grant, {
+                'project_id': 1,
+                'access_type': 'rw'
+            }]
+        },
+        headers={'Authorization': 'Bearer %s' % token})
+    assert '400 BAD REQUEST' == rv.status
+    assert 'Conflicting access types' in rv.get_json()['msg']
+
+    rv = local_client.post(
+        '/users/import',
+        json={
+            'users': users,
+            'permissions': [grant, dict(grant, project_id='1')]
+        },
+        headers={'Authorization': 'Bearer %s' % token})
+    assert '201 CREATED' == rv.status
+    with local_client.application.app_context():
+        user = User.query.filter_by(username='granted').first()
+        assert 1 == len(user.project_permissions)
+
+
+def test_import_users_busy(local_client, tmp_path):
+    token = successful_login(local_client, 'test_import_admin', 'TestTest1')
+    app = local_client.application
+    app.config['PASSWORD_HASH_LOCK_DIR'] = str(tmp_path)
+    # Requests hash in the slots shared with the logins
+    held = [_acquire_slot(app.config['PASSWORD_HASH_SLOTS'], str(tmp_path), 0)
+            for _ in range(app.config['PASSWORD_HASH_SLOTS'])]
+    try:
+        rv = local_client.post(
+            '/users/import',
+            json={
+                'users': [{
+                    'username': 'busy',
+                    'email': 'busy@test_import.com',
+                    'password': 'Password0'
+                }]
+            },
+            headers={'Authorization': 'Bearer %s' % token})
+        assert '503 SERVICE UNAVAILABLE' == rv.status
+    finally:
+        for fd in held:
+            os.close(fd)
+        app.config['PASSWORD_HASH_LOCK_DIR'] = None
+    with app.app_context():
+        assert User.query.filter_by(username='busy').first() is None
+
+
+def test_import_users_processes(local_client):
+    records = [{
+        'username': 'processed%d' % i,
+        'email': 'processed%d@test_import.com' % i,
+        'password': 'Password%d' % i
+    } for i in range(3)]
+    with local_client.application.app_context():
+        assert 3 == len(import_users(records, [(1, 'rw')], 2))
+        for record in records:
+            user = User.query.filter_by(username=record['username']).first()
+            assert user.verify_password(record['password'])
+            permission, = user.project_permissions
+            assert 1 == permission.project_id
+            assert AccessTypeEnum.READ_WRITE == permission.access_type
+
+
+def test_import_users_csv(local_client):
+    token = successful_login(local_client, 'test_import_admin', 'TestTest1')
+    csv_file = io.BytesIO(b'username,email,password,privilege\n'
+                          b'csv1,csv1@test_import.com,Password1,admin\n'
+                          b'csv2,csv2@test_import.com,Password2,\n')
+    rv = local_client.post(
+        '/users/import',
+        data={'users': (csv_file, 'users.csv')},
+        headers={'Authorization': 'Bearer %s' % token})
+    assert '201 CREATED' == rv.status
+
+    with local_client.application.app_context():
+        assert User.query.filter_by(
+            username='csv1').first().privileges == PrivilegesEnum.ADMIN
+        assert User.query.filter_by(
+            username='csv2').first().privileges == PrivilegesEnum.ANNOTATOR
+
+
+test_data = [
+    ([{
+        'username': 'bad',
+        'email': 'bad@test_import.com',
+        'password': 'password'
+    }], '400 BAD REQUEST'),
+    ([{
+        'username': 'test_import_annotator',
+        'email': 'new@test_import.com',
+        'password': 'Password0'
+    }], '400 BAD REQUEST'),
+    ([{
+        'username': 'dup',
+        'email': 'dup@test_import.com',
+        'password': 'Password0'
+    }, {
+        'username': 'dup',
+        'email': 'dup2@test_import.com',
+        'password': 'Password0'
+    }], '400 BAD REQUEST'),
+]
+
+
+@pytest.mark.parametrize('users, expected', test_data)
+def test_import_users_invalid(users, expected, local_client):
+    token = successful_login(local_client, 'test_import_admin', 'TestTest1')
+    rv = local_client.post(
+        '/users/import',
+        json={'users': users},
+        headers={'Authorization': 'Bearer %s' % token})
+    assert expected == rv.status
+    with local_client.application.app_context():
+        assert User.query.count() == 2
+
+
+def test_import_users_not_admin(local_client):
+    token = successful_login(local_client, 'test_import_annotator',
+                             'TestTest2')
+    rv = local_client.post(
+        '/users/import',
+        json={'users': []},
+        headers={'Authorization': 'Bearer %s' % token})
+    assert '401 UNAUTHORIZED' == rv.status
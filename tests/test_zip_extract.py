@@ -0,0 +1,61 @@
+"""Module related to testing the extraction of uploaded zip files
+"""
+
+import hashlib
+import os
+import zipfile
+
+import pytest
+
+from instadam.utils.zip_extract import unzip_process
+
+
+@pytest.fixture
+def archive(tmp_path):
+    zip_path = str(tmp_path / 'archive.zip')
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zip_file:
+        for i in range(10):
+            zip_file.writestr('%d.png' % i, b'%d' % i * 100)
+    with open(zip_path, 'rb') as fd:
+        data = fd.read()
+    # Corrupt the data of the last member
+    with open(zip_path, 'wb') as fd:
+        fd.write(data.replace(b'9' * 100, b'8' * 100))
+    return zip_path
+
+
+@pytest.mark.parametrize('processes', [1, 3])
+def test_unzip_process(archive, tmp_path, processes):
+    output_dir = tmp_path / ('output%d' % processes)
+    output_dir.mkdir()
+    members = [('%d.png' % i, str(output_dir / str(i))) for i in range(10)]
+    members.append(('missing.png', str(output_dir / 'missing')))
+
+    results = list(
+        unzip_process(archive, members, 7, processes, batch_size=3))
+    assert [name for name, _ in members] == [name for name, _, _ in results]
+    errors = {name: error for name, error, _ in results if error}
+    assert ['9.png', 'missing.png'] == sorted(errors)
+    for i in range(9):
+        with open(str(output_dir / str(i)), 'rb') as fd:
+            assert b'%d' % i * 100 == fd.read()
+    assert not os.path.exists(str(output_dir / '9'))
+
+
+def test_unzip_process_bad_zip(tmp_path):
+    zip_path = str(tmp_path / 'bad.zip')
+    with open(zip_path, 'wb') as fd:
+        fd.write(b'not a zip file')
+    members = [('%d.png' % i, str(tmp_path / str(i))) for i in range(10)]
+    with pytest.raises(zipfile.BadZipFile):
+        list(unzip_process(zip_path, members, 7, 3, batch_size=3))
+
+
+def test_unzip_process_digest(archive, tmp_path):
+    members = [('%d.png' % i, str(tmp_path / str(i))) for i in range(10)]
+    results = list(unzip_process(archive, members, 7, digest=True))
+    for i, (name, error, digest) in enumerate(results[:9]):
+        assert error is None
+        assert hashlib.sha256(b'%d' % i * 100).hexdigest() == digest
+    assert results[9][1] is not None
+    assert results[9][2] is None
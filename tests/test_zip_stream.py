@@ -0,0 +1,80 @@
+"""Module related to testing the sequential extraction of zip archives
+"""
+
+import io
+import zipfile
+
+import pytest
+
+from instadam.utils.zip_stream import (ZipStreamError, ZipStreamUnsupported,
+                                       iter_zip_members)
+
+
+class UnseekableStream(io.RawIOBase):
+    """Output without tell and seek, which makes zipfile write data
+    descriptors"""
+
+    def __init__(self):
+        self.data = b''
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data += bytes(b)
+        return len(b)
+
+
+def make_zip(members, compression=zipfile.ZIP_DEFLATED, seekable=True):
+    fd = io.BytesIO() if seekable else UnseekableStream()
+    with zipfile.ZipFile(fd, 'w', compression) as zip_file:
+        for name, data in members:
+            zip_file.writestr(name, data)
+    return fd.getvalue() if seekable else fd.data
+
+
+def extract(archive, chunk_size=7):
+    extracted = []
+    for member in iter_zip_members(io.BytesIO(archive), chunk_size):
+        if member.name.endswith('.skip'):
+            continue
+        fd = io.BytesIO()
+        member.copy_to(fd)
+        extracted.append((member.name, fd.getvalue()))
+    return extracted
+
+
+MEMBERS = [('a.png', b'a' * 100 + b'xyz'), ('b.skip', b'b' * 50),
+           ('dir/c.jpg', bytes(range(256)) * 4)]
+EXPECTED = [MEMBERS[0], MEMBERS[2]]
+
+
+def test_stream_deflated():
+    assert extract(make_zip(MEMBERS)) == EXPECTED
+
+
+def test_stream_stored():
+    assert extract(make_zip(MEMBERS, zipfile.ZIP_STORED)) == EXPECTED
+
+
+def test_stream_data_descriptor():
+    archive = make_zip(MEMBERS, seekable=False)
+    assert extract(archive) == EXPECTED
+    assert extract(archive, chunk_size=4096) == EXPECTED
+
+
+def test_stream_unsupported():
+    archive = make_zip(MEMBERS, zipfile.ZIP_STORED, seekable=False)
+    with pytest.raises(ZipStreamUnsupported):
+        extract(archive)
+
+
+def test_stream_corrupted():
+    archive = make_zip(MEMBERS, zipfile.ZIP_STORED)
+    corrupted = archive.replace(b'xyz', b'xyw')
+    with pytest.raises(ZipStreamError):
+        extract(corrupted)
+    with pytest.raises(ZipStreamError):
+        extract(archive[:120])
+    with pytest.raises(ZipStreamError):
+        extract(b'not a zip file')